@@ -0,0 +1,336 @@
+"""
+batch_crawl.py
+ファイル (または標準入力) の URL リストをプールのブラウザでまとめて描画するバッチジョブ。
+- URL は 1 件ずつ読む (.txt … 1 行 1 URL / .csv … url 列 (無ければ先頭列) / .jsonl … "url" キー)。
+  入力全体をメモリに載せないので、10 万件以上のリストでも使用量は一定。壊れた JSONL の行は飛ばして数える
+- window 件ずつ arun_many に渡す。1 つの window がタブを 1 枚借り、同時に走る window は
+  セマフォで concurrency 個まで (既定はプールのタブ数 = contexts × tabs)。終わった window から
+  次の window を入れるので、入力が残っている間はタブが空かない
+- arun_many の結果は並び順ではなく URL で対応付ける (結果が返らなかった URL も失敗行として残す)
+- 行は ResultSink で逐次書き出し、一定間隔で 進捗 / スループット / 残り時間の目安 を表示
+
+    python -m crawl_cli batch urls.txt --out batch_results/urls.csv
+    zcat urls.jsonl.gz | python -m crawl_cli batch - --input-format jsonl --window 16
+"""
+
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+from collections import defaultdict, deque
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import AsyncExitStack
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+from typing import TextIO
+
+from crawl4ai import CacheMode, CrawlerRunConfig, CrawlResult, SemaphoreDispatcher
+
+from browser_pool import BROWSER_ERRORS, BrowserPool, close_pool, get_pool
+from host_health import classify_error, short_error
+from metrics import dispatch_ms, metrics
+from page_store import PageStore
+from parquet_sink import ParquetStream
+from render_profiles import ProfileRouter, parse_profile_paths
+from result_sink import CsvWriter, ResultSink
+from url_index import canonicalize
+
+TS = datetime.now().strftime("%Y%m%d_%H%M%S")
+OUTPUT_DIR = Path(os.getenv("OUTPUT_DIR", "batch_results"))
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "csv")        # csv / parquet / both
+PARQUET_DIR = Path(os.getenv("PARQUET_DIR", OUTPUT_DIR / "parquet"))
+
+# 1 回の arun_many に渡す URL 数と、同時に走らせる window 数 (0 はプールのタブ数)
+BATCH_WINDOW = int(os.getenv("BATCH_WINDOW", "8"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "0"))
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", "10"))
+
+BATCH_FIELDS = [
+    "url", "success", "status_code", "final_url", "title", "markdown_len",
+    "error", "error_class", "fetch_ms", "profile", "blocked", "blocked_bytes",
+]
+
+
+# ---------- 入力 ----------
+def read_urls(
+    source: TextIO,
+    fmt: str = "txt",
+    on_skip: Callable[[int, str], None] | None = None,
+) -> Iterator[str]:
+    """source から URL を 1 件ずつ (空行と # で始まる行は飛ばす)。
+    読めない JSONL の行は止まらずに飛ばし、on_skip(行番号, 理由) で知らせる"""
+    if fmt == "csv":
+        reader = csv.reader(source)
+        header = next(reader, [])
+        column = header.index("url") if "url" in header else 0
+        if column == 0 and header and "://" in header[0]:
+            yield header[0]                  # ヘッダー無しの CSV
+        for row in reader:
+            if len(row) > column and row[column].strip():
+                yield row[column].strip()
+    elif fmt == "jsonl":
+        for lineno, line in enumerate(source, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                if on_skip:
+                    on_skip(lineno, f"JSON として読めない: {e}")
+                continue
+            url = item.get("url") if isinstance(item, dict) else item
+            if isinstance(url, str) and url.strip():
+                yield url.strip()
+            elif url and on_skip:
+                on_skip(lineno, f"url が文字列でない: {url!r}"[:200])
+    else:
+        for line in source:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+
+
+def input_format(path: str) -> str:
+    suffix = Path(path).suffix.lower()
+    return {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}.get(suffix, "txt")
+
+
+def count_lines(path: Path, chunk: int = 1 << 20) -> int:
+    """残り時間の目安用に行数だけ数える (空行やヘッダーも含むのでおおよそ)"""
+    n = 0
+    with path.open("rb") as f:
+        while block := f.read(chunk):
+            n += block.count(b"\n")
+    return n
+
+
+# ---------- 進捗 ----------
+class Progress:
+    """完了件数から スループット (直近の移動平均) と 残り時間 を出す"""
+    def __init__(self, total: int | None = None, interval: float = 10.0, out: TextIO = sys.stderr) -> None:
+        self.total = total
+        self.interval = interval
+        self.out = out
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0                     # 入力で読めなかった行
+        self.started = self._last_t = time.perf_counter()
+        self._last_done = 0
+        self.rate = 0.0                      # pages/s
+
+    def update(self, success: bool) -> None:
+        self.done += 1
+        self.failed += not success
+        now = time.perf_counter()
+        if now - self._last_t >= self.interval:
+            recent = (self.done - self._last_done) / (now - self._last_t)
+            self.rate = recent if not self.rate else 0.7 * self.rate + 0.3 * recent
+            self._last_t, self._last_done = now, self.done
+            print(self.line(), file=self.out, flush=True)
+
+    def skip(self, lineno: int, reason: str) -> None:
+        self.skipped += 1
+        metrics.inc("batch_input_skipped_total")
+        if self.skipped <= 10:               # 全部出すと埋もれるので最初の数件だけ
+            print(f"⚠ 入力 {lineno} 行目を飛ばしました: {reason}", file=self.out, flush=True)
+
+    def eta(self) -> float | None:
+        if not self.total or not self.rate:
+            return None
+        return max(0, self.total - self.done) / self.rate
+
+    def line(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        done = f"{self.done:,}" + (f"/{self.total:,} ({self.done / self.total:.1%})" if self.total else "")
+        rate = self.rate or (self.done / elapsed if elapsed else 0.0)
+        eta = self.eta()
+        return (f"… {done} 件 / 失敗 {self.failed:,} / {rate:.1f} pages/s / 経過 {elapsed:,.0f}s"
+                + (f" / 残り 約 {eta:,.0f}s" if eta is not None else "")
+                + (f" / 入力で飛ばした行 {self.skipped:,}" if self.skipped else ""))
+
+
+# ---------- 実行 ----------
+def match_results(urls: list[str], results: Iterable[CrawlResult]) -> Iterator[tuple[str, CrawlResult | None]]:
+    """結果を並び順ではなく (正規化した) URL で対応付ける。同じ URL が複数あれば出てきた順に
+    (正規化できない URL はそのままの文字列で)"""
+    by_url: dict[str, deque] = defaultdict(deque)
+    for result in results:
+        by_url[canonicalize(result.url) or result.url].append(result)
+    for url in urls:
+        queue = by_url.get(canonicalize(url) or url)
+        yield url, (queue.popleft() if queue else None)
+
+
+class BatchRunner:
+    def __init__(
+        self,
+        sink: ResultSink,
+        *,
+        pool: BrowserPool,
+        config: CrawlerRunConfig | None = None,
+        router: ProfileRouter | None = None,
+        window: int = 8,
+        concurrency: int = 0,
+        progress: Progress | None = None,
+        pages: ResultSink | None = None,
+    ) -> None:
+        self.sink = sink
+        self.pool = pool
+        self.config = config or CrawlerRunConfig(cache_mode=CacheMode.BYPASS, verbose=False)
+        self.router = router
+        self.window = window
+        self.concurrency = concurrency or pool.capacity
+        self.progress = progress or Progress()
+        self.pages = pages
+
+    async def run(self, urls: Iterable[str]) -> None:
+        """urls を window ずつ (描画プロファイルが同じもの同士で) arun_many に流す"""
+        slots = asyncio.Semaphore(self.concurrency)
+        running: set[asyncio.Task] = set()
+        errors: list[BaseException] = []
+
+        def done(task: asyncio.Task) -> None:
+            running.discard(task)
+            slots.release()
+            # URL ごとの失敗は _window が失敗行にする。ここに来るのは書き出しの失敗などで、続けても行が欠ける
+            if not task.cancelled() and task.exception() is not None:
+                errors.append(task.exception())
+
+        async def submit(window: list[str]) -> None:
+            await slots.acquire()                # 空いている枠が無ければ入力の読み込みも止まる
+            if errors:
+                raise errors[0]
+            task = asyncio.create_task(self._window(window))
+            running.add(task)
+            task.add_done_callback(done)
+
+        it = iter(urls)
+        buffers: dict[object, list[str]] = defaultdict(list)
+        try:
+            # 標準入力の読み込みでイベントループを止めないよう、読み込みはスレッドで
+            while chunk := await asyncio.to_thread(list, islice(it, self.window)):
+                for url in chunk:
+                    key = self.router.profile_for(url) if self.router else None
+                    buffers[key].append(url)
+                    if len(buffers[key]) >= self.window:
+                        await submit(buffers.pop(key))
+            for window in buffers.values():
+                await submit(window)
+            while running:
+                await asyncio.gather(*running, return_exceptions=True)
+            if errors:
+                raise errors[0]
+        finally:
+            for task in running:
+                task.cancel()
+
+    async def _window(self, urls: list[str]) -> None:
+        profile = self.router.profile_for(urls[0]) if self.router else None
+        config = profile.run_config(self.config) if profile else self.config
+        results: list[CrawlResult] = []
+        error = ""
+        try:
+            async with self.pool.lease(len(urls)) as crawler:
+                # 1 window = 1 タブなので window の中は 1 件ずつ (同時に描画するのは全体で concurrency 枚)
+                results = await crawler.arun_many(
+                    urls=urls, config=config, dispatcher=SemaphoreDispatcher(semaphore_count=1))
+        except BROWSER_ERRORS as e:              # ブラウザが落ちた等は window の全 URL を失敗行に
+            error = f"{e.__class__.__name__}: {e}"
+        # 書き出しの失敗はここでは握りつぶさない (run() が送出する)
+        for url, result in match_results(urls, results):
+            await self._emit(url, result, error or "結果が返らなかった")
+
+    async def _emit(self, url: str, result: CrawlResult | None, error: str) -> None:
+        fetch_ms = dispatch_ms(result) if result is not None else None
+        stats = self.router.pop_stats(url, fetch_ms) if self.router else {}
+        if result is None:
+            row = {"url": url, "success": False, "error": short_error(error),
+                   "error_class": classify_error(error)}
+        else:
+            markdown = result.markdown.raw_markdown if result.success and result.markdown else ""
+            row = {
+                "url": url,
+                "success": result.success,
+                "status_code": result.status_code,
+                "final_url": result.redirected_url if result.redirected_url not in (None, url) else "",
+                "title": (result.metadata or {}).get("title") or "",
+                "markdown_len": len(markdown),
+                "error": short_error(result.error_message),
+                "error_class": classify_error(result.error_message, result.status_code),
+                "fetch_ms": fetch_ms,
+            }
+            if self.pages is not None and result.success:
+                await self.pages.put({"url": url, "html": result.html, "markdown": markdown,
+                                      "status_code": result.status_code})
+        row.update(stats)
+        await self.sink.put(row)
+        metrics.inc("batch_pages_total", success=row["success"])
+        self.progress.update(row["success"])
+
+
+async def main(
+    source: str,
+    *,
+    out: Path | None = None,
+    fmt: str | None = None,
+    limit: int = 0,
+    pages_dir: Path | None = None,
+) -> None:
+    """source (ファイルのパスか "-") の URL をクロールする。window / concurrency は BATCH_* から"""
+    out = out or OUTPUT_DIR / f"batch_{TS}.csv"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    writers = []
+    if OUTPUT_FORMAT in ("csv", "both"):
+        writers.append(CsvWriter(out, BATCH_FIELDS))
+    if OUTPUT_FORMAT in ("parquet", "both"):
+        writers.append(ParquetStream(PARQUET_DIR, "batch_output", TS))
+
+    fmt = fmt or ("txt" if source == "-" else input_format(source))
+    total = None
+    if source != "-":
+        total = count_lines(Path(source)) - (1 if fmt == "csv" else 0)
+    if limit:
+        total = min(total, limit) if total is not None else limit
+
+    # 全部 full なら route を張らない
+    default, paths = os.getenv("RENDER_PROFILE", "full"), parse_profile_paths(os.getenv("RENDER_PROFILE_PATHS", ""))
+    router = ProfileRouter(default, paths) if default != "full" or any(n != "full" for n in paths.values()) else None
+    pool = get_pool(hooks={"before_goto": router.before_goto} if router else None)
+    progress = Progress(total, PROGRESS_INTERVAL)
+
+    try:
+        async with AsyncExitStack() as stack:
+            stream = sys.stdin if source == "-" else stack.enter_context(
+                await asyncio.to_thread(Path(source).open, newline="", encoding="utf-8"))
+            sink = await stack.enter_async_context(ResultSink(*writers))
+            pages = None
+            if pages_dir:
+                # 本文は大きいのでキューは短めに
+                pages = await stack.enter_async_context(
+                    ResultSink(PageStore(pages_dir), max_queue=256, batch=64))
+            await pool.warmup()
+            runner = BatchRunner(sink, pool=pool, router=router, window=BATCH_WINDOW,
+                                 concurrency=BATCH_CONCURRENCY, progress=progress, pages=pages)
+            urls = read_urls(stream, fmt, on_skip=progress.skip)
+            await runner.run(islice(urls, limit) if limit else urls)
+    finally:
+        await close_pool()
+
+    print(progress.line(), file=sys.stderr)
+    print(f"✓ {out if OUTPUT_FORMAT != 'parquet' else PARQUET_DIR / 'batch_output'}"
+          f"（{progress.done:,} 件 / 失敗 {progress.failed:,}"
+          + (f" / 入力で飛ばした行 {progress.skipped:,}" if progress.skipped else "") + "）")
+    if router:
+        for name, n, avg_ms, blocked, blocked_bytes, _saved in router.summary():
+            print(f"✓ 描画 {name}: {n} ページ / 平均 {avg_ms:.0f} ms / 止めたリクエスト {blocked}"
+                  f"（推定 {blocked_bytes / 1e6:.1f} MB）")
+
+
+if __name__ == "__main__":
+    # 引数は crawl_cli でまとめて解釈する (python -m crawl_cli batch と同じ)
+    from crawl_cli.cli import main as cli
+
+    sys.exit(cli(["batch", *sys.argv[1:]]))
@@ -0,0 +1,317 @@
+"""
+bench_crawl.py
+ローカルに合成サイトを立て、intra_crawler.py をサブプロセスで走らせて速度を測るベンチマーク。
+ネットワークは不要 (JS 専用ページの描画にはローカルの Playwright / Chromium を使う)。
+
+    python bench_crawl.py --pages 500 --fanout 5 --js 0.05 --label baseline
+    python bench_crawl.py --env HYBRID_FETCH=1 --env SCHEDULER=1 --label hybrid
+    python bench_crawl.py --compare bench_results/xxx_baseline.json
+
+合成サイト
+- ページ数 / 深さ / 子ページ数 (fan-out)
+- 添付 (PDF) リンクを持つページ、リダイレクト (302 を redirect_hops 回) 経由のリンク
+- 応答を slow_ms 遅らせるページ、本文とリンクを JS で組み立てるページ
+測定値 (--repeat 回の実行ごと)
+- pages/sec             … site_structure.csv の行数 / 実行時間
+- fetch_ms p50/p95/p99  … site_structure.csv の fetch_ms 列
+- peak RSS / CPU 時間   … os.wait4 で得たクローラープロセス (と回収済みの子プロセス) の値
+- フェーズ別            … intra_crawler.py が書く run_stats.json
+結果は JSON (既定 bench_results/<時刻>_<label>.json) に保存し、版ごとの比較に使う。
+"""
+
+import argparse
+import csv
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
+
+HERE = Path(__file__).resolve().parent
+RESULTS_DIR = HERE / "bench_results"
+
+FILLER = "これはベンチマーク用の合成ページです。本文テキストとして十分な長さを持たせています。" * 8
+PDF_BYTES = b"%PDF-1.4\n" + b"0" * 4096 + b"\n%%EOF\n"
+
+
+@dataclass
+class SiteSpec:
+    pages: int = 300
+    depth: int = 5
+    fanout: int = 5
+    attachments: float = 0.1     # 添付リンクを持つページの割合
+    redirects: float = 0.05      # リダイレクト経由でリンクされる子ページの割合
+    redirect_hops: int = 2
+    slow: float = 0.02           # 応答が遅いページの割合
+    slow_ms: int = 500
+    js: float = 0.05             # JS で描画しないと中身が無いページの割合
+    seed: int = 0
+
+
+class SyntheticSite:
+    """SiteSpec から決定的に生成するページ木 (パス → 子ページへの href)"""
+    def __init__(self, spec: SiteSpec) -> None:
+        rnd = random.Random(spec.seed)
+        self.spec = spec
+        self.links: dict[str, list[str]] = {"/": []}
+        queue = deque([("/", 0)])
+        n = 1
+        while queue and n < spec.pages:
+            path, depth = queue.popleft()
+            if depth >= spec.depth:
+                continue
+            for _ in range(spec.fanout):
+                if n >= spec.pages:
+                    break
+                child = f"{path.rstrip('/')}/p{n}"
+                n += 1
+                self.links[child] = []
+                href = child
+                if rnd.random() < spec.redirects:
+                    href = f"/go/{spec.redirect_hops}{child}"
+                self.links[path].append(href)
+                queue.append((child, depth + 1))
+
+        self.slow = {p for p in self.links if rnd.random() < spec.slow}
+        self.js = {p for p in self.links if p != "/" and rnd.random() < spec.js}
+        self.files = {
+            p: f"/files{p.rstrip('/')}_doc.pdf" for p in self.links if rnd.random() < spec.attachments
+        }
+        self.requests = 0                # reset_requests() 以降に受けたリクエスト数
+        self._lock = threading.Lock()
+
+    def reset_requests(self) -> None:
+        with self._lock:
+            self.requests = 0
+
+    def count_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def html(self, path: str) -> str:
+        items = [f'<li><a href="{h}">{h}</a></li>' for h in self.links[path]]
+        if path in self.files:
+            items.append(f'<li><a href="{self.files[path]}">資料</a></li>')
+        content = f"<h1>{path}</h1><p>{FILLER}</p><ul>{''.join(items)}</ul>"
+        if path in self.js:
+            content = (
+                '<div id="app"></div><noscript>Please enable JavaScript to view this page.</noscript>'
+                f"<script>document.getElementById('app').innerHTML = {json.dumps(content)};</script>"
+            )
+        return f"<!DOCTYPE html><html><head><title>{path}</title></head><body>{content}</body></html>"
+
+
+def make_handler(site: SyntheticSite):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args) -> None:
+            pass
+
+        def do_HEAD(self) -> None:
+            self.respond(head=True)
+
+        def do_GET(self) -> None:
+            self.respond()
+
+        def respond(self, head: bool = False) -> None:
+            site.count_request()
+            path = urlsplit(self.path).path
+            if path.startswith("/go/"):
+                _, _, hops, rest = path.split("/", 3)
+                hops = int(hops)
+                target = f"/go/{hops - 1}/{rest}" if hops > 1 else f"/{rest}"
+                self.send(302, b"", head=head, location=target)
+            elif path.startswith("/files/"):
+                self.send(200, PDF_BYTES, "application/pdf", head=head)
+            elif path in site.links:
+                if path in site.slow:
+                    time.sleep(site.spec.slow_ms / 1000)
+                self.send(200, site.html(path).encode(), head=head)
+            else:
+                self.send(404, b"not found", "text/plain", head=head)
+
+        def send(self, status: int, body: bytes, ctype: str = "text/html; charset=utf-8",
+                 head: bool = False, location: str | None = None) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            if location:
+                self.send_header("Location", location)
+            self.end_headers()
+            if not head:
+                self.wfile.write(body)
+
+    return Handler
+
+
+def serve(site: SyntheticSite) -> tuple[ThreadingHTTPServer, str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(site))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/"
+
+
+# ---------- 計測 ----------
+def percentile(sorted_values: list[float], q: float) -> float | None:
+    """最近順位法のパーセンタイル"""
+    if not sorted_values:
+        return None
+    i = max(0, math.ceil(q / 100 * len(sorted_values)) - 1)
+    return sorted_values[min(i, len(sorted_values) - 1)]
+
+
+def read_fetch_ms(site_csv: Path) -> list[float]:
+    if not site_csv.exists():
+        return []
+    with site_csv.open(newline="", encoding="utf-8") as f:
+        return sorted(float(r["fetch_ms"]) for r in csv.DictReader(f) if r.get("fetch_ms"))
+
+
+def run_once(site: SyntheticSite, base_url: str, env: dict[str, str], keep: bool) -> dict:
+    out = Path(tempfile.mkdtemp(prefix="bench_crawl_"))
+    child_env = {
+        **os.environ,
+        "ROOT_URL": base_url,
+        "OUTPUT_DIR": str(out),
+        "MAX_PAGES": str(site.spec.pages * 10),
+        **env,
+    }
+    site.reset_requests()
+    with (out / "crawl.log").open("wb") as log:
+        t0 = time.perf_counter()
+        proc = subprocess.Popen(
+            [sys.executable, str(HERE / "intra_crawler.py")],
+            cwd=HERE, env=child_env, stdout=log, stderr=subprocess.STDOUT,
+        )
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - t0
+    proc.returncode = os.waitstatus_to_exitcode(status)
+
+    stats_path = out / "run_stats.json"
+    stats = json.loads(stats_path.read_text(encoding="utf-8")) if stats_path.exists() else {}
+    latencies = read_fetch_ms(out / "site_structure.csv")
+    rows = stats.get("rows", 0)
+    run = {
+        "exit_code": proc.returncode,
+        "elapsed_s": round(elapsed, 3),
+        "rows": rows,
+        "pages_per_sec": round(rows / elapsed, 2) if elapsed else None,
+        "fetch_ms": {f"p{q}": percentile(latencies, q) for q in (50, 95, 99)},
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),          # Linux は KB 単位
+        "cpu_user_s": round(usage.ru_utime, 3),
+        "cpu_sys_s": round(usage.ru_stime, 3),
+        "server_requests": site.requests,
+        "engines": stats.get("engines", {}),
+        "phases": stats.get("phases", {}),
+    }
+    if proc.returncode != 0:
+        tail = (out / "crawl.log").read_text(encoding="utf-8", errors="replace")[-2000:]
+        print(f"✗ intra_crawler.py が終了コード {proc.returncode} で終了\n{tail}")
+    if keep:
+        run["output_dir"] = str(out)
+    else:
+        shutil.rmtree(out, ignore_errors=True)
+    return run
+
+
+def summarize(runs: list[dict]) -> dict:
+    """複数回実行した値の中央値"""
+    def med(values):
+        values = [v for v in values if v is not None]
+        return statistics.median(values) if values else None
+
+    return {
+        "elapsed_s": med(r["elapsed_s"] for r in runs),
+        "pages_per_sec": med(r["pages_per_sec"] for r in runs),
+        "fetch_ms": {k: med(r["fetch_ms"][k] for r in runs) for k in ("p50", "p95", "p99")},
+        "peak_rss_mb": med(r["peak_rss_mb"] for r in runs),
+        "cpu_s": med(r["cpu_user_s"] + r["cpu_sys_s"] for r in runs),
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old: dict, new: dict) -> None:
+    """2 つの結果 JSON の中央値を並べて表示 (比は new / old)"""
+    a, b = old["median"], new["median"]
+    pairs = [(k, a[k], b[k]) for k in ("elapsed_s", "pages_per_sec", "peak_rss_mb", "cpu_s")]
+    pairs += [(f"fetch_ms.{k}", a["fetch_ms"][k], b["fetch_ms"][k]) for k in ("p50", "p95", "p99")]
+    print(f"{'':18s} {old.get('commit') or '?':>10s} {new.get('commit') or '?':>10s}   比")
+    for name, x, y in pairs:
+        ratio = f"{y / x:5.2f}" if x and y is not None else "  -"
+        print(f"{name:18s} {x if x is not None else '-':>10} {y if y is not None else '-':>10}   {ratio}")
+
+
+def main() -> None:
+    defaults = SiteSpec()
+    parser = argparse.ArgumentParser(description="合成サイトに対する intra_crawler.py のベンチマーク")
+    for name, value in asdict(defaults).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="intra_crawler.py に渡す環境変数 (複数可)")
+    parser.add_argument("--label", default="default")
+    parser.add_argument("--out", type=Path, help="結果 JSON の保存先")
+    parser.add_argument("--keep", action="store_true", help="クロール出力を残す")
+    parser.add_argument("--compare", type=Path, help="前回の結果 JSON と比較する")
+    args = parser.parse_args()
+
+    spec = SiteSpec(**{k: getattr(args, k) for k in asdict(defaults)})
+    env = dict(e.split("=", 1) for e in args.env)
+    site = SyntheticSite(spec)
+    server, base_url = serve(site)
+    print(f"合成サイト {len(site.links)} ページ → {base_url}")
+
+    try:
+        runs = []
+        for i in range(args.repeat):
+            run = run_once(site, base_url, env, args.keep)
+            runs.append(run)
+            print(f"[{i + 1}/{args.repeat}] {run['rows']} 行 / {run['elapsed_s']}s"
+                  f" / {run['pages_per_sec']} pages/s / RSS {run['peak_rss_mb']} MB")
+    finally:
+        server.shutdown()
+
+    result = {
+        "label": args.label,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "site": {**asdict(spec), "generated_pages": len(site.links)},
+        "env": env,
+        "runs": runs,
+        "median": summarize(runs),
+    }
+    out = args.out or RESULTS_DIR / f"{datetime.now():%Y%m%d_%H%M%S}_{args.label}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"✓ {out}")
+
+    if args.compare:
+        compare(json.loads(args.compare.read_text(encoding="utf-8")), result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+browser_pool.py
+プロセス内で共有する長寿命のブラウザプール。
+- contexts 個の AsyncWebCrawler (= ブラウザ / コンテキスト) を持ち、それぞれ tabs 枚まで同時に貸し出す
+  (arun_many で複数ページを描く時は lease(tabs=n) で n 枚借り、dispatcher(n) で同時描画数を n に抑える)
+- 起動直後に raw: ページを 1 枚描画してウォームアップ
+- recycle_after ページ描画したら、使用中のタブが無くなった時点で作り直す (メモリ肥大対策)
+- health_interval 秒ごとに空いているブラウザを raw: ページで検査し、応答しなければ作り直す
+- hooks ({フック名: 関数}) は起動・作り直しのたびに各ブラウザへ登録する (描画プロファイルの before_goto など)
+スクリプト内のクロール処理は `async with get_pool().lease() as crawler:` で借りて使う。
+"""
+
+import asyncio
+import os
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager, suppress
+
+from crawl4ai import (
+    AsyncWebCrawler,
+    BrowserConfig,
+    CacheMode,
+    CrawlerRunConfig,
+    SemaphoreDispatcher,
+)
+from playwright.async_api import Error as PlaywrightError
+
+PROBE_URL = "raw:<html><body>ok</body></html>"
+# ブラウザが落ちた / 応答しない時に起動・描画・終了で上がる例外 (ここに無いものはバグとして送出)
+BROWSER_ERRORS = (PlaywrightError, OSError, RuntimeError, ValueError, asyncio.TimeoutError)
+_probe_cfg: CrawlerRunConfig | None = None     # 作るのに 30ms ほどかかるので最初の検査の時に
+
+
+def probe_config() -> CrawlerRunConfig:
+    global _probe_cfg
+    if _probe_cfg is None:
+        _probe_cfg = CrawlerRunConfig(cache_mode=CacheMode.BYPASS, verbose=False)
+    return _probe_cfg
+
+
+class _Slot:
+    def __init__(self, index: int, tabs: int) -> None:
+        self.index = index
+        self.crawler: AsyncWebCrawler | None = None
+        self.tabs = asyncio.Semaphore(tabs)
+        self.multi = asyncio.Lock()      # 複数枚の貸し出しは 1 つずつ (取り合いで詰まらないよう)
+        self.lock = asyncio.Lock()
+        self.queued = 0                  # 貸し出し待ち + 使用中 (振り分け用)
+        self.active = 0                  # 使用中のタブ数
+        self.pages = 0
+        self.restarts = 0
+        self.draining = False
+
+
+class BrowserPool:
+    def __init__(
+        self,
+        *,
+        contexts: int = 1,
+        tabs: int = 4,
+        recycle_after: int = 500,
+        health_interval: float = 60.0,
+        health_timeout: float = 15.0,
+        browser_config: BrowserConfig | None = None,
+        hooks: dict[str, Callable] | None = None,
+    ) -> None:
+        self.slots = [_Slot(i, tabs) for i in range(contexts)]
+        self.tabs = tabs                         # 1 回の貸し出しで借りられる最大枚数
+        self.capacity = contexts * tabs          # 同時に描画できるページ数
+        self.recycle_after = recycle_after
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.browser_config = browser_config
+        self.hooks = hooks or {}
+        self._health_task: asyncio.Task | None = None
+
+    # ---------- 起動 / 停止 ----------
+    async def _probe(self, crawler: AsyncWebCrawler) -> bool:
+        try:
+            result = await asyncio.wait_for(
+                crawler.arun(PROBE_URL, config=probe_config()), self.health_timeout)
+            return bool(result.success)
+        except BROWSER_ERRORS:
+            return False
+
+    async def _start(self, slot: _Slot) -> None:
+        crawler = AsyncWebCrawler(config=self.browser_config)
+        for hook_type, hook in self.hooks.items():
+            crawler.crawler_strategy.set_hook(hook_type, hook)
+        await crawler.start()
+        await self._probe(crawler)                 # ウォームアップ
+        slot.crawler, slot.pages, slot.draining = crawler, 0, False
+
+    async def _ensure_started(self, slot: _Slot) -> AsyncWebCrawler:
+        async with slot.lock:
+            if slot.crawler is None:
+                await self._start(slot)
+            if self._health_task is None and self.health_interval > 0:
+                self._health_task = asyncio.create_task(self._health_loop())
+            return slot.crawler
+
+    async def _recycle(self, slot: _Slot) -> None:
+        async with slot.lock:
+            # lock を待つ間に別の貸し出しが使い始めた / 先に作り直された なら何もしない
+            if slot.draining and slot.active == 0:
+                await self._restart(slot)
+
+    async def _restart(self, slot: _Slot) -> None:
+        """slot.lock を持った状態で呼ぶ"""
+        old, slot.crawler = slot.crawler, None
+        if old is not None:
+            with suppress(*BROWSER_ERRORS):        # 落ちたブラウザの後始末は失敗してもよい
+                await old.close()
+        slot.restarts += 1
+        await self._start(slot)
+
+    async def warmup(self) -> None:
+        """全スロットのブラウザを先に起動しておく"""
+        await asyncio.gather(*(self._ensure_started(s) for s in self.slots))
+
+    async def close(self) -> None:
+        if self._health_task:
+            self._health_task.cancel()
+            self._health_task = None
+        for slot in self.slots:
+            async with slot.lock:
+                if slot.crawler is not None:
+                    await slot.crawler.close()
+                    slot.crawler = None
+
+    def add_hooks(self, hooks: dict[str, Callable]) -> None:
+        """フックを追加し、起動済みのブラウザにも登録する (同じ名前に別の関数はエラー)"""
+        for hook_type, hook in hooks.items():
+            current = self.hooks.get(hook_type)
+            if current is not None and current != hook:
+                raise ValueError(f"フック {hook_type} は既に別の関数で登録されています")
+        self.hooks = {**self.hooks, **hooks}
+        for slot in self.slots:
+            if slot.crawler is not None:
+                for hook_type, hook in hooks.items():
+                    slot.crawler.crawler_strategy.set_hook(hook_type, hook)
+
+    # ---------- 貸し出し ----------
+    def dispatcher(self, tabs: int) -> SemaphoreDispatcher:
+        """lease(tabs=n) で借りた n 枚の中で arun_many を回すためのディスパッチャ"""
+        return SemaphoreDispatcher(semaphore_count=tabs)
+
+    @asynccontextmanager
+    async def lease(self, pages: int = 1, tabs: int = 1) -> AsyncIterator[AsyncWebCrawler]:
+        """空きタブの多いスロットから tabs 枚 (最大 self.tabs) 借りる。pages はこの貸し出しで描画する見込みのページ数"""
+        tabs = max(1, min(tabs, self.tabs))
+        slot = min(self.slots, key=lambda s: (s.draining, s.queued))
+        slot.queued += tabs
+        acquired = 0
+        try:
+            if tabs == 1:
+                await slot.tabs.acquire()
+                acquired = 1
+            else:
+                async with slot.multi:
+                    for _ in range(tabs):
+                        await slot.tabs.acquire()
+                        acquired += 1
+            crawler = await self._ensure_started(slot)
+            slot.active += tabs
+            try:
+                yield crawler
+            finally:
+                slot.active -= tabs
+                slot.pages += pages
+                if slot.pages >= self.recycle_after:
+                    slot.draining = True
+                # 使用中のタブが無くなったら作り直す (待っている貸し出しは作り直し後のブラウザを使う)
+                if slot.draining and slot.active == 0:
+                    await self._recycle(slot)
+        finally:
+            for _ in range(acquired):
+                slot.tabs.release()
+            slot.queued -= tabs
+
+    # ---------- ヘルスチェック ----------
+    async def health_check(self) -> None:
+        for slot in self.slots:
+            if slot.crawler is None or slot.active or slot.draining:
+                continue
+            # 検査中は新しい貸し出しを他のスロットへ回し、このスロットの貸し出しは lock で待たせる
+            # (検査の途中で貸し出したブラウザを作り直してしまわないように)
+            slot.draining = True
+            try:
+                async with slot.lock:
+                    if slot.crawler is not None and slot.active == 0 and not await self._probe(slot.crawler):
+                        await self._restart(slot)
+            finally:
+                slot.draining = False
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.health_check()
+
+    def stats(self) -> list[tuple[int, int, int]]:
+        """(スロット番号, 現ブラウザでの描画数, 作り直し回数)"""
+        return [(s.index, s.pages, s.restarts) for s in self.slots]
+
+
+_POOL: BrowserPool | None = None
+
+
+def get_pool(
+    browser_config: BrowserConfig | None = None,
+    hooks: dict[str, Callable] | None = None,
+) -> BrowserPool:
+    """プロセス共有のプール (設定は POOL_CONTEXTS / POOL_TABS / POOL_RECYCLE_AFTER)。
+    既にあるプールに hooks を渡すと追加で登録する。browser_config は最初の呼び出しでしか決められない"""
+    global _POOL
+    if _POOL is None:
+        _POOL = BrowserPool(
+            contexts=int(os.getenv("POOL_CONTEXTS", "1")),
+            tabs=int(os.getenv("POOL_TABS", "4")),
+            recycle_after=int(os.getenv("POOL_RECYCLE_AFTER", "500")),
+            browser_config=browser_config,
+            hooks=hooks,
+        )
+        return _POOL
+    if browser_config is not None and browser_config is not _POOL.browser_config:
+        raise ValueError("プールは既に別の browser_config で作られています (close_pool() してから作り直す)")
+    if hooks:
+        _POOL.add_hooks(hooks)
+    return _POOL
+
+
+async def close_pool() -> None:
+    global _POOL
+    if _POOL is not None:
+        await _POOL.close()
+        _POOL = None
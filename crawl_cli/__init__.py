@@ -0,0 +1,16 @@
+"""
+crawl_cli
+クローラーの入口をまとめたコマンド。
+
+    python -m crawl_cli site --root https://intra.example.com/ --max-pages 5000   # intra_crawler (サイト全体)
+    python -m crawl_cli site --resume
+    python -m crawl_cli batch urls.txt --window 16                                # batch_crawl (URL リスト)
+    python -m crawl_cli markdown https://example.com/ --fit                       # tutorial_basic_crawl (Markdown)
+    python -m crawl_cli startup site                                              # import の内訳 (-X importtime)
+
+- 引数の解釈と設定はここで 1 回だけ行い、各モジュールが import 時に読む環境変数へ反映してから import する
+  (-e KEY=VALUE でそれ以外の設定も渡せる)
+- crawl4ai などの重いモジュールはサブコマンドが決まってから読み込む (--help や引数の誤りでは読まない)
+- --timing (または CRAWL_TIMING=1) で プロセス開始から取得開始までの時間と、その内訳 (インタープリタ・
+  import・設定) を標準エラーへ出す
+"""
@@ -0,0 +1,147 @@
+"""
+引数の解釈とサブコマンドの実行。ここでは標準ライブラリしか import しない
+(クローラー本体のモジュールは設定を環境変数へ反映してから、run_* の中で import する)。
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+from crawl_cli.startup import StartupTimer, importtime
+
+# サブコマンド → 実体のモジュール (startup の対象にもなる)
+MODULES = {"site": "intra_crawler", "batch": "batch_crawl", "markdown": "tutorial_basic_crawl"}
+
+# サブコマンド → {オプションの dest: 環境変数} (各モジュールは import 時に os.getenv で読む)
+ENV_OPTIONS: dict[str, dict[str, str]] = {}
+
+
+def env_option(parser: argparse.ArgumentParser, *flags: str, env: str, **kwargs) -> None:
+    """指定された時だけ環境変数 env に入れるオプション (既定値はモジュール側の os.getenv に任せる)"""
+    action = parser.add_argument(*flags, default=None, **kwargs)
+    ENV_OPTIONS.setdefault(parser.prog.rsplit(" ", 1)[-1], {})[action.dest] = env
+    action.help = f"{action.help or ''} (${env})".strip()
+
+
+def common_options(parser: argparse.ArgumentParser, top: bool) -> None:
+    """-e / --timing はサブコマンドの前後どちらに書いてもよい。
+    -e は前後で別の dest に集め、apply_env で前 → 後の順に反映する (同じ dest だと後ろが前を上書きする)"""
+    parser.add_argument("-e", "--env", action="append", metavar="KEY=VALUE",
+                        dest="env" if top else "sub_env", default=[] if top else argparse.SUPPRESS,
+                        help="その他の設定 (環境変数として渡す。複数可)")
+    parser.add_argument("--timing", action="store_true",
+                        default=os.getenv("CRAWL_TIMING") == "1" if top else argparse.SUPPRESS,
+                        help="プロセス開始から取得開始までの時間と内訳を表示 ($CRAWL_TIMING=1)")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m crawl_cli", description="クローラーの入口")
+    common_options(parser, top=True)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("site", help="サイト全体をクロール (intra_crawler)")
+    common_options(p, top=False)
+    env_option(p, "--root", env="ROOT_URL", help="起点の URL")
+    env_option(p, "--max-pages", env="MAX_PAGES", type=int)
+    env_option(p, "--max-depth", env="MAX_DEPTH", type=int)
+    env_option(p, "--output", env="OUTPUT_DIR", type=Path, help="出力先")
+    env_option(p, "--format", env="OUTPUT_FORMAT", choices=["csv", "parquet", "both"])
+    env_option(p, "--mode", env="CRAWL_MODE", choices=["bfs", "best_first"])
+    p.add_argument("--resume", action="store_true", help="状態 DB に残った前回の続きから再開")
+
+    p = sub.add_parser("batch", help="URL リストをクロール (batch_crawl)")
+    common_options(p, top=False)
+    p.add_argument("input", help="URL リスト (.txt / .csv / .jsonl)。- で標準入力")
+    p.add_argument("--input-format", choices=["txt", "csv", "jsonl"], help="既定は拡張子から (標準入力は txt)")
+    p.add_argument("--out", type=Path, help="結果の CSV (既定 <出力先>/batch_<実行時刻>.csv)")
+    env_option(p, "--output", env="OUTPUT_DIR", type=Path, help="出力先")
+    env_option(p, "--format", env="OUTPUT_FORMAT", choices=["csv", "parquet", "both"])
+    env_option(p, "--window", env="BATCH_WINDOW", type=int, help="1 回の arun_many に渡す URL 数")
+    env_option(p, "--concurrency", env="BATCH_CONCURRENCY", type=int,
+               help="同時に走らせる window 数 (0 はプールのタブ数)")
+    env_option(p, "--profile", env="RENDER_PROFILE", choices=["full", "text", "links-only"], help="描画プロファイル")
+    p.add_argument("--limit", type=int, default=0, help="先頭の N 件だけ")
+    p.add_argument("--pages", type=Path, help="本文 (HTML / Markdown) をこのディレクトリへアーカイブ")
+
+    p = sub.add_parser("markdown", help="URL の Markdown を取り出す (tutorial_basic_crawl)")
+    common_options(p, top=False)
+    p.add_argument("urls", nargs="*", help="対象の URL (省略するとサンプルの 3 処理)")
+    p.add_argument("--fit", action="store_true", help="PruningContentFilter で枝刈りした fit_markdown を使う")
+    env_option(p, "--output", env="OUTPUT_ROOT", type=Path, help="出力先")
+    env_option(p, "--profile", env="RENDER_PROFILE", choices=["full", "text", "links-only"], help="描画プロファイル")
+
+    p = sub.add_parser("startup", help="サブコマンドの import の内訳 (python -X importtime)")
+    common_options(p, top=False)
+    p.add_argument("target", nargs="?", choices=sorted(MODULES), default="site")
+    p.add_argument("--top", type=int, default=15, help="累積時間の長い順に何件出すか")
+    return parser
+
+
+def apply_env(args: argparse.Namespace) -> None:
+    """設定を 1 回だけ環境変数へ反映 (モジュールの import より前に呼ぶ)"""
+    for item in [*args.env, *getattr(args, "sub_env", [])]:
+        key, sep, value = item.partition("=")
+        if not sep or not key:
+            raise SystemExit(f"-e は KEY=VALUE の形で指定してください: {item}")
+        os.environ[key] = value
+    for dest, env in ENV_OPTIONS.get(args.command, {}).items():
+        value = getattr(args, dest, None)
+        if value is not None:
+            os.environ[env] = str(value)
+
+
+# ---------- サブコマンド ----------
+def run_site(args: argparse.Namespace, timer: StartupTimer) -> None:
+    timer.import_module("crawl4ai")
+    intra_crawler = timer.import_module("intra_crawler")
+    asyncio.run(_started(intra_crawler.crawl(resume=args.resume), args, timer))
+
+
+def run_batch(args: argparse.Namespace, timer: StartupTimer) -> None:
+    timer.import_module("crawl4ai")
+    batch_crawl = timer.import_module("batch_crawl")
+    asyncio.run(_started(batch_crawl.main(
+        args.input, out=args.out, fmt=args.input_format, limit=args.limit, pages_dir=args.pages,
+    ), args, timer))
+
+
+def run_markdown(args: argparse.Namespace, timer: StartupTimer) -> None:
+    timer.import_module("crawl4ai")
+    tutorial = timer.import_module("tutorial_basic_crawl")
+    asyncio.run(_started(tutorial.main(args.urls, fit=args.fit), args, timer))
+
+
+def run_startup(args: argparse.Namespace, timer: StartupTimer) -> None:
+    """対象モジュールを新しいプロセスで import し、累積時間の長いものから表示"""
+    module = MODULES[args.target]
+    rows = importtime(module, cwd=str(Path(__file__).resolve().parent.parent))
+    total = next((r.cumulative_us for r in rows if r.module == module and r.level == 0), 0)
+    print(f"import {module}: {total / 1000:.0f} ms（累積の長い順。self は子の import を除いた時間）")
+    for r in sorted(rows, key=lambda r: r.cumulative_us, reverse=True)[:args.top]:
+        print(f"  {r.cumulative_us / 1000:8.1f} ms  self {r.self_us / 1000:7.1f} ms  {'  ' * r.level}{r.module}")
+
+
+async def _started(coro, args: argparse.Namespace, timer: StartupTimer):
+    """イベントループが回り始めた = 取得を始められる時点で起動時間を出してから本体へ"""
+    timer.mark("イベントループ")
+    if args.timing:
+        print(timer.report(), file=sys.stderr, flush=True)
+    return await coro
+
+
+COMMANDS = {"site": run_site, "batch": run_batch, "markdown": run_markdown, "startup": run_startup}
+
+
+def main(argv: list[str] | None = None) -> int:
+    timer = StartupTimer()
+    args = build_parser().parse_args(argv)
+    apply_env(args)
+    timer.mark("設定")
+    try:
+        COMMANDS[args.command](args, timer)
+    except KeyboardInterrupt:
+        print("中断しました (site は --resume で続きから再開できます)", file=sys.stderr)
+        return 130
+    return 0
@@ -0,0 +1,81 @@
+"""
+起動時間の計測。
+- StartupTimer … プロセス開始 (Linux は /proc から) → CLI 開始 → 各 import → 取得開始 の区切りを記録し、
+                 report() で 1 行にまとめる
+- importtime() … 別プロセスで `python -X importtime -c "import <module>"` を実行し、
+                 累積時間の長い import を返す (python -m crawl_cli startup)
+"""
+
+import importlib
+import os
+import subprocess
+import sys
+import time
+from types import ModuleType
+from typing import NamedTuple
+
+
+def process_age() -> float | None:
+    """プロセス開始からの経過秒 (/proc が無い環境では None)。分解能はクロックティック (通常 10ms)"""
+    try:
+        with open("/proc/self/stat") as f:
+            stat = f.read()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except OSError:
+        return None
+    # comm に空白や括弧が入っていてもよいように最後の ')' から数える (starttime は 22 番目)
+    start_ticks = int(stat.rsplit(")", 1)[1].split()[19])
+    return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+
+
+class StartupTimer:
+    def __init__(self) -> None:
+        self.t0 = time.perf_counter()
+        self.before = process_age()                  # CLI に入るまで (インタープリタの起動など)
+        self.marks: list[tuple[str, float]] = []     # (区切り名, 前の区切りからの秒)
+        self._last = self.t0
+
+    def mark(self, name: str) -> None:
+        now = time.perf_counter()
+        self.marks.append((name, now - self._last))
+        self._last = now
+
+    def import_module(self, name: str) -> ModuleType:
+        """import にかかった時間を "import <name>" として記録 (読み込み済みなら 0 に近い)"""
+        module = importlib.import_module(name)
+        self.mark(f"import {name}")
+        return module
+
+    def total(self) -> float:
+        return (self.before or 0.0) + (self._last - self.t0)
+
+    def report(self) -> str:
+        parts = [f"起動前 {self.before * 1000:.0f}"] if self.before is not None else []
+        parts += [f"{name} {seconds * 1000:.0f}" for name, seconds in self.marks]
+        return f"⏱ 取得開始まで {self.total() * 1000:.0f} ms（" + " / ".join(parts) + " ms）"
+
+
+class ImportTime(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+    level: int                                       # import の入れ子の深さ (0 が最上位)
+
+
+def importtime(module: str, cwd: str | None = None) -> list[ImportTime]:
+    """module を新しいプロセスで import し、-X importtime の出力を読む"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd, capture_output=True, text=True, check=False,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else module)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative, name = line[len("import time:"):].split("|", 2)
+        level = (len(name) - len(name.lstrip()) - 1) // 2     # 名前の前の空白 1 つ + 深さごとに 2 つ
+        rows.append(ImportTime(name.strip(), int(self_us), int(cumulative), level))
+    return rows
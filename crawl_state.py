@@ -0,0 +1,200 @@
+"""
+crawl_state.py
+長時間クロールの中断・再開用の状態ストア (SQLite / WAL モード)。
+- frontier … 未取得 + 取得中の URL (深さ・親 URL 付き。best-first ではスコアと発見理由も)
+- visited  … キュー投入済み URL と深さ (メモリ上は url_index.SeenSet の 64bit 指紋だけ)
+- results  … 書き出し済みの行 (site_structure / file_links 1 ページ分)
+メモリ上の状態を checkpoint_every 件ごとにまとめてコミットする。
+best_first=True では frontier をスコアの高い順に取り出すヒープで持つ (pop_best)。
+"""
+
+import heapq
+import itertools
+import json
+import sqlite3
+from collections import deque
+from collections.abc import Iterator
+from datetime import datetime
+from pathlib import Path
+from typing import NamedTuple
+
+from url_index import SeenSet
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta     (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS visited  (url TEXT PRIMARY KEY, depth INTEGER);
+CREATE TABLE IF NOT EXISTS frontier (seq INTEGER PRIMARY KEY, url TEXT UNIQUE,
+                                     depth INTEGER, parent TEXT,
+                                     score REAL DEFAULT 0, reason TEXT DEFAULT '');
+CREATE TABLE IF NOT EXISTS results  (seq INTEGER PRIMARY KEY, url TEXT UNIQUE,
+                                     success INTEGER, row TEXT, files TEXT);
+"""
+
+
+class FrontierItem(NamedTuple):
+    url: str
+    depth: int
+    parent: str | None
+    score: float = 0.0
+    reason: str = ""
+
+
+def add_columns(db: sqlite3.Connection, table: str, columns: dict[str, str]) -> None:
+    """古い状態 DB に後から増えた列を足す"""
+    have = {row[1] for row in db.execute(f"PRAGMA table_info({table})")}
+    for name, decl in columns.items():
+        if name not in have:
+            db.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+
+class CrawlStateStore:
+    """frontier / visited / results をメモリに持ち、一定間隔で SQLite へ書き出す"""
+    def __init__(
+        self,
+        path: Path,
+        checkpoint_every: int = 50,
+        bloom_capacity: int = 0,
+        best_first: bool = False,
+    ) -> None:
+        self.path = path
+        self.checkpoint_every = checkpoint_every
+        self.bloom_capacity = bloom_capacity
+        self.best_first = best_first
+        # BFS は深さ順の deque、best-first は (-score, 積んだ順, item) のヒープ
+        self.frontier: deque[FrontierItem] | list[tuple[float, int, FrontierItem]] = (
+            [] if best_first else deque())
+        self._order = itertools.count()
+        self.in_flight: dict[str, FrontierItem] = {}
+        self.visited = SeenSet(bloom_capacity=bloom_capacity)
+        self.pages_crawled = 0
+        self.resumed = False
+        self.run_ts = datetime.now().strftime("%Y%m%d_%H%M%S")   # 再開時は最初の実行の時刻を引き継ぐ
+
+        # 前回チェックポイント以降の差分
+        self._new_visited: list[tuple[str, int]] = []
+        self._new_frontier: list[FrontierItem] = []
+        self._done: list[str] = []
+        self._new_results: list[tuple[str, int, str, str]] = []
+
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        add_columns(self.db, "frontier", {"score": "REAL DEFAULT 0", "reason": "TEXT DEFAULT ''"})
+
+    # ---------- 開始 / 再開 ----------
+    def open(self, root_url: str, resume: bool = False) -> bool:
+        """resume=True かつ同じ ROOT_URL の状態が残っていれば読み込む。戻り値は再開したか"""
+        row = self.db.execute("SELECT value FROM meta WHERE key='root_url'").fetchone()
+        if resume and row and row[0] == root_url:
+            self.visited = SeenSet(bloom_capacity=self.bloom_capacity)
+            for (url,) in self.db.execute("SELECT url FROM visited"):
+                self.visited.add(url)
+            items = [FrontierItem(*r) for r in self.db.execute(
+                "SELECT url, depth, parent, score, reason FROM frontier ORDER BY depth, seq")]
+            if self.best_first:
+                self.frontier = [(-item.score, next(self._order), item) for item in items]
+                heapq.heapify(self.frontier)
+            else:
+                self.frontier = deque(items)
+            self.pages_crawled = self.db.execute(
+                "SELECT count(*) FROM results WHERE success=1").fetchone()[0]
+            self.resumed = True
+            row = self.db.execute("SELECT value FROM meta WHERE key='run_ts'").fetchone()
+            self.run_ts = row[0] if row else self.run_ts
+            return True
+
+        with self.db:
+            for table in ("meta", "visited", "frontier", "results"):
+                self.db.execute(f"DELETE FROM {table}")
+            self.db.execute("INSERT INTO meta VALUES ('root_url', ?)", (root_url,))
+            self.db.execute("INSERT INTO meta VALUES ('run_ts', ?)", (self.run_ts,))
+        return False
+
+    # ---------- frontier 操作 ----------
+    def seen(self, url: str) -> bool:
+        return url in self.visited
+
+    def push(
+        self,
+        url: str,
+        depth: int,
+        parent: str | None = None,
+        score: float = 0.0,
+        reason: str = "",
+    ) -> bool:
+        """未訪問ならキューに積んで True"""
+        if not self.visited.add(url):
+            return False
+        item = FrontierItem(url, depth, parent, score, reason)
+        if self.best_first:
+            heapq.heappush(self.frontier, (-score, next(self._order), item))
+        else:
+            self.frontier.append(item)
+        self._new_visited.append((url, depth))
+        self._new_frontier.append(item)
+        return True
+
+    def pop_level(self) -> list[FrontierItem]:
+        """先頭と同じ深さの URL をまとめて取り出す (取得中として保持)"""
+        if not self.frontier:
+            return []
+        depth = self.frontier[0].depth
+        level = []
+        while self.frontier and self.frontier[0].depth == depth:
+            item = self.frontier.popleft()
+            self.in_flight[item.url] = item
+            level.append(item)
+        return level
+
+    def pop_best(self, n: int) -> list[FrontierItem]:
+        """スコアの高い順に n 件取り出す (best_first=True のとき)"""
+        batch = []
+        while self.frontier and len(batch) < n:
+            item = heapq.heappop(self.frontier)[2]
+            self.in_flight[item.url] = item
+            batch.append(item)
+        return batch
+
+    async def wait_for_work(self) -> bool:
+        """frontier が空になった時に呼ばれる。単独実行ではこれ以上増えないので False"""
+        return False
+
+    # ---------- 結果の記録 ----------
+    def complete(self, url: str, row: dict, file_rows: list[dict]) -> None:
+        """1 ページ分の出力行を記録し、frontier から外す"""
+        self.in_flight.pop(url, None)
+        self._done.append(url)
+        self._new_results.append((
+            url, int(bool(row.get("success"))),
+            json.dumps(row, ensure_ascii=False),
+            json.dumps(file_rows, ensure_ascii=False),
+        ))
+        if row.get("success"):
+            self.pages_crawled += 1
+        if len(self._new_results) >= self.checkpoint_every:
+            self.checkpoint()
+
+    def iter_results(self) -> Iterator[tuple[dict, list[dict]]]:
+        """記録済みの (site 行, file 行リスト) を記録順に返す (再開時の CSV 再構築用)"""
+        for row, files in self.db.execute("SELECT row, files FROM results ORDER BY seq"):
+            yield json.loads(row), json.loads(files)
+
+    def checkpoint(self) -> None:
+        with self.db:
+            self.db.executemany("INSERT OR IGNORE INTO visited VALUES (?, ?)", self._new_visited)
+            self.db.executemany(
+                "INSERT OR IGNORE INTO frontier (url, depth, parent, score, reason) VALUES (?, ?, ?, ?, ?)",
+                self._new_frontier)
+            self.db.executemany("DELETE FROM frontier WHERE url = ?", ((u,) for u in self._done))
+            self.db.executemany(
+                "INSERT OR REPLACE INTO results (url, success, row, files) VALUES (?, ?, ?, ?)",
+                self._new_results)
+        self._new_visited.clear()
+        self._new_frontier.clear()
+        self._done.clear()
+        self._new_results.clear()
+
+    def close(self) -> None:
+        self.checkpoint()
+        self.db.close()
@@ -0,0 +1,180 @@
+"""
+fetch_engine.py
+まずコネクションプール付きの httpx で取得し、JS が必要そうなページだけ
+Playwright (AsyncWebCrawler) に回すためのフェッチ層。
+ブラウザへ回す条件
+- パスが BROWSER_PATHS のいずれかで始まる
+- HTML の本文テキストがほぼ空 (SPA の空シェル)
+- <noscript> に「JavaScript を有効に」系の案内がある
+HTML 以外 (FILE_EXTS の添付など) はヘッダだけ見て本文は読まない。
+parse_pool を渡すと、JS 要否判定とリンク抽出はワーカープロセスで行う。
+"""
+
+import asyncio
+from collections.abc import Iterable
+from typing import TYPE_CHECKING, Optional
+from urllib.parse import urlparse
+
+import httpx
+import lxml.etree
+import lxml.html
+from crawl4ai import CrawlResult
+from crawl4ai.utils import get_base_domain
+
+from metrics import metrics
+
+if TYPE_CHECKING:
+    from typing import Self
+
+    from parse_pool import ParsePool
+
+HTML_TYPES = ("text/html", "application/xhtml+xml")
+MAX_HTML_BYTES = 5 * 1024 * 1024
+
+
+def parse_html(html: str):
+    """lxml でパース (空文書は None)。encoding 宣言付きの XHTML は bytes で読み直す"""
+    if not html.strip():
+        return None
+    try:
+        return lxml.html.fromstring(html)
+    except ValueError:
+        return lxml.html.fromstring(html.encode("utf-8"))
+    except lxml.etree.ParserError:
+        return None
+
+
+def extract_links(html: str, base_url: str) -> dict:
+    """<a href> を絶対 URL にして internal / external に振り分ける
+    (crawl4ai と同じくサブドメインも internal 扱い。ポート付きのイントラ URL も判定できるよう host で比較)"""
+    links = {"internal": [], "external": []}
+    doc = parse_html(html)
+    if doc is None:
+        return links
+    # 絶対 URL にできない href (IPv6 の括弧が閉じていないなど) は属性ごと捨てる
+    doc.resolve_base_href(handle_failures="discard")
+    doc.make_links_absolute(base_url, resolve_base_href=False, handle_failures="discard")
+    base_domain = get_base_domain(base_url)
+    seen = set()
+    for a in doc.iter("a"):
+        href = (a.get("href") or "").strip()
+        if not href or href in seen or urlparse(href).scheme not in ("http", "https"):
+            continue
+        seen.add(href)
+        host = (urlparse(href).hostname or "").removeprefix("www.")
+        internal = host == base_domain or host.endswith("." + base_domain)
+        kind = "internal" if internal else "external"
+        links[kind].append({
+            "href": href,
+            "text": a.text_content().strip(),
+            "title": (a.get("title") or "").strip(),
+        })
+    return links
+
+
+def needs_browser(html: str, min_text_chars: int = 200) -> bool:
+    """静的 HTML だけでは中身が取れなさそうなら True"""
+    doc = parse_html(html)
+    if doc is None:
+        return True
+    for el in doc.iter("noscript"):
+        if "javascript" in el.text_content().lower():
+            return True
+    for el in doc.xpath("//script|//style|//noscript|//template"):
+        el.drop_tree()
+    body = doc.find("body")
+    text = (body if body is not None else doc).text_content()
+    return len(" ".join(text.split())) < min_text_chars
+
+
+class HybridFetcher:
+    """`fetch()` が CrawlResult を返せば HTTP で完結、None ならブラウザで描画する"""
+    def __init__(
+        self,
+        *,
+        browser_paths: Iterable[str] = (),
+        max_connections: int = 50,
+        max_keepalive: int = 20,
+        concurrency: int = 16,
+        timeout: float = 15.0,
+        min_text_chars: int = 200,
+        parse_pool: Optional["ParsePool"] = None,
+    ) -> None:
+        self.browser_paths = tuple(p for p in browser_paths if p)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+        )
+        self.timeout = timeout
+        self.min_text_chars = min_text_chars
+        self.parse_pool = parse_pool
+        self._sem = asyncio.Semaphore(concurrency)
+        self._client = None
+
+    async def __aenter__(self) -> "Self":
+        self._client = httpx.AsyncClient(
+            limits=self.limits, timeout=self.timeout, follow_redirects=True,
+        )
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self._client.aclose()
+
+    @staticmethod
+    async def _read_html(r: httpx.Response) -> bytes | None:
+        """本文を MAX_HTML_BYTES まで読む。超えると分かった時点 (Content-Length か受信中) で読むのをやめて None"""
+        length = r.headers.get("content-length", "")
+        if length.isdigit() and int(length) > MAX_HTML_BYTES:
+            return None
+        chunks, size = [], 0
+        try:
+            async for chunk in r.aiter_bytes():
+                size += len(chunk)
+                if size > MAX_HTML_BYTES:
+                    return None
+                chunks.append(chunk)
+        finally:
+            metrics.inc("bytes_total", size, engine="http")
+        return b"".join(chunks)
+
+    async def fetch(self, url: str) -> CrawlResult | None:
+        if urlparse(url).path.startswith(self.browser_paths):
+            return None
+        try:
+            async with self._sem, self._client.stream("GET", url) as r:
+                ctype = r.headers.get("content-type", "").split(";")[0].strip().lower()
+                is_html = ctype in HTML_TYPES
+                body = ""
+                if is_html:
+                    raw = await self._read_html(r)
+                    if raw is None:
+                        return None          # 大きすぎる HTML はブラウザへ
+                    body = raw.decode(r.encoding or "utf-8", errors="replace")
+        except httpx.HTTPError:
+            metrics.inc("fallbacks_total", reason="http_error")
+            return None                  # 通信エラーの判定・記録はブラウザ側に任せる
+
+        final_url = str(r.url)
+        with metrics.timer("parse", url):
+            if not is_html:
+                dynamic, links = False, {}
+            elif self.parse_pool:
+                dynamic, links = await self.parse_pool.analyze(body, final_url, self.min_text_chars)
+            else:
+                dynamic = needs_browser(body, self.min_text_chars)
+                links = {} if dynamic else extract_links(body, final_url)
+        if dynamic:
+            metrics.inc("fallbacks_total", reason="needs_browser")
+            return None
+
+        first = r.history[0] if r.history else r     # crawl4ai と同じく最初の応答のステータス
+        return CrawlResult(
+            url=url,
+            html=body,
+            success=True,
+            status_code=first.status_code,
+            links=links,
+            response_headers=dict(r.headers),
+            redirected_url=final_url if r.history else None,
+            metadata={"engine": "http", "content_type": ctype, "redirect_hops": len(r.history)},
+        )
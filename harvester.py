@@ -0,0 +1,307 @@
+"""
+harvester.py
+file_links.csv に出てくる添付ファイル (FILE_EXTS) をまとめてダウンロードするステージ。
+- 同じファイル URL は (正規化して) 1 回だけ取得
+- keep-alive 付きの httpx コネクションプールを 1 つ使い回し、全体 / ホスト単位の同時実行数を制限
+- 本文は chunk_size ずつファイルへ書き、メモリには溜めない (SHA-256 も書きながら計算)
+- 途中で切れたら <path>.part を残し、次の試行では Range (+ If-Range) で続きから取得
+- 前回取得済みのファイルは ETag / Last-Modified の条件付き GET で確かめ、304 なら取り直さない
+- 1 ファイルごとにサイズ・ハッシュ・Content-Type・所要時間を <dest>/harvest.sqlite と結果行に残す
+
+    python harvester.py crawl_results/file_links.csv --dest crawl_results/files
+"""
+
+import asyncio
+import csv
+import hashlib
+import re
+import sqlite3
+import time
+from collections import defaultdict
+from collections.abc import AsyncIterator, Iterable
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple
+from urllib.parse import unquote, urlsplit
+
+import httpx
+
+from metrics import metrics
+from url_index import canonicalize
+
+if TYPE_CHECKING:
+    from typing import Self
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    url           TEXT PRIMARY KEY,
+    path          TEXT,
+    size          INTEGER,
+    sha256        TEXT,
+    content_type  TEXT,
+    etag          TEXT,
+    last_modified TEXT,
+    fetched_at    REAL
+);
+"""
+HARVEST_FIELDS = [
+    "url", "path", "status", "http_status", "size", "sha256",
+    "content_type", "elapsed_ms", "error",
+]
+_UNSAFE = re.compile(r"[^\w.\-]+")
+
+
+class FileRecord(NamedTuple):
+    path: str
+    size: int
+    sha256: str
+    content_type: str
+    etag: str | None
+    last_modified: str | None
+
+
+def local_path(dest: Path, url: str) -> Path:
+    """<dest>/<host>/<パス>
+    - %2e%2e なども unquote してから . / .. を捨てる。それでも dest の外を指すなら ValueError
+    - クエリ付き、または . / .. を捨てたり安全な文字へ置き換えたりした URL は衝突しないよう短いハッシュを付ける
+      (a b.pdf と a_b.pdf、/%2e%2e/x.pdf と /x.pdf が同じ .part に書き込まないように)"""
+    parts = urlsplit(url)
+    decoded = [s for s in map(unquote, parts.path.split("/")) if s]
+    raw = [s for s in decoded if s not in (".", "..")]
+    segments = [_UNSAFE.sub("_", s) for s in raw]
+    host = _UNSAFE.sub("_", parts.netloc) or "_"
+    changed = segments != decoded or host != parts.netloc
+    name = segments.pop() if segments else "index"
+    if parts.query or changed:
+        stem, dot, ext = name.rpartition(".")
+        tag = hashlib.sha256(url.encode()).hexdigest()[:8]
+        name = f"{stem}_{tag}.{ext}" if dot else f"{name}_{tag}"
+    path = dest.joinpath(host, *segments, name)
+    if not path.resolve().is_relative_to(dest.resolve()):
+        raise ValueError(f"保存先が {dest} の外になります: {url}")
+    return path
+
+
+def read_file_links(path: Path) -> Iterable[str]:
+    """file_links.csv の file_url 列 (重複は harvest 側で除く)"""
+    with path.open(newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            if row.get("file_url"):
+                yield row["file_url"]
+
+
+class AttachmentHarvester:
+    """`async with AttachmentHarvester(dest) as h: async for row in h.harvest(urls): ...`"""
+    def __init__(
+        self,
+        dest: Path,
+        *,
+        concurrency: int = 8,
+        per_host: int = 4,
+        max_connections: int = 32,
+        timeout: float = 60.0,
+        chunk_size: int = 64 * 1024,
+        retries: int = 2,
+    ) -> None:
+        self.dest = dest
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_connections)
+        self.timeout = httpx.Timeout(timeout, connect=min(timeout, 10.0))
+        self._host_sem = defaultdict(lambda: asyncio.Semaphore(per_host))
+        self._client: httpx.AsyncClient | None = None
+        self.db: sqlite3.Connection | None = None
+        self.counts: dict[str, int] = defaultdict(int)
+        self._validators: dict[str, str] = {}     # 途中で切れた応答の ETag / Last-Modified (If-Range 用)
+
+    async def __aenter__(self) -> "Self":
+        self.dest.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.dest / "harvest.sqlite")
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        # 圧縮されるとバイト位置 (Range) と Content-Length が本文と合わなくなるので identity で
+        self._client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout, follow_redirects=True,
+                                         headers={"Accept-Encoding": "identity"})
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self._client.aclose()
+        self.db.commit()
+        self.db.close()
+
+    # ---------- 全体 ----------
+    async def harvest(self, urls: Iterable[str]) -> AsyncIterator[dict]:
+        """重複を除いた URL を concurrency 本のワーカーで取得し、終わった順に結果行を流す"""
+        queue: asyncio.Queue = asyncio.Queue(self.concurrency * 2)
+        results: asyncio.Queue = asyncio.Queue(self.concurrency * 2)
+
+        async def feed() -> None:
+            seen = set()
+            cancelled = False
+            try:
+                for raw in urls:
+                    url = canonicalize(raw)
+                    if url is None:              # 解釈できない URL は取得せずに失敗行だけ残す
+                        await results.put(self._error_row(raw, "InvalidURL: URL を解釈できません"))
+                    elif url not in seen:
+                        seen.add(url)
+                        await queue.put(url)
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            finally:
+                # 入力が途中で読めなくなっても終端は積む (積んだ分を取り終えてから harvest() が例外を送出)
+                if not cancelled:
+                    for _ in range(self.concurrency):
+                        await queue.put(None)
+
+        async def worker() -> None:
+            while (url := await queue.get()) is not None:
+                await results.put(await self.download(url))
+
+        feeder = asyncio.create_task(feed())
+        workers = {asyncio.create_task(worker()) for _ in range(self.concurrency)}
+        tasks = [feeder, *workers]
+        getter: asyncio.Future | None = None
+        try:
+            # 結果を待ちながらワーカーも見張る (ワーカーが例外で止まったら待ち続けずに送出)
+            while workers or not results.empty():
+                getter = asyncio.ensure_future(results.get())
+                done, _ = await asyncio.wait({getter, *workers}, return_when=asyncio.FIRST_COMPLETED)
+                for task in done - {getter}:
+                    workers.discard(task)
+                    task.result()
+                if getter.done():
+                    yield getter.result()
+                else:
+                    getter.cancel()
+            await feeder
+        finally:
+            if getter is not None:
+                getter.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    # ---------- 1 ファイル ----------
+    def _record(self, url: str) -> FileRecord | None:
+        row = self.db.execute(
+            "SELECT path, size, sha256, content_type, etag, last_modified FROM files WHERE url=?",
+            (url,)).fetchone()
+        return FileRecord(*row) if row else None
+
+    def _error_row(self, url: str, error: str) -> dict:
+        self.counts["error"] += 1
+        metrics.inc("harvest_files_total", status="error")
+        return {**dict.fromkeys(HARVEST_FIELDS, ""), "url": url, "status": "error", "error": error[:300]}
+
+    async def download(self, url: str) -> dict:
+        try:
+            path = local_path(self.dest, url)
+        except ValueError as e:
+            return self._error_row(url, f"{e.__class__.__name__}: {e}")
+        row = {"url": url, "path": str(path), "status": "error", "http_status": "",
+               "size": "", "sha256": "", "content_type": "", "elapsed_ms": "", "error": ""}
+        t0 = time.perf_counter()
+        async with self._host_sem[urlsplit(url).netloc]:
+            for attempt in range(self.retries + 1):
+                try:
+                    await self._fetch(url, path, row)
+                    row["error"] = ""
+                    break
+                except (httpx.HTTPError, OSError) as e:
+                    row["error"] = f"{e.__class__.__name__}: {e}"[:300]
+                    if attempt < self.retries:
+                        metrics.inc("retries_total", reason="harvest")
+                        await asyncio.sleep(2 ** attempt)
+                except (httpx.InvalidURL, httpx.StreamError, ValueError) as e:   # 取り直しても変わらない
+                    row["error"] = f"{e.__class__.__name__}: {e}"[:300]
+                    break
+        row["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        metrics.observe("harvest_seconds", time.perf_counter() - t0)
+        metrics.inc("harvest_files_total", status=row["status"])
+        self.counts[row["status"]] += 1
+        return row
+
+    async def _fetch(self, url: str, path: Path, row: dict) -> None:
+        record = self._record(url)
+        part = path.with_name(path.name + ".part")
+        headers = {}
+        if record and path.exists():
+            if record.etag:
+                headers["If-None-Match"] = record.etag
+            if record.last_modified:
+                headers["If-Modified-Since"] = record.last_modified
+        offset = part.stat().st_size if part.exists() else 0
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            validator = self._validators.get(url) or ((record.etag or record.last_modified) if record else None)
+            if validator:
+                headers["If-Range"] = validator   # 途中で変わっていたら 200 で全体が返る
+
+        async with self._client.stream("GET", url, headers=headers) as r:
+            row["http_status"] = r.status_code
+            if r.status_code == 304 and record:
+                row.update(status="unchanged", size=record.size, sha256=record.sha256,
+                           content_type=record.content_type)
+                return
+            if r.status_code == 416 and offset:  # .part が既に全体 (あるいは壊れている)
+                part.unlink()
+                raise httpx.HTTPStatusError("range not satisfiable", request=r.request, response=r)
+            r.raise_for_status()
+
+            resumed = r.status_code == 206 and offset > 0
+            validator = r.headers.get("etag") or r.headers.get("last-modified")
+            if validator:
+                self._validators[url] = validator
+            digest = hashlib.sha256()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if resumed:
+                with part.open("rb") as f:           # 続きから書く前に既存分をハッシュへ
+                    while chunk := f.read(self.chunk_size):
+                        digest.update(chunk)
+            size = offset if resumed else 0
+            with part.open("ab" if resumed else "wb") as f:
+                async for chunk in r.aiter_bytes(self.chunk_size):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+                    metrics.inc("bytes_total", len(chunk), engine="harvest")
+            expected = r.headers.get("content-length")
+            if expected is not None and size - (offset if resumed else 0) != int(expected):
+                raise httpx.ReadError(f"incomplete body ({size} bytes)", request=r.request)
+
+            part.replace(path)
+            self._validators.pop(url, None)
+            ctype = r.headers.get("content-type", "").split(";")[0].strip().lower()
+            row.update(status="resumed" if resumed else "downloaded", size=size,
+                       sha256=digest.hexdigest(), content_type=ctype)
+            self.db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, str(path), size, row["sha256"], ctype,
+                 r.headers.get("etag"), r.headers.get("last-modified"), time.time()))
+            self.db.commit()
+
+
+async def main(file_links: Path, dest: Path, concurrency: int, per_host: int) -> None:
+    from result_sink import CsvWriter, ResultSink
+
+    out = dest / "attachments.csv"
+    async with AttachmentHarvester(dest, concurrency=concurrency, per_host=per_host) as harvester, \
+            ResultSink(CsvWriter(out, HARVEST_FIELDS)) as sink:
+        async for row in harvester.harvest(read_file_links(file_links)):
+            await sink.put(row)
+    print(f"✓ attachments.csv → {out}  " + " / ".join(f"{k} {v}" for k, v in sorted(harvester.counts.items())))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="file_links.csv の添付ファイルを一括ダウンロード")
+    parser.add_argument("file_links", type=Path, help="intra_crawler の file_links.csv")
+    parser.add_argument("--dest", type=Path, default=Path("crawl_results/files"))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--per-host", type=int, default=4)
+    args = parser.parse_args()
+    asyncio.run(main(args.file_links, args.dest, args.concurrency, args.per_host))
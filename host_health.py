@@ -0,0 +1,277 @@
+"""
+host_health.py
+ホストの死活を先に確かめて、落ちているホストの URL にブラウザを使わないための仕組み。
+- classify_error() … エラーメッセージ / ステータスコードを分類 (dns / connect / timeout / tls /
+                     throttled / http_4xx / http_5xx / other)。RETRYABLE の分類だけ再試行する
+                     (メッセージは URL を含むので、net::ERR_* のコードか例外の型名・決まった文言だけを見る)
+- short_error()    … crawl4ai の複数行のエラー (トレースバック付き) から要点の 1 行を取り出す
+- HostHealth       … DNS 解決結果のキャッシュ (失敗も negative_ttl の間は覚える) と TCP 接続の事前確認、
+                     ホスト単位のサーキットブレーカー。接続系の失敗が failure_threshold 回続いたホストは
+                     cooldown 秒のあいだ遮断し、その間の URL は取得せずに失敗行 (engine=precheck) にする
+- RetryPolicy      … 再試行の回数と、上限付き指数バックオフ + full jitter の待ち時間
+
+    health = HostHealth()
+    failed = await health.precheck(url)      # 遮断中 / 名前解決できない / 接続できない なら失敗の CrawlResult
+    ...
+    error_class = health.observe(result)     # 取得結果でブレーカーを更新 (metadata["error_class"] も付ける)
+"""
+
+import asyncio
+import random
+import re
+import socket
+import time
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+
+from crawl4ai import CrawlResult
+
+from metrics import metrics
+
+# ブラウザのエラー: net::ERR_* のコード → 分類 (どれにも当たらないコードは other。ERR_ABORTED など)
+NET_ERRORS = [
+    ("dns", re.compile(r"ERR_NAME_NOT_RESOLVED|ERR_NAME_RESOLUTION_FAILED")),
+    ("tls", re.compile(r"ERR_CERT_\w+|ERR_SSL_\w+|ERR_BAD_SSL_CLIENT_AUTH_CERT")),
+    ("timeout", re.compile(r"ERR_TIMED_OUT|ERR_CONNECTION_TIMED_OUT")),
+    ("connect", re.compile(r"ERR_CONNECTION_(REFUSED|RESET|CLOSED|FAILED)|ERR_ADDRESS_UNREACHABLE|"
+                           r"ERR_INTERNET_DISCONNECTED|ERR_NETWORK_CHANGED")),
+]
+# net::ERR_* の無いエラー (Playwright / httpx / socket の例外): 例外の型名と決まった文言 (上から順に照合)
+EXCEPTION_PATTERNS = [
+    ("dns", re.compile(r"\bgaierror\b|getaddrinfo failed|Name or service not known|nodename nor servname|"
+                       r"No address associated with hostname|Temporary failure in name resolution")),
+    ("tls", re.compile(r"\b(SSLError|SSLCertVerificationError|CERTIFICATE_VERIFY_FAILED)\b")),
+    ("timeout", re.compile(r"\b(TimeoutError|ConnectTimeout|ReadTimeout|WriteTimeout|PoolTimeout)\b|"
+                           r"\bTimeout \d+ms exceeded|\btimed out\b")),
+    ("connect", re.compile(r"\b(ConnectError|ConnectionRefusedError|ConnectionResetError)\b|"
+                           r"\bConnection (refused|reset)\b", re.IGNORECASE)),
+]
+RETRYABLE = {"timeout", "connect", "throttled", "http_5xx"}
+HOST_FAILURES = {"dns", "connect", "timeout", "tls"}     # ホストそのものの不調とみなす分類
+_NET_ERR = re.compile(r"net::ERR_\w+")
+_URL = re.compile(r"\b[a-z][a-z0-9+.-]*://\S+", re.IGNORECASE)
+
+
+def classify_error(message: str | None, status_code: int | None = None) -> str:
+    """成功 (エラーもステータス 400 以上も無い) なら空文字"""
+    status = status_code or 0
+    if status in (429, 503):
+        return "throttled"
+    if 400 <= status < 500:
+        return "http_4xx"
+    if status >= 500:
+        return "http_5xx"
+    if not message:
+        return ""
+    code = _NET_ERR.search(message)
+    if code:
+        return next((name for name, pattern in NET_ERRORS if pattern.search(code.group())), "other")
+    text = _URL.sub("", message)                 # パスに ssl / timeout などの語があっても引っかけない
+    return next((name for name, pattern in EXCEPTION_PATTERNS if pattern.search(text)), "other")
+
+
+def short_error(message: str | None, limit: int = 300) -> str:
+    """複数行のエラーから 1 行だけ (net::ERR_* を含む行 → "Error:" の行 → 最初の行)"""
+    if not message:
+        return ""
+    lines = [line.strip() for line in message.splitlines() if line.strip()]
+    picked = (next((line for line in lines if _NET_ERR.search(line)), None)
+              or next((line for line in lines if line.startswith("Error:")), None)
+              or lines[0])
+    return picked[:limit]
+
+
+@dataclass
+class RetryPolicy:
+    retries: int = 2
+    base: float = 0.5
+    cap: float = 30.0
+
+    def should_retry(self, error_class: str, attempt: int) -> bool:
+        return error_class in RETRYABLE and attempt < self.retries
+
+    def delay(self, attempt: int) -> float:
+        """attempt 回目 (1 始まり) の再試行までの待ち時間"""
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+
+@dataclass
+class HostCircuit:
+    failures: int = 0                 # 接続系の失敗の連続回数
+    open_until: float = 0.0
+    cooldown: float = 0.0
+    last_class: str = ""
+    last_error: str = ""
+    trial: bool = False               # 遮断明けの試しの 1 件を出している間
+    short_circuited: int = 0
+
+
+class HostError(Exception):
+    def __init__(self, error_class: str, message: str) -> None:
+        super().__init__(message)
+        self.error_class = error_class
+
+
+class HostHealth:
+    def __init__(
+        self,
+        *,
+        dns_ttl: float = 300.0,
+        negative_ttl: float = 60.0,
+        dns_timeout: float = 5.0,
+        connect_timeout: float = 3.0,
+        probe: bool = True,
+        failure_threshold: int = 3,
+        cooldown: float = 30.0,
+        max_cooldown: float = 600.0,
+    ) -> None:
+        self.dns_ttl = dns_ttl
+        self.negative_ttl = negative_ttl
+        self.dns_timeout = dns_timeout
+        self.connect_timeout = connect_timeout
+        self.probe_enabled = probe
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        # host → (期限, アドレス一覧 or HostError)
+        self._dns: dict[str, tuple[float, object]] = {}
+        self._probed: dict[str, tuple[float, HostError | None]] = {}
+        self._inflight: dict[str, asyncio.Future] = {}
+        self.circuits: dict[str, HostCircuit] = {}
+
+    # ---------- DNS / TCP ----------
+    async def _once(self, key: str, make) -> object:
+        """同じ key の問い合わせは 1 本にまとめる"""
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = self._inflight[key] = asyncio.ensure_future(make())
+            fut.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(fut)
+
+    async def resolve(self, host: str, port: int) -> list[str]:
+        cached = self._dns.get(host)
+        if cached and cached[0] > time.monotonic():
+            if isinstance(cached[1], HostError):
+                raise cached[1]
+            return cached[1]
+
+        async def lookup() -> object:
+            loop = asyncio.get_running_loop()
+            metrics.inc("dns_lookups_total")
+            try:
+                infos = await asyncio.wait_for(
+                    loop.getaddrinfo(host, port, type=socket.SOCK_STREAM), self.dns_timeout)
+                addrs = list(dict.fromkeys(info[4][0] for info in infos))
+                self._dns[host] = (time.monotonic() + self.dns_ttl, addrs)
+            except (OSError, asyncio.TimeoutError) as e:  # noqa: UP041 (3.10 では組み込みの TimeoutError と別物)
+                err = HostError("dns", f"DNS: {host}: {e.__class__.__name__}: {e}")
+                self._dns[host] = (time.monotonic() + self.negative_ttl, err)
+            return self._dns[host][1]
+
+        result = await self._once(f"dns:{host}", lookup)
+        if isinstance(result, HostError):
+            raise result
+        return result
+
+    async def probe(self, host: str, port: int) -> None:
+        """TCP で繋がるか (結果は dns_ttl / negative_ttl の間覚えておく)"""
+        key = f"{host}:{port}"
+        cached = self._probed.get(key)
+        if cached and cached[0] > time.monotonic():
+            if cached[1]:
+                raise cached[1]
+            return
+
+        async def connect() -> HostError | None:
+            addrs = await self.resolve(host, port)
+            err: HostError | None = None
+            t0 = time.perf_counter()
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection(addrs[0], port), self.connect_timeout)
+                writer.close()
+            except asyncio.TimeoutError:  # noqa: UP041 (3.10 では組み込みの TimeoutError と別物)
+                err = HostError("timeout", f"TCP: {key}: {self.connect_timeout:g}s 以内に接続できない")
+            except OSError as e:
+                err = HostError("connect", f"TCP: {key}: {e.__class__.__name__}: {e}")
+            metrics.observe("probe_seconds", time.perf_counter() - t0)
+            ttl = self.negative_ttl if err else self.dns_ttl
+            self._probed[key] = (time.monotonic() + ttl, err)
+            return err
+
+        err = await self._once(f"tcp:{key}", connect)
+        if err:
+            raise err
+
+    # ---------- サーキットブレーカー ----------
+    def _circuit(self, host: str) -> HostCircuit:
+        circuit = self.circuits.get(host)
+        if circuit is None:
+            circuit = self.circuits[host] = HostCircuit()
+        return circuit
+
+    def _fail(self, circuit: HostCircuit, error_class: str, message: str, *, open_now: bool = False) -> None:
+        circuit.failures += 1
+        circuit.last_class, circuit.last_error = error_class, message
+        if open_now or circuit.trial or circuit.failures >= self.failure_threshold:
+            # 遮断明けの試しでも失敗したら遮断時間を倍に
+            circuit.cooldown = min(self.max_cooldown, circuit.cooldown * 2 if circuit.trial else self.cooldown)
+            circuit.open_until = time.monotonic() + circuit.cooldown
+            metrics.inc("circuit_open_total", reason=error_class)
+        circuit.trial = False
+
+    def _short_circuit(self, url: str, circuit: HostCircuit) -> CrawlResult:
+        circuit.short_circuited += 1
+        metrics.inc("short_circuited_total", reason=circuit.last_class)
+        return CrawlResult(
+            url=url, html="", success=False, status_code=None,
+            error_message=circuit.last_error,
+            metadata={"engine": "precheck", "error_class": circuit.last_class, "fetch_ms": 0.0},
+        )
+
+    async def precheck(self, url: str) -> CrawlResult | None:
+        """取得してよければ None。遮断中 / 名前解決できない / 接続できないホストなら失敗の CrawlResult"""
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            return None
+        circuit = self._circuit(parts.netloc)
+        now = time.monotonic()
+        if circuit.open_until:
+            if now < circuit.open_until or circuit.trial:
+                return self._short_circuit(url, circuit)
+            circuit.trial = True                     # 遮断明け: この 1 件で様子を見る
+        try:
+            port = parts.port or (443 if parts.scheme == "https" else 80)
+            if self.probe_enabled:
+                await self.probe(parts.hostname, port)
+            else:
+                await self.resolve(parts.hostname, port)
+        except HostError as e:
+            # 名前解決できないホストはすぐ遮断 (DNS は negative_ttl の間キャッシュ済み)
+            self._fail(circuit, e.error_class, str(e), open_now=e.error_class == "dns")
+            return self._short_circuit(url, circuit)
+        return None
+
+    def observe(self, result: CrawlResult) -> str:
+        """取得結果を分類してブレーカーを更新し、分類を返す (metadata["error_class"] にも残す)"""
+        result.metadata = result.metadata or {}
+        if result.metadata.get("engine") == "precheck":
+            return result.metadata["error_class"]
+        error_class = classify_error(result.error_message, result.status_code)
+        result.metadata["error_class"] = error_class
+        circuit = self._circuit(urlsplit(result.url).netloc)
+        if error_class in HOST_FAILURES:
+            self._fail(circuit, error_class, short_error(result.error_message))
+        elif result.status_code or circuit.trial:
+            # 何か応答が返ってきたならホストは生きている。遮断明けの試しがホスト以外の理由
+            # (ページのクラッシュなど) で失敗した時も、試しを出しっぱなしにせず遮断を解く
+            circuit.failures, circuit.open_until, circuit.cooldown, circuit.trial = 0, 0.0, 0.0, False
+        return error_class
+
+    def is_open(self, url: str) -> bool:
+        circuit = self.circuits.get(urlsplit(url).netloc)
+        return bool(circuit and circuit.open_until > time.monotonic())
+
+    def summary(self) -> list[tuple[str, str, int, str]]:
+        """遮断したことのあるホストの (host, 分類, 取得せずに済ませた件数, 最後のエラー)"""
+        return [(host, c.last_class, c.short_circuited, c.last_error)
+                for host, c in sorted(self.circuits.items()) if c.cooldown or c.short_circuited]
@@ -0,0 +1,182 @@
+"""
+incremental.py
+前回クロール時の URL ごとの記録 (ETag / Last-Modified / リンク) を SQLite に残しておき、
+次回は HTTP 条件付きリクエストだけで変更有無を確かめる (本文は読まない)。
+- 304 → 記録済みのリンク等から CrawlResult を組み立てて再利用
+- 200 (変更あり) / 初回 / ETag も Last-Modified も無いページ → 従来どおり描画し、記録を更新
+  (本文を比べるには全体を 1 回余分に取ることになるので、ダイジェストでの比較はしない)
+"""
+
+import asyncio
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple
+
+import httpx
+from crawl4ai import CrawlResult
+
+if TYPE_CHECKING:
+    from typing import Self
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    variant       TEXT,
+    url           TEXT,
+    etag          TEXT,
+    last_modified TEXT,
+    digest        TEXT,          -- 以前の版の名残 (今は書かない)
+    status_code   INTEGER,
+    links         TEXT,
+    markdown      TEXT,
+    checked_at    REAL,
+    PRIMARY KEY (variant, url)
+);
+"""
+
+
+class PageRecord(NamedTuple):
+    etag: str | None
+    last_modified: str | None
+    digest: str | None
+    status_code: int | None
+    links: dict
+    markdown: dict | None
+
+
+def _compact_links(links: dict) -> dict:
+    """記録に残すのは href / text だけ"""
+    return {
+        kind: [{"href": l.get("href", ""), "text": l.get("text", "")} for l in items]
+        for kind, items in (links or {}).items()
+    }
+
+
+class IncrementalCache:
+    """`check()` で変更なしなら記録から CrawlResult を返し、変更ありなら None"""
+    def __init__(
+        self,
+        path: Path,
+        *,
+        variant: str = "default",
+        keep_markdown: bool = False,
+        concurrency: int = 16,
+        timeout: float = 10.0,
+        commit_every: int = 50,
+    ) -> None:
+        self.variant = variant                 # CrawlerRunConfig ごとに記録を分ける用
+        self.keep_markdown = keep_markdown
+        self.timeout = timeout
+        self.commit_every = commit_every
+        self.unchanged = self.changed = self.new = 0
+
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self._sem = asyncio.Semaphore(concurrency)
+        self._probed: dict[str, tuple] = {}    # url → 条件付きリクエストで得た新しい (etag, last_modified)
+        self._dirty = 0
+        self._client = None
+
+    async def __aenter__(self) -> "Self":
+        self._client = httpx.AsyncClient(timeout=self.timeout, follow_redirects=True)
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self._client.aclose()
+        self.db.commit()
+        self.db.close()
+
+    def _get(self, url: str) -> PageRecord | None:
+        row = self.db.execute(
+            "SELECT etag, last_modified, digest, status_code, links, markdown "
+            "FROM pages WHERE variant=? AND url=?", (self.variant, url)).fetchone()
+        if row is None:
+            return None
+        return PageRecord(*row[:4], json.loads(row[4] or "{}"), json.loads(row[5] or "null"))
+
+    async def _probe(self, url: str, headers: dict) -> httpx.Response | None:
+        """条件付き GET。ヘッダだけ見て本文は読まずに閉じる (変わっていれば本文は描画側で取る)"""
+        try:
+            async with self._sem, self._client.stream("GET", url, headers=headers) as r:
+                return r
+        except httpx.HTTPError:
+            return None
+
+    async def check(self, url: str) -> CrawlResult | None:
+        rec = self._get(url)
+        if rec is None:
+            self.new += 1
+            return None
+        if not (rec.etag or rec.last_modified):
+            self.changed += 1
+            return None                           # 比べる手がかりが無いので問い合わせない
+
+        headers = {}
+        if rec.etag:
+            headers["If-None-Match"] = rec.etag
+        if rec.last_modified:
+            headers["If-Modified-Since"] = rec.last_modified
+        r = await self._probe(url, headers)
+        if r is None:
+            self.changed += 1
+            return None                           # 判定できない時はブラウザに任せる
+
+        etag, last_modified = r.headers.get("etag"), r.headers.get("last-modified")
+        if r.status_code == 304:
+            if etag or last_modified:
+                self._touch(url, etag, last_modified)
+            return self._reuse(url, rec)
+        if r.status_code == 200:
+            self._probed[url] = (etag, last_modified)
+        self.changed += 1
+        return None
+
+    def _reuse(self, url: str, rec: PageRecord) -> CrawlResult:
+        self.unchanged += 1
+        return CrawlResult(
+            url=url,
+            html="",
+            success=True,
+            status_code=rec.status_code,
+            links=rec.links,
+            markdown=rec.markdown,
+            metadata={"incremental": "unchanged"},
+        )
+
+    def _touch(self, url: str, etag: str | None, last_modified: str | None) -> None:
+        self.db.execute(
+            "UPDATE pages SET etag=coalesce(?, etag), last_modified=coalesce(?, last_modified), "
+            "checked_at=? WHERE variant=? AND url=?",
+            (etag, last_modified, time.time(), self.variant, url))
+        self._maybe_commit()
+
+    def update(self, result: CrawlResult) -> None:
+        """ブラウザで描画し直した結果を記録する (成功したページのみ)"""
+        if not result.success:
+            return
+        headers = {k.lower(): v for k, v in (result.response_headers or {}).items()}
+        etag, last_modified = self._probed.pop(
+            result.url, (headers.get("etag"), headers.get("last-modified")))
+
+        markdown = None
+        if self.keep_markdown and result.markdown is not None:
+            markdown = {
+                "raw_markdown": result.markdown.raw_markdown,
+                "markdown_with_citations": "",
+                "references_markdown": "",
+                "fit_markdown": result.markdown.fit_markdown,
+            }
+        self.db.execute(
+            "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (self.variant, result.url, etag, last_modified, None, result.status_code,
+             json.dumps(_compact_links(result.links), ensure_ascii=False),
+             json.dumps(markdown, ensure_ascii=False), time.time()))
+        self._maybe_commit()
+
+    def _maybe_commit(self) -> None:
+        self._dirty += 1
+        if self._dirty >= self.commit_every:
+            self.db.commit()
+            self._dirty = 0
@@ -119,32 +119,48 @@ intra_crawler.py
 ローカル Playwright + crawl4ai 0.7.* でイントラサイトをクロールして
 - site_structure.csv       … URL,深さ,HTTP ステータス,成功/失敗 等
 - file_links.csv           … ページ→添付ファイル名
-- site_tree.txt            … インデント付きツリー（深さ順ソート）
-- site_tree_fancy.txt      … └──/│ 付きの木構造   ★ NEW
+- site_tree.txt            … インデント付きツリー（パスのトライ木を名前順に）
+- site_tree_fancy.txt      … └──/│ 付きの木構造 + 部分木ごとのページ／ファイル／エラー数・バイト数
 - site_summary.csv         … パス別ページ／ファイル／エラー数   ★ NEW
+- run_stats.json           … フェーズ別の所要時間・CPU 時間
 """
 
-import asyncio, csv, os
+import asyncio, csv, json, os, time
 from pathlib import Path
 from urllib.parse import urlparse
 from collections import Counter                 # ★ NEW
+from contextlib import AsyncExitStack, asynccontextmanager
 
 from crawl4ai import AsyncWebCrawler, CrawlerRunConfig, CacheMode
-from crawl4ai.content_scraping_strategy import LXMLWebScrapingStrategy
-from crawl4ai.deep_crawling import BFSDeepCrawlStrategy
 from crawl4ai.deep_crawling.filters import FilterChain, ContentTypeFilter
 
-# 木構造表示用
-try:
-    from anytree import Node, RenderTree        # ★ NEW
-except ImportError:
-    Node = RenderTree = None    # anytree が未インストールでも動くように
-
 # 追加 import
 from typing import Iterable
 from urllib.parse import urlparse
 
-import requests                    # ★ NEW 追跡用
+from redirect_resolver import RedirectResolver, RESOLVE_ERRORS   # 3xx の最終 URL を並行追跡
+from crawl_state import CrawlStateStore           # 中断・再開用の状態ストア
+from intra_strategy import ResumableBFSStrategy, ResumableBestFirstStrategy
+from url_scorer import (                          # best-first の優先度
+    AttachmentScorer, CompositeScorer, DepthScorer, FreshnessScorer, KeywordScorer,
+    PathPrefixScorer, parse_weights,
+)
+from incremental import IncrementalCache          # 前回から変わっていないページの再利用
+from fetch_engine import HybridFetcher            # 静的ページは httpx、JS が要るページだけブラウザ
+from scheduler import HostScheduler               # ホスト単位の流量制御 (AIMD + トークンバケット)
+from browser_pool import get_pool, close_pool     # 使い回すブラウザのプール
+from metrics import metrics, PhaseTimer, TimedLXMLScrapingStrategy   # フェーズ別の計測
+from parse_pool import ParsePool, PassthroughScrapingStrategy      # パースを別プロセスで
+from parquet_sink import ParquetStream            # 型付き・圧縮の Parquet 出力
+from result_sink import ResultSink, CsvWriter     # 出力ファイルへのまとめ書き (非同期キュー)
+from page_store import PageStore                  # 本文の内容アドレス型アーカイブ
+from near_dup import NearDupIndex, parse_mode     # テンプレート違いのほぼ同じページの検出
+from harvester import AttachmentHarvester, HARVEST_FIELDS   # 添付ファイルの一括ダウンロード
+from records import PageRecord                    # 結果の省メモリ表現
+from site_tree import SiteTree                    # ツリー出力用のパスのトライ木
+from render_profiles import ProfileRouter, parse_profile_paths   # 描画時に不要なリソースを止める
+from host_health import HostHealth, RetryPolicy   # 落ちているホストの事前検知と再試行の方針
+from link_graph import LinkGraph                  # ページ間リンクの整数グラフとクロール後の集計
 
 # ---------- ① SchemeFilter を自前定義 ★ NEW ----------
 class SchemeFilter:
@@ -167,7 +183,7 @@ MAX_PAGES = int(os.getenv("MAX_PAGES", 2000))
 OUTPUT_DIR = Path(os.getenv("OUTPUT_DIR", "crawl_results"))
 # -------------------------------------------
 
-OUTPUT_DIR.mkdir(exist_ok=True)
+# 出力先は crawl() の中で作る (import しただけではディレクトリもファイルも作らない)
 SITE_CSV, FILES_CSV, TREE_TXT = (
     OUTPUT_DIR / "site_structure.csv",
     OUTPUT_DIR / "file_links.csv",
@@ -175,17 +191,156 @@ SITE_CSV, FILES_CSV, TREE_TXT = (
 )
 TREE_FANCY_TXT = OUTPUT_DIR / "site_tree_fancy.txt"   # ★ NEW
 SUMMARY_CSV    = OUTPUT_DIR / "site_summary.csv"      # ★ NEW
+RUN_STATS_JSON = OUTPUT_DIR / "run_stats.json"        # フェーズ別の所要時間 (bench_crawl.py が読む)
 
 FILE_EXTS = {
     ".pdf", ".doc", ".docx", ".ppt", ".pptx",
     ".xls", ".xlsx", ".csv", ".zip", ".rar", ".7z", ".txt"
 }
 
-def strip_base(url: str, netloc: str) -> str:
-    p = urlparse(url)
-    return p.path or "/" if p.netloc == netloc else url
+SITE_FIELDS = [
+    "url", "path", "depth", "type", "status_code", "success", "error",
+    "redirect_to", "redirect_hops", "engine", "fetch_ms", "duplicate_of", "score", "reason", "size",
+    "profile", "blocked", "blocked_bytes", "error_class",
+]
+FILE_FIELDS = ["page_url", "file_name", "file_url"]
+
+# リダイレクト追跡のホスト単位同時実行数
+REDIRECT_PER_HOST = int(os.getenv("REDIRECT_PER_HOST", "4"))
+
+# 中断・再開用の状態 DB と、何件ごとにコミットするか
+STATE_DB = OUTPUT_DIR / "crawl_state.sqlite"
+CHECKPOINT_EVERY = int(os.getenv("CHECKPOINT_EVERY", "50"))
+# 既訪問集合の前段に置く Bloom フィルタの想定件数 (0 で使わない)
+SEEN_BLOOM = int(os.getenv("SEEN_BLOOM", "0"))
+
+# 1 で前回の記録 (ETag / Last-Modified / ダイジェスト) を使った差分クロール
+INCREMENTAL = os.getenv("INCREMENTAL", "0") == "1"
+RECORDS_DB = OUTPUT_DIR / "page_records.sqlite"
+
+# 1 で静的ページを httpx で取得し、JS が必要なページだけ Playwright で描画 (既定は従来どおり全ページ Playwright)
+HYBRID_FETCH = os.getenv("HYBRID_FETCH", "0") == "1"
+# 常にブラウザで描画するパスの接頭辞 (カンマ区切り 例: "/app/,/portal/")
+BROWSER_PATHS = [p.strip() for p in os.getenv("BROWSER_PATHS", "").split(",") if p.strip()]
+
+# 1 でホスト単位の流量制御 (既定は crawl4ai 既定の dispatcher のみ)
+SCHEDULER = os.getenv("SCHEDULER", "0") == "1"
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "16"))           # 全ホスト合計
+PER_HOST_CONCURRENCY = int(os.getenv("PER_HOST_CONCURRENCY", "4"))  # 1 ホストあたりの上限
+PER_HOST_RPS = float(os.getenv("PER_HOST_RPS", "2.0"))              # 1 ホストあたりの秒間リクエスト数
+HEALTHY_LATENCY = float(os.getenv("HEALTHY_LATENCY", "2.0"))        # これより速ければ同時実行数を増やす (秒)
+
+# 1 でストリーミング (結果を 1 件ずつ CSV へ書き出して捨てる)、0 で従来の一括処理
+STREAM = os.getenv("STREAM", "1") != "0"
+
+# ブラウザ描画は共有プールから借りる (POOL_CONTEXTS / POOL_TABS / POOL_RECYCLE_AFTER で調整)
+
+# 計測: METRICS_PORT で /metrics (Prometheus 形式) を公開、METRICS_JSONL に METRICS_INTERVAL 秒ごとに追記
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_JSONL = os.getenv("METRICS_JSONL", "")
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", "10"))
+# 1 以上で遅いページ上位 N 件の cProfile / tracemalloc を PROFILE_DIR へ書き出す
+PROFILE_SLOWEST = int(os.getenv("PROFILE_SLOWEST", "0"))
+PROFILE_DIR = OUTPUT_DIR / "profiles"
+
+# 出力の書き出し: キューの上限行数・まとめて書く行数・OS へ flush する間隔 (秒)
+SINK_QUEUE = int(os.getenv("SINK_QUEUE", "10000"))
+SINK_BATCH = int(os.getenv("SINK_BATCH", "1000"))
+SINK_FLUSH_INTERVAL = float(os.getenv("SINK_FLUSH_INTERVAL", "1.0"))
+
+# 出力形式: csv / parquet / both (Parquet は PARQUET_DIR/<表>/run_ts=…/host=…/ に実行をまたいで蓄積)
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "csv")
+PARQUET_DIR = Path(os.getenv("PARQUET_DIR", OUTPUT_DIR / "parquet"))
+
+# 1 で取得した生 HTML (と Markdown があれば Markdown) を PAGE_STORE_DIR のアーカイブへ保存
+# (内容ハッシュで重複排除・zstd 辞書圧縮。実行をまたいで同じアーカイブに追記)
+PAGE_STORE = os.getenv("PAGE_STORE", "0") == "1"
+PAGE_STORE_DIR = Path(os.getenv("PAGE_STORE_DIR", OUTPUT_DIR / "pages"))
+
+# 1 でクロール後に file_links の添付ファイルを HARVEST_DIR へダウンロード (attachments.csv に結果)
+# 2 回目以降は条件付き GET で変わっていないファイルを取り直さない
+HARVEST = os.getenv("HARVEST", "0") == "1"
+HARVEST_DIR = Path(os.getenv("HARVEST_DIR", OUTPUT_DIR / "files"))
+HARVEST_CONCURRENCY = int(os.getenv("HARVEST_CONCURRENCY", "8"))
+ATTACH_CSV = OUTPUT_DIR / "attachments.csv"
+
+# 近似重複ページ (MinHash + LSH) の扱い: off / mark (duplicate_of 列に記録のみ)
+# / defer (そのページのリンクは他を辿り終えてから) / skip (そのページのリンクは辿らない)
+NEAR_DUP = parse_mode(os.getenv("NEAR_DUP", "off"))
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.8"))   # 推定 Jaccard 類似度
+
+# 巡回順: bfs (浅い順) / best_first (url_scorer のスコアが高い順に BEST_FIRST_BATCH 件ずつ)
+CRAWL_MODE = os.getenv("CRAWL_MODE", "bfs")
+BEST_FIRST_BATCH = int(os.getenv("BEST_FIRST_BATCH", "16"))
+# スコアラーの重み (0 で無効) と設定。例: SCORE_PATHS="/docs/=2,/calendar/=-2" SCORE_KEYWORDS="規程,マニュアル"
+SCORE_WEIGHTS = {"path": 1.0, "attach": 1.0, "fresh": 0.5, "keyword": 1.0, "depth": 0.5,
+                 **parse_weights(os.getenv("SCORE_WEIGHTS", ""))}
+SCORE_PATHS = parse_weights(os.getenv("SCORE_PATHS", ""))
+SCORE_KEYWORDS = [k.strip() for k in os.getenv("SCORE_KEYWORDS", "").split(",") if k.strip()]
+FRESH_HALF_LIFE_DAYS = float(os.getenv("FRESH_HALF_LIFE_DAYS", "7"))
+
+# ブラウザ描画のプロファイル: full / text / links-only (RENDER_PROFILE_PATHS="/app/=full,/news/=links-only" でパスごとに)
+RENDER_PROFILE = os.getenv("RENDER_PROFILE", "full")
+RENDER_PROFILE_PATHS = parse_profile_paths(os.getenv("RENDER_PROFILE_PATHS", ""))
+
+# 1 で取得前にホストの名前解決・TCP 接続を確かめ、失敗が続くホストは CIRCUIT_COOLDOWN 秒遮断する
+# (プロキシ経由でしか名前解決できない環境では使えないので既定は無効)
+HOST_PRECHECK = os.getenv("HOST_PRECHECK", "0") == "1"
+CIRCUIT_THRESHOLD = int(os.getenv("CIRCUIT_THRESHOLD", "3"))
+CIRCUIT_COOLDOWN = float(os.getenv("CIRCUIT_COOLDOWN", "30"))
+# 一時的な失敗 (タイムアウト・接続断・5xx・429) の再試行回数と待ち時間の基準 (秒, 指数バックオフ + jitter)
+RETRIES = int(os.getenv("RETRIES", "2"))
+RETRY_BASE = float(os.getenv("RETRY_BASE", "0.5"))
+
+# 1 でページ間リンクを LINK_GRAPH_DIR に追記し、クロール後に page_graph.csv / broken_links.csv を作る
+LINK_GRAPH = os.getenv("LINK_GRAPH", "0") == "1"
+LINK_GRAPH_DIR = OUTPUT_DIR / "link_graph"
+PAGE_GRAPH_CSV = OUTPUT_DIR / "page_graph.csv"
+BROKEN_LINKS_CSV = OUTPUT_DIR / "broken_links.csv"
+
+# 子がこの数を超えるディレクトリはツリー出力で畳む (0 で畳まない)
+TREE_COLLAPSE = int(os.getenv("TREE_COLLAPSE", "0"))
+
+# 1 以上で HTML のパース・リンク抽出をそのプロセス数のワーカーで行う (0 はイベントループ上で処理)
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "0"))
+
+def build_scorer() -> CompositeScorer:
+    """SCORE_* の設定から best-first のスコアラーを組み立てる (前回の記録は RECORDS_DB から)"""
+    return CompositeScorer([
+        (PathPrefixScorer(SCORE_PATHS), SCORE_WEIGHTS["path"] if SCORE_PATHS else 0),
+        (AttachmentScorer(FILE_EXTS), SCORE_WEIGHTS["attach"]),
+        (FreshnessScorer.from_records(RECORDS_DB, FRESH_HALF_LIFE_DAYS), SCORE_WEIGHTS["fresh"]),
+        (KeywordScorer(SCORE_KEYWORDS), SCORE_WEIGHTS["keyword"] if SCORE_KEYWORDS else 0),
+        (DepthScorer(), SCORE_WEIGHTS["depth"]),
+    ])
+
+
+@asynccontextmanager
+async def lazy_crawler():
+    """deep crawl の入口。描画はプールが担い、プールのブラウザも最初に描画が必要になった時点で起動"""
+    crawler = AsyncWebCrawler()
+    try:
+        yield crawler
+    finally:
+        if crawler.ready:
+            await crawler.close()
 
-async def crawl() -> None:
+
+async def iter_results(crawler: AsyncWebCrawler, run_cfg: CrawlerRunConfig):
+    """STREAM=1 なら deep crawl の async iterator を、0 なら一括結果をそのまま流す"""
+    if run_cfg.stream:
+        async for res in await crawler.arun(ROOT_URL, config=run_cfg):
+            yield res
+    else:
+        # 一括結果も 1 件ずつリストから外して流す (処理済みの CrawlResult を持ち続けない)
+        results = list(await crawler.arun(ROOT_URL, config=run_cfg))
+        results.reverse()
+        while results:
+            yield results.pop()
+
+
+async def crawl(resume: bool = False, store=None) -> None:
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
     # filters = FilterChain([ContentTypeFilter(allowed_types=["text/html"])])
 
     # 既存 filters に追加 -------------（元のコード内を書き換え）
@@ -195,160 +350,327 @@ async def crawl() -> None:
     ])
     # ---------------------------------
 
-    deep_crawl = BFSDeepCrawlStrategy(
+    # frontier / visited / 完了行を SQLite に残し、--resume で続きから再開
+    # (分散クロールでは shard.py が共有 frontier の ShardStore を渡す)
+    if store is None:
+        store = CrawlStateStore(STATE_DB, checkpoint_every=CHECKPOINT_EVERY, bloom_capacity=SEEN_BLOOM,
+                                best_first=CRAWL_MODE == "best_first")
+        resumed = store.open(ROOT_URL, resume=resume)
+        if resumed:
+            print(f"↻ 再開: 完了 {store.pages_crawled} 件 / 残り {len(store.frontier)} 件")
+    else:
+        resumed = store.open(ROOT_URL, resume=True)
+        if resumed:
+            print(f"↻ 再開: このシャードで完了 {store.pages_crawled} 件")
+
+    incremental = IncrementalCache(RECORDS_DB) if INCREMENTAL else None
+    parse_pool = ParsePool(PARSE_WORKERS) if PARSE_WORKERS else None
+    fetcher = HybridFetcher(browser_paths=BROWSER_PATHS, parse_pool=parse_pool) if HYBRID_FETCH else None
+    scheduler = HostScheduler(
+        global_limit=MAX_CONCURRENCY,
+        per_host_max=PER_HOST_CONCURRENCY,
+        rate=PER_HOST_RPS,
+        burst=max(1.0, PER_HOST_RPS * 2),
+        healthy_latency=HEALTHY_LATENCY,
+    ) if SCHEDULER else None
+
+    # 全部 full なら route を張らず今まで通り
+    profiles = None
+    if RENDER_PROFILE != "full" or any(n != "full" for n in RENDER_PROFILE_PATHS.values()):
+        profiles = ProfileRouter(RENDER_PROFILE, RENDER_PROFILE_PATHS)
+
+    health = HostHealth(failure_threshold=CIRCUIT_THRESHOLD, cooldown=CIRCUIT_COOLDOWN) if HOST_PRECHECK else None
+    # 再開時は追記済みの辺を読み直して続きから積む
+    graph = LinkGraph(LINK_GRAPH_DIR, resume=resumed) if LINK_GRAPH else None
+
+    best_first = {}
+    if CRAWL_MODE == "best_first":
+        best_first = {"scorer": build_scorer(), "file_exts": FILE_EXTS, "batch_size": BEST_FIRST_BATCH}
+    strategy_cls = ResumableBestFirstStrategy if best_first else ResumableBFSStrategy
+    deep_crawl = strategy_cls(
         max_depth=MAX_DEPTH,
         include_external=False,
         max_pages=MAX_PAGES,
         filter_chain=filters,
+        store=store,
+        incremental=incremental,
+        fetcher=fetcher,
+        scheduler=scheduler,
+        pool=get_pool(hooks={"before_goto": profiles.before_goto} if profiles else None),
+        parse_pool=parse_pool,
+        near_dup=NearDupIndex(NEAR_DUP_THRESHOLD) if NEAR_DUP != "off" else None,
+        near_dup_mode=NEAR_DUP,
+        profiles=profiles,
+        health=health,
+        retry=RetryPolicy(RETRIES, RETRY_BASE) if RETRIES else None,
+        **best_first,
     )
 
     run_cfg = CrawlerRunConfig(
         deep_crawl_strategy=deep_crawl,
-        scraping_strategy=LXMLWebScrapingStrategy(),
+        scraping_strategy=PassthroughScrapingStrategy() if parse_pool else TimedLXMLScrapingStrategy(),
         cache_mode=CacheMode.BYPASS,
         verbose=True,
+        stream=STREAM,
         # raise_exceptions=False,
 
     )
 
     FAILED_CSV = OUTPUT_DIR / "failed_urls.csv"
 
-
-
-
-    async with AsyncWebCrawler() as crawler:
-        results = await crawler.arun(ROOT_URL, config=run_cfg)
-
     base = urlparse(ROOT_URL).netloc
-    site_rows, file_rows, tree_paths = [], [], []
-
-    for res in results:
-        depth = res.metadata.get("depth", 0)
-        path  = strip_base(res.url, base)
-        is_file = os.path.splitext(path)[1].lower() in FILE_EXTS
-
-
-        redirect_to = ""                          # ★ NEW
-        redirect_hops = 0                         # ★ NEW
-
+    def open_sink(path: Path, fieldnames: list[str], host_field: str = "url") -> ResultSink:
+        writers = []
+        if OUTPUT_FORMAT in ("csv", "both"):
+            writers.append(CsvWriter(path, fieldnames))
+        if OUTPUT_FORMAT in ("parquet", "both"):
+            # 再開時は同じ run_ts のパーティションを作り直す (シャードごとにファイルを分ける)
+            writers.append(ParquetStream(PARQUET_DIR, path.stem, store.run_ts,
+                                         host_field=host_field, part=str(getattr(store, "shard", 0))))
+        return ResultSink(*writers, max_queue=SINK_QUEUE, batch=SINK_BATCH,
+                          flush_interval=SINK_FLUSH_INTERVAL)
+
+    site_out = open_sink(SITE_CSV, SITE_FIELDS)
+    file_out = open_sink(FILES_CSV, FILE_FIELDS, host_field="page_url")
+    failed_out = open_sink(FAILED_CSV, SITE_FIELDS)
+    attach_out = open_sink(ATTACH_CSV, HARVEST_FIELDS)
+    # 本文は大きいのでキューは短めに
+    page_out = ResultSink(PageStore(PAGE_STORE_DIR), max_queue=256, batch=64,
+                          flush_interval=SINK_FLUSH_INTERVAL) if PAGE_STORE else None
+    sinks = tuple(s for s in (site_out, file_out, failed_out, attach_out, page_out) if s)
+
+    # ツリーとサマリー用にはパスのトライ木 (ノードごとの集計付き) だけを残す
+    site = SiteTree()
+    file_urls = set()    # 添付ファイル URL (HARVEST=1 でクロール後にまとめて取得)
+
+    async def emit(row: dict, file_rows: list[dict]) -> None:
+        await site_out.put(row)
+        if not row["success"]:
+            await failed_out.put(row)
+        for file_row in file_rows:
+            await file_out.put(file_row)
+            if HARVEST:
+                file_urls.add(file_row["file_url"])
+        # ツリー・パス別サマリーもここで逐次集計
+        site.add(row["path"], row["type"] == "file", row["success"], row.get("size") or 0)
+        if graph is not None:
+            graph.visit(row["url"], row["status_code"], row["success"])
+
+    completed = 0
+
+    async def finish(rec: PageRecord, file_rows: list[dict]) -> None:
+        nonlocal completed
+        row = rec.row()
+        await emit(row, file_rows)           # キューに積むだけ (書き出しが詰まっている時だけ待つ)
+        with metrics.timer("write", row["url"]):
+            store.complete(row["url"], row, file_rows)
+        completed += 1
+        if completed % store.checkpoint_every == 0:
+            # 状態 DB のチェックポイントに合わせて出力も fsync (クロールは待たない)
+            for sink in sinks:
+                await sink.checkpoint(wait=False)
+            if graph is not None:
+                graph.flush()
+        metrics.inc("pages_total", engine=row["engine"], success=row["success"])
+        metrics.finish_page(row["url"])
+
+    async def finish_after_redirect(rec: PageRecord, file_rows: list[dict], resolver: RedirectResolver) -> None:
         # ---------- 3xx の場合に最終 URL を追跡 ----------
-        if 300 <= (res.status_code or 0) < 400:
-            try:
-                r = requests.get(res.url, allow_redirects=True, timeout=10)
-                redirect_to = r.url
-                redirect_hops = len(r.history)
-            except requests.RequestException as e:
-                redirect_to = f"ERROR: {e.__class__.__name__}"
-        # --------------------------------------------------
-
-        site_rows.append({
-            "url": res.url,
-            "path": path,
-            "depth": depth,
-            "type": "file" if is_file else "page",
-            "status_code": res.status_code,
-            "success": res.success,
-            "error": res.error_message or "",
-            "redirect_to": redirect_to,
-            "redirect_hops": redirect_hops,
-        })
-        tree_paths.append((depth, path))
-
-        for link in res.links.get("internal", []):
-            href = link.get("href", "")
-            if not href:
-                continue
-            fname = os.path.basename(urlparse(href).path)
-            if os.path.splitext(fname)[1].lower() in FILE_EXTS:
-                file_rows.append({
-                    "page_url": res.url,
-                    "file_name": fname,
-                    "file_url": href,
-                })
-
-
-    # 結果処理ループのあとに追記 ---------- ★ NEW
-    failed_rows = [r for r in site_rows if not r["success"]]
-
-    if failed_rows:
-        with FAILED_CSV.open("w", newline="", encoding="utf-8") as f:
-            w = csv.DictWriter(f, fieldnames=failed_rows[0].keys())
-            w.writeheader(); w.writerows(failed_rows)
-
-    # ---------- CSV 出力 ----------
-    if site_rows:
-        with SITE_CSV.open("w", newline="", encoding="utf-8") as f:
-            w = csv.DictWriter(f, fieldnames=site_rows[0].keys())
-            w.writeheader(); w.writerows(site_rows)
-
-    if file_rows:
-        with FILES_CSV.open("w", newline="", encoding="utf-8") as f:
-            w = csv.DictWriter(f, fieldnames=file_rows[0].keys())
-            w.writeheader(); w.writerows(file_rows)
-
-    # ---------- ツリー (深さ順インデント) ----------
+        try:
+            with metrics.timer("redirect", rec.url):
+                rec.redirect_to, rec.redirect_hops = await resolver.resolve(rec.url)
+        except RESOLVE_ERRORS as e:
+            # 1 行の失敗で他の追跡を巻き込まない
+            rec.redirect_to = f"ERROR: {e.__class__.__name__}"
+        await finish(rec, file_rows)
+
+    metrics.enable_profiling(PROFILE_SLOWEST)
+    timer = PhaseTimer()
+    started = time.perf_counter()
+    engines = Counter()
+
+    # 再開時は前回チェックポイントまでの行から CSV・集計を作り直す
+    pending = set()      # リダイレクト追跡中の行 (クロールと並行して解決)
+    for sink in sinks:
+        sink.start()
+
+    try:
+        timer.start("replay")
+        for row, file_rows in store.iter_results():
+            await emit(row, file_rows)
+
+        async with AsyncExitStack() as stack:
+            crawler = await stack.enter_async_context(lazy_crawler())
+            stack.push_async_callback(close_pool)
+            resolver = await stack.enter_async_context(RedirectResolver(per_host=REDIRECT_PER_HOST))
+            if incremental:
+                await stack.enter_async_context(incremental)
+            if parse_pool:
+                await stack.enter_async_context(parse_pool)
+            if fetcher:
+                await stack.enter_async_context(fetcher)
+            if METRICS_PORT:
+                server = await metrics.serve(METRICS_PORT)
+                stack.push_async_callback(server.wait_closed)
+                stack.callback(server.close)
+                print(f"✓ metrics → http://127.0.0.1:{METRICS_PORT}/metrics")
+            if METRICS_JSONL:
+                stack.callback(asyncio.create_task(
+                    metrics.write_jsonl(Path(METRICS_JSONL), METRICS_INTERVAL)).cancel)
+
+            timer.start("crawl")
+
+            async for res in iter_results(crawler, run_cfg):
+                # 出力に要る項目だけ取り出し、HTML 等を持つ res はこのループ内で手放す
+                rec = PageRecord.from_result(res, base, FILE_EXTS)
+                engines[rec.engine] += 1
+                if page_out and res.html:
+                    await page_out.put({
+                        "url": res.url,
+                        "html": res.html,
+                        "markdown": res.markdown.raw_markdown if res.markdown else None,
+                        "status_code": res.status_code,
+                    })
+
+                file_rows = []
+                hrefs = []
+                for link in res.links.get("internal", []):
+                    href = link.get("href", "")
+                    if not href:
+                        continue
+                    hrefs.append(href)
+                    try:
+                        fname = os.path.basename(urlparse(href).path)
+                    except ValueError:
+                        continue                 # 解釈できない href (IPv6 の括弧が閉じていないなど)
+                    if os.path.splitext(fname)[1].lower() in FILE_EXTS:
+                        file_rows.append({
+                            "page_url": res.url,
+                            "file_name": fname,
+                            "file_url": href,
+                        })
+                if graph is not None:
+                    graph.add_page(res.url, hrefs)
+
+                if 300 <= (res.status_code or 0) < 400 and res.redirected_url and "redirect_hops" in res.metadata:
+                    # httpx で取得したページはリダイレクト先が分かっている
+                    rec.redirect_to = res.redirected_url
+                    rec.redirect_hops = res.metadata["redirect_hops"]
+                    await finish(rec, file_rows)
+                elif 300 <= (res.status_code or 0) < 400:
+                    task = asyncio.create_task(finish_after_redirect(rec, file_rows, resolver))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                else:
+                    await finish(rec, file_rows)
+
+            # クロール終了時点で残っているリダイレクト追跡を待つ
+            timer.start("redirects")
+            if pending:
+                await asyncio.gather(*pending)
+
+            # ---------- 添付ファイルの取得 ----------
+            if HARVEST and file_urls:
+                timer.start("harvest")
+                harvester = await stack.enter_async_context(AttachmentHarvester(
+                    HARVEST_DIR, concurrency=HARVEST_CONCURRENCY, per_host=PER_HOST_CONCURRENCY))
+                async for row in harvester.harvest(sorted(file_urls)):
+                    await attach_out.put(row)
+    finally:
+        for task in pending:
+            task.cancel()
+        store.close()            # 中断時もここまでの状態をチェックポイント
+        if graph is not None:
+            graph.close()
+        for sink in sinks:       # キューに残った行を書き切ってから閉じる
+            await sink.close()
+
+    # ---------- ツリー (インデント / 罫線付き) ----------
+    timer.start("tree")
     with TREE_TXT.open("w", encoding="utf-8") as f:
-        for d, p in sorted(tree_paths, key=lambda x: x[0]):
-            f.write(f"{'    '*d}{os.path.basename(p) or '/'}\n")
-
-    # ---------- 木構造 (anytree) ---------- ★ NEW
-    if Node:
-        root_node = Node("/")
-        node_map = {"/": root_node}
-
-        for _depth, p in tree_paths:
-            parts = [seg for seg in p.split("/") if seg]
-            cur = root_node
-            acc = ""
-            for seg in parts:
-                acc += f"/{seg}"
-                if acc not in node_map:
-                    node_map[acc] = Node(seg, parent=cur)
-                cur = node_map[acc]
-
-        with TREE_FANCY_TXT.open("w", encoding="utf-8") as f:
-            for pre, _, node in RenderTree(root_node):
-                f.write(f"{pre}{node.name}\n")
-    else:
-        print("※ anytree が未インストールのため site_tree_fancy.txt は生成されません")
+        site.write_indented(f, TREE_COLLAPSE)
+    with TREE_FANCY_TXT.open("w", encoding="utf-8") as f:
+        site.write_fancy(f, TREE_COLLAPSE)
 
     # ---------- パス別サマリー ---------- ★ NEW
-    seg_counter, file_counter, err_counter = Counter(), Counter(), Counter()
-    for r in site_rows:
-        # 第一階層（/about/ → about）
-        seg = (r["path"].split("/", 2)[1] if "/" in r["path"][1:] else r["path"].lstrip("/")) or "/"
-        seg_counter[seg] += 1
-        if r["type"] == "file":
-            file_counter[seg] += 1
-        if not r["success"]:
-            err_counter[seg] += 1
-
-    if seg_counter:
+    timer.start("summary")
+    if len(site) > 1:
         with SUMMARY_CSV.open("w", newline="", encoding="utf-8") as f:
             fieldnames = ["segment", "pages", "files", "errors"]
             w = csv.DictWriter(f, fieldnames=fieldnames)
             w.writeheader()
-            for seg in sorted(seg_counter):
-                w.writerow({
-                    "segment": seg,
-                    "pages": seg_counter[seg],
-                    "files": file_counter[seg],
-                    "errors": err_counter[seg],
-                })
+            w.writerows(site.summary())
+
+    # ---------- リンクグラフの集計 ----------
+    graph_report = None
+    if graph is not None and len(graph):
+        timer.start("graph")
+        graph_report = graph.write_reports(OUTPUT_DIR, ROOT_URL)
+
+    timer.stop()
+    with RUN_STATS_JSON.open("w", encoding="utf-8") as f:
+        json.dump({
+            "root_url": ROOT_URL,
+            "rows": site_out.count,
+            "failed": failed_out.count,
+            "elapsed_s": round(time.perf_counter() - started, 3),
+            "engines": dict(engines),
+            "phases": {k: {m: round(v, 3) for m, v in p.items()} for k, p in timer.phases.items()},
+            "metrics": metrics.snapshot(),
+        }, f, ensure_ascii=False, indent=2)
+    if METRICS_JSONL:
+        metrics.append_jsonl(Path(METRICS_JSONL))
+    if metrics.profiler:
+        print(f"✓ 遅いページのプロファイル → {metrics.profiler.dump(PROFILE_DIR)}")
 
     # ---------- 完了ログ ----------
     print(f"✓ site_structure.csv    → {SITE_CSV}")
-    print(f"✓ file_links.csv        → {FILES_CSV}" if file_rows else "（添付ファイル無し）")
+    print(f"✓ file_links.csv        → {FILES_CSV}" if file_out.count else "（添付ファイル無し）")
     print(f"✓ site_tree.txt         → {TREE_TXT}")
-    if Node:
-        print(f"✓ site_tree_fancy.txt   → {TREE_FANCY_TXT}")
-    print(f"✓ site_summary.csv      → {SUMMARY_CSV}")
+    print(f"✓ site_tree_fancy.txt   → {TREE_FANCY_TXT}")
+    if len(site) > 1:
+        print(f"✓ site_summary.csv      → {SUMMARY_CSV}")
+    print(f"✓ run_stats.json        → {RUN_STATS_JSON}")
+    if graph_report:
+        print(f"✓ page_graph.csv        → {PAGE_GRAPH_CSV}（{graph_report['nodes']} URL / "
+              f"{graph_report['edges']} リンク / 孤立 {graph_report['orphans']} / "
+              f"ルートから辿れない {graph_report['unreachable']}）")
+        print(f"✓ broken_links.csv      → {BROKEN_LINKS_CSV}（{graph_report['broken_links']} 件のリンク切れ）")
+    if attach_out.count:
+        print(f"✓ attachments.csv       → {ATTACH_CSV}（"
+              + " / ".join(f"{k} {v}" for k, v in sorted(harvester.counts.items())) + "）")
+    if page_out:
+        archive = page_out.writers[0]
+        print(f"✓ ページアーカイブ      → {PAGE_STORE_DIR}（新規 {archive.stored} / 重複 {archive.deduped}"
+              f" / {archive.raw_bytes:,} → {archive.stored_bytes:,} bytes）")
+    if OUTPUT_FORMAT != "csv":
+        print(f"✓ Parquet               → {PARQUET_DIR}（run_ts={store.run_ts}）")
+    if scheduler:
+        for host, limit, latency, backoffs in scheduler.summary():
+            print(f"  {host:40s} 同時実行 {limit:4.1f} / 平均応答 {latency:5.2f}s / バックオフ {backoffs} 回")
+    if deep_crawl.near_dup:
+        print(f"✓ 近似重複: {deep_crawl.near_dup.duplicates} ページ（{NEAR_DUP}）")
+    if health:
+        for host, error_class, skipped, error in health.summary():
+            print(f"✓ 遮断 {host}（{error_class}）: {skipped} URL を取得せず — {error[:80]}")
+    if profiles:
+        for name, pages, avg_ms, blocked, blocked_bytes, saved in profiles.summary():
+            print(f"✓ 描画 {name:10s} {pages} ページ / 平均 {avg_ms:.0f} ms / 止めたリクエスト {blocked}"
+                  f"（推定 {blocked_bytes / 1e6:.1f} MB）" + (f" / full との差 {-saved:+.0f} ms" if saved is not None else ""))
+    if incremental:
+        print(f"✓ 差分クロール: 未変更 {incremental.unchanged} / 変更 {incremental.changed} / 新規 {incremental.new}")
     # 完了ログ末尾に追記 ---------------（元のコードを書き換え）
-    if failed_rows:
-        print(f"✓ failed_urls.csv       → {FAILED_CSV}（{len(failed_rows)} 件の失敗）")
+    if failed_out.count:
+        print(f"✓ failed_urls.csv       → {FAILED_CSV}（{failed_out.count} 件の失敗）")
     else:
         print("✓ 失敗 URL なし")
     # ---------------------------------
 
 if __name__ == "__main__":
-    asyncio.run(crawl())
+    import argparse
+
+    parser = argparse.ArgumentParser(description="イントラサイトのクロール")
+    parser.add_argument("--resume", action="store_true",
+                        help=f"{STATE_DB.name} に残った状態から前回の続きを再開する")
+    args = parser.parse_args()
+    asyncio.run(crawl(resume=args.resume))
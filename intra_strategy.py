@@ -0,0 +1,410 @@
+"""
+intra_strategy.py
+BFSDeepCrawlStrategy を拡張し、frontier / visited を CrawlStateStore に持たせる。
+途中で止まっても --resume で「未取得 + 取得中だった URL」から続きを再開できる。
+IncrementalCache を渡すと、前回から変わっていないページはブラウザを使わずに再利用し、
+HybridFetcher を渡すと、静的なページは httpx だけで取得してブラウザは JS が要るページに限る。
+どの経路で取得したかは result.metadata["engine"] (cache / http / browser) に、
+取得にかかった時間 (待ち行列の待ち時間は除く) は result.metadata["fetch_ms"] に残し、
+フェーズ別の時間とバイト数・リンク数は metrics に記録する。
+HostScheduler を渡すと、3 つの経路すべてをホスト単位の流量制御の下で 1 URL ずつ実行する。
+BrowserPool を渡すと、ブラウザ描画は entry の crawler ではなくプールから借りたタブで行う。
+ParsePool を渡すと、描画結果のスクレイピング (リンク抽出) はワーカープロセスで行う
+(crawl4ai 側は PassthroughScrapingStrategy で素通りさせておく)。
+NearDupIndex を渡すと、本文がほぼ同じページ (テンプレート違い) を result.metadata["duplicate_of"] に記録し、
+near_dup_mode に応じてそのページの外向きリンクを後回し (defer) / 捨てる (skip)。
+ProfileRouter を渡すと、ブラウザ描画は URL ごとの描画プロファイル (不要なリソースを止める・待ち条件を短くする) で行い、
+使ったプロファイルと止めたリクエスト数・推定バイト数を result.metadata["profile"] / ["blocked"] / ["blocked_bytes"] に残す。
+HostHealth を渡すと、取得の前にホストの名前解決・TCP 接続を確かめ、落ちている / 遮断中のホストの URL は
+取得せずに失敗行 (engine=precheck) にする。RetryPolicy を渡すと、一時的な失敗 (タイムアウト・接続断・5xx・429)
+だけをバックオフ付きで再試行し、分類は result.metadata["error_class"] に残す。
+ResumableBestFirstStrategy は同じ仕組みで、深さ順ではなく url_scorer のスコアが高い順に batch_size 件ずつ取得し、
+各ページのスコアと発見理由を result.metadata["score"] / ["reason"] に残す。
+"""
+
+import asyncio
+import os
+import time
+from collections.abc import AsyncGenerator, Awaitable, Callable
+
+from crawl4ai import AsyncWebCrawler, CrawlerRunConfig, CrawlResult
+from crawl4ai.deep_crawling import BFSDeepCrawlStrategy
+
+from browser_pool import BrowserPool
+from crawl_state import CrawlStateStore, FrontierItem
+from fetch_engine import HybridFetcher
+from host_health import HostHealth, RetryPolicy, classify_error
+from incremental import IncrementalCache
+from metrics import dispatch_ms, metrics
+from near_dup import NearDupIndex, page_text, parse_mode, signature
+from parse_pool import ParsePool
+from render_profiles import ProfileRouter
+from scheduler import HostScheduler
+from url_index import canonicalize
+from url_scorer import CompositeScorer, LinkContext
+
+
+async def first_pass(
+    urls: list[str],
+    fetch: Callable[[str], Awaitable[CrawlResult | None]],
+    leftover: list[str],
+) -> AsyncGenerator[CrawlResult, None]:
+    """fetch を並行に呼び、結果が返ったものは完了順に流し、None の URL は leftover へ"""
+    async def one(url: str):
+        return url, await fetch(url)
+
+    for fut in asyncio.as_completed([one(u) for u in urls]):
+        url, result = await fut
+        if result is None:
+            leftover.append(url)
+        else:
+            yield result
+
+
+def timed(fetch: Callable[[str], Awaitable[CrawlResult | None]], phase: str):
+    """fetch(url) の所要時間を metrics の phase と result.metadata["fetch_ms"] に記録する関数にして返す"""
+    async def run(url: str) -> CrawlResult | None:
+        t0 = time.perf_counter()
+        with metrics.timer(phase, url):
+            result = await fetch(url)
+        if result is not None:
+            result.metadata = result.metadata or {}
+            result.metadata["fetch_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        return result
+    return run
+
+
+class ResumableBFSStrategy(BFSDeepCrawlStrategy):
+    """深さ単位で frontier を取り出し、発見したリンクを store へ積む BFS"""
+    def __init__(
+        self,
+        *args,
+        store: CrawlStateStore,
+        incremental: IncrementalCache | None = None,
+        fetcher: HybridFetcher | None = None,
+        scheduler: HostScheduler | None = None,
+        pool: BrowserPool | None = None,
+        parse_pool: ParsePool | None = None,
+        near_dup: NearDupIndex | None = None,
+        near_dup_mode: str = "skip",
+        profiles: ProfileRouter | None = None,
+        health: HostHealth | None = None,
+        retry: RetryPolicy | None = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.store = store
+        self.incremental = incremental
+        self.fetcher = fetcher
+        self.scheduler = scheduler
+        self.pool = pool
+        self.parse_pool = parse_pool
+        self.near_dup = near_dup
+        self.near_dup_mode = parse_mode(near_dup_mode)      # mark / defer / skip
+        self.profiles = profiles
+        self.health = health
+        self.retry = retry
+        self._deferred: list[tuple[list, str, int]] = []
+
+    def scheduled(self, fetch, phase: str):
+        fetch = timed(fetch, phase)
+        return self.scheduler.wrap(fetch) if self.scheduler else fetch
+
+    async def discover(self, result: CrawlResult, item: FrontierItem) -> None:
+        next_depth = item.depth + 1
+        if next_depth > self.max_depth or self._pages_crawled >= self.max_pages:
+            return
+
+        links = result.links.get("internal", [])
+        if self.include_external:
+            links = links + result.links.get("external", [])
+        metrics.inc("links_found_total", len(links))
+
+        if result.metadata.get("duplicate_of") and self.near_dup_mode != "mark":
+            metrics.inc("links_skipped_total", len(links), reason=f"near_dup_{self.near_dup_mode}")
+            if self.near_dup_mode == "defer":       # 重複でないページのリンクを全部辿った後で積む
+                self._deferred.append((links, item.url, next_depth))
+            return
+
+        with metrics.timer("links", item.url):
+            await self._push_links(links, item.url, next_depth)
+
+    async def dedup(self, result: CrawlResult) -> str | None:
+        """既出ページとほぼ同じ本文なら、その URL を metadata["duplicate_of"] に入れて返す"""
+        if self.near_dup is None or not result.html:
+            return None
+        t0 = time.perf_counter()
+        if self.parse_pool is not None:
+            sig = await self.parse_pool.fingerprint(result.html)
+        else:
+            with metrics.timer("dedup", result.url):
+                sig = signature(page_text(result.html))
+        dup = self.near_dup.check(result.url, sig)
+        if self.parse_pool is not None:
+            metrics.record("dedup", time.perf_counter() - t0, result.url)
+        if dup is not None:
+            result.metadata["duplicate_of"] = dup
+            metrics.inc("near_duplicates_total")
+        return dup
+
+    async def _candidates(self, links: list, parent: str, next_depth: int):
+        """未訪問でフィルタを通るリンクを (正規化 URL, link) で流す"""
+        for link in links:
+            href = link.get("href")
+            if not href:
+                continue
+            url = canonicalize(href, parent)
+            if url is None:
+                self.stats.urls_skipped += 1         # 解釈できない href (壊れたポート番号など)
+                continue
+            if self.store.seen(url):
+                continue
+            if not await self.can_process_url(url, next_depth):
+                self.stats.urls_skipped += 1
+                continue
+            yield url, link
+
+    async def _push_links(self, links: list, parent: str, next_depth: int) -> None:
+        async for url, _ in self._candidates(links, parent, next_depth):
+            self.store.push(url, next_depth, parent)
+
+    def next_batch(self) -> list[FrontierItem]:
+        """次に取得する URL の組 (BFS は同じ深さのものをまとめて)"""
+        return self.store.pop_level()
+
+    async def fetch_level(
+        self,
+        urls: list[str],
+        crawler: AsyncWebCrawler,
+        config: CrawlerRunConfig,
+    ) -> AsyncGenerator[CrawlResult, None]:
+        """1 階層分の URL を取得して届いた順に流す。一時的な失敗は残りを流し終えてから待って取り直す"""
+        attempt = 0
+        while urls:
+            retry: list[str] = []
+            async for result in self._fetch_once(urls, crawler, config):
+                if self.health:
+                    error_class = self.health.observe(result)
+                else:
+                    error_class = classify_error(result.error_message, result.status_code)
+                    result.metadata = result.metadata or {}
+                    result.metadata["error_class"] = error_class
+                if (self.retry and self.retry.should_retry(error_class, attempt)
+                        and not (self.health and self.health.is_open(result.url))):
+                    metrics.inc("retries_total", reason=error_class)
+                    retry.append(result.url)
+                    continue
+                yield result
+            attempt += 1
+            if retry:
+                await asyncio.sleep(self.retry.delay(attempt))
+            urls = retry
+
+    async def _fetch_once(
+        self,
+        urls: list[str],
+        crawler: AsyncWebCrawler,
+        config: CrawlerRunConfig,
+    ) -> AsyncGenerator[CrawlResult, None]:
+        """ホストの事前確認 → 差分キャッシュ → HTTP → ブラウザ の順に試し、届いた順に流す"""
+        if self.health:
+            alive: list[str] = []
+            async for result in first_pass(urls, timed(self.health.precheck, "precheck"), alive):
+                yield result
+            urls = alive
+
+        if self.incremental:
+            changed: list[str] = []
+            async for result in first_pass(urls, self.scheduled(self.incremental.check, "cache_check"), changed):
+                result.metadata["engine"] = "cache"
+                yield result
+            urls = changed
+
+        if self.fetcher:
+            dynamic: list[str] = []
+            async for result in first_pass(urls, self.scheduled(self.fetcher.fetch, "http_fetch"), dynamic):
+                if self.incremental:
+                    self.incremental.update(result)
+                yield result
+            urls = dynamic
+
+        if not urls:
+            return
+        async for result in self.render_level(urls, crawler, config):
+            result.metadata = result.metadata or {}
+            result.metadata["engine"] = "browser"
+            if "fetch_ms" not in result.metadata:
+                result.metadata["fetch_ms"] = dispatch_ms(result)
+                if result.metadata["fetch_ms"] is not None:
+                    metrics.record("browser", result.metadata["fetch_ms"] / 1000, result.url)
+            if self.profiles:
+                result.metadata.update(self.profiles.pop_stats(result.url, result.metadata["fetch_ms"]))
+            metrics.inc("bytes_total", len(result.html or ""), engine="browser")
+            if self.incremental:
+                self.incremental.update(result)
+            yield result
+
+    async def scrape(self, result: CrawlResult) -> CrawlResult:
+        """parse_pool があれば描画済み HTML のスクレイピングをワーカープロセスで行う"""
+        if self.parse_pool is None or not result.success or not result.html:
+            return result
+        t0 = time.perf_counter()
+        scraped = await self.parse_pool.scrape(result.url, result.html)
+        metrics.record("scrape", time.perf_counter() - t0, result.url)
+        return self.parse_pool.apply(result, scraped)
+
+    async def scrape_stream(self, results) -> AsyncGenerator[CrawlResult, None]:
+        """arun_many の結果を並行にスクレイピングし、終わった順に流す
+        (処理待ちが max_pending 件に達したら次の結果を取りに行かない)"""
+        if self.parse_pool is None:
+            async for result in results:
+                yield result
+            return
+        pending = set()
+        try:
+            async for result in results:
+                pending.add(asyncio.create_task(self.scrape(result)))
+                if len(pending) >= self.parse_pool.max_pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.result()
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            # 受け手が途中でやめた (max_pages に達したなど) 時に残りのスクレイピングを止める
+            for task in pending:
+                task.cancel()
+
+    async def render_level(
+        self,
+        urls: list[str],
+        crawler: AsyncWebCrawler,
+        config: CrawlerRunConfig,
+    ) -> AsyncGenerator[CrawlResult, None]:
+        """ブラウザで描画。スケジューラ有りなら 1 URL ずつ、無しなら arun_many でまとめて
+        (描画プロファイルがあれば、プロファイルごとに待ち条件を変えた config で)"""
+        if self.profiles and self.pool is None:
+            self.profiles.install(crawler)          # プールのブラウザには起動時に登録済み
+
+        if self.scheduler:
+            async def render(url: str) -> CrawlResult:
+                cfg = self.profiles.profile_for(url).run_config(config) if self.profiles else config
+                if self.pool is None:
+                    result = (await crawler.arun(url, config=cfg))[0]
+                else:
+                    async with self.pool.lease() as leased:
+                        result = (await leased.arun(url, config=cfg))[0]
+                # タブは返してからパース。ホストの枠はパースが終わるまで持ったままにする
+                return await self.scrape(result)
+            async for result in first_pass(urls, self.scheduled(render, "browser"), []):
+                yield result
+        else:
+            groups = self.profiles.group(urls).items() if self.profiles else [(None, urls)]
+            for profile, group in groups:
+                cfg = profile.run_config(config) if profile else config
+                async for result in self._render_many(group, crawler, cfg):
+                    yield result
+
+    async def _render_many(
+        self,
+        urls: list[str],
+        crawler: AsyncWebCrawler,
+        config: CrawlerRunConfig,
+    ) -> AsyncGenerator[CrawlResult, None]:
+        if self.pool is None:
+            async for result in self.scrape_stream(await crawler.arun_many(urls=urls, config=config)):
+                yield result
+        else:
+            # 借りたタブの枚数までしか同時に描画しない (既定のディスパッチャだと上限を超える)
+            tabs = min(len(urls), self.pool.tabs)
+            async with self.pool.lease(len(urls), tabs=tabs) as leased:
+                results = await leased.arun_many(urls=urls, config=config, dispatcher=self.pool.dispatcher(tabs))
+                async for result in self.scrape_stream(results):
+                    yield result
+
+    async def _arun_stream(
+        self,
+        start_url: str,
+        crawler: AsyncWebCrawler,
+        config: CrawlerRunConfig,
+    ) -> AsyncGenerator[CrawlResult, None]:
+        store = self.store
+        if not store.resumed:
+            root = canonicalize(start_url)
+            if root is None:
+                raise ValueError(f"起点の URL を解釈できません: {start_url}")
+            store.push(root, 0, None)
+        self._pages_crawled = store.pages_crawled
+
+        stream_config = config.clone(deep_crawl_strategy=None, stream=True)
+        while not self._cancel_event.is_set() and self._pages_crawled < self.max_pages:
+            level = {item.url: item for item in self.next_batch()}
+            if not level:
+                if self._deferred:                   # 後回しにした重複ページのリンクをここで積む
+                    for links, parent, next_depth in self._deferred:
+                        await self._push_links(links, parent, next_depth)
+                    self._deferred.clear()
+                    continue
+                if await store.wait_for_work():      # 分散時は他のワーカーが積むのを待つ
+                    continue
+                break
+
+            async for result in self.fetch_level(list(level), crawler, stream_config):
+                item = level.get(result.url) or FrontierItem(result.url, 0, None)
+                result.metadata = result.metadata or {}
+                result.metadata["depth"] = item.depth
+                result.metadata["parent_url"] = item.parent
+                if item.reason:
+                    result.metadata["score"] = item.score
+                    result.metadata["reason"] = item.reason
+
+                if result.success:
+                    self._pages_crawled += 1
+                    # 受け手が finish_page で内訳を確定する前に links フェーズまで済ませておく
+                    await self.dedup(result)
+                    await self.discover(result, item)
+                yield result
+
+                if self._pages_crawled >= self.max_pages:
+                    self.logger.info(f"Max pages limit ({self.max_pages}) reached, stopping crawl")
+                    break
+
+    async def _arun_batch(
+        self,
+        start_url: str,
+        crawler: AsyncWebCrawler,
+        config: CrawlerRunConfig,
+    ) -> list[CrawlResult]:
+        return [r async for r in self._arun_stream(start_url, crawler, config)]
+
+
+class ResumableBestFirstStrategy(ResumableBFSStrategy):
+    """frontier をスコア順に取り出す best-first 版 (store は best_first=True で作る)"""
+    def __init__(
+        self,
+        *args,
+        scorer: CompositeScorer,
+        file_exts: set[str] = frozenset(),
+        batch_size: int = 16,
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.scorer = scorer
+        self.file_exts = file_exts
+        self.batch_size = batch_size
+
+    def next_batch(self) -> list[FrontierItem]:
+        # 小さめに取り出すほど、直前に見つかった高スコアのリンクが早く順番に入る
+        return self.store.pop_best(self.batch_size)
+
+    async def _push_links(self, links: list, parent: str, next_depth: int) -> None:
+        files = sum(
+            os.path.splitext(link.get("href", "").split("?", 1)[0])[1].lower() in self.file_exts
+            for link in links)
+        density = files / len(links) if links else 0.0
+        async for url, link in self._candidates(links, parent, next_depth):
+            score, reason = self.scorer.score(LinkContext(
+                url, parent, next_depth, (link.get("text") or "").strip(), density))
+            self.store.push(url, next_depth, parent, score, reason or "-")
@@ -0,0 +1,322 @@
+"""
+link_graph.py
+クロール中に見つけたページ間リンク (internal) をそのまま残し、クロール後に集計する。
+- URL は整数 ID に置き換え (URL 本体は UTF-8 で 1 本の bytearray に連結)、辺は (元, 先) の uint32 の array
+- 辺とノードは見つけたそばから <dir>/ に追記するので、中断しても --resume で続きから積める
+      nodes.tsv   … ID 順の URL (1 行 1 URL。行番号 = ID)
+      edges.u32   … (元 ID, 先 ID) の uint32 の組 (ネイティブのバイト順)
+      visits.i32  … (ID, ステータス) の int32 の組 (-1 はステータス無しの失敗)
+- 集計は NumPy の疎行列表現 (CSR) で: 被リンク数・孤立ページ・リンク切れの張り元・
+  ルートからの最短クリック数・PageRank。書き出すのは page_graph.csv と broken_links.csv
+
+    graph = LinkGraph(OUTPUT_DIR / "link_graph")
+    graph.add_page(res.url, [link["href"] for link in res.links["internal"]])
+    graph.visit(res.url, res.status_code, res.success)
+    graph.close()
+    graph.write_reports(OUTPUT_DIR, ROOT_URL)
+
+    python link_graph.py crawl_results/link_graph --root https://www.python.org/
+"""
+
+import csv
+from array import array
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+import numpy as np
+
+from url_index import canonicalize
+
+NODES, EDGES, VISITS = "nodes.tsv", "edges.u32", "visits.i32"
+FAILED = -1
+
+
+def _unique(values: np.ndarray) -> np.ndarray:
+    """ソートして隣と違うものだけ残す (np.unique より速い)"""
+    values = np.sort(values)
+    keep = np.empty(len(values), dtype=bool)
+    keep[:1] = True
+    np.not_equal(values[1:], values[:-1], out=keep[1:])
+    return values[keep]
+
+
+class LinkGraph:
+    def __init__(self, directory: Path | None = None, *, resume: bool = False) -> None:
+        self._ids: dict[int, int] = {}          # hash(URL) → ID (衝突したら +1 して探す)
+        self._offsets = array("Q", [0])         # ID i の URL は _urls[_offsets[i]:_offsets[i+1]]
+        self._urls = bytearray()
+        self.src = array("I")
+        self.dst = array("I")
+        self.status = array("i")                # 0: 未取得
+        self.directory = directory
+        self._files = None
+        self._edge_cache = None
+        if directory is not None:
+            directory.mkdir(parents=True, exist_ok=True)
+            if resume:
+                self._load(directory)
+                self._rewrite(directory)
+            mode = "ab" if resume else "wb"
+            self._files = tuple((directory / name).open(mode) for name in (NODES, EDGES, VISITS))
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    # ---------- ID ----------
+    def url(self, node: int) -> str:
+        return self._urls[self._offsets[node]:self._offsets[node + 1]].decode()
+
+    def _find(self, url: str, data: bytes, create: bool) -> int | None:
+        key = hash(url)
+        while True:
+            node = self._ids.get(key)
+            if node is None:
+                if not create:
+                    return None
+                node = self._ids[key] = len(self)
+                self._urls += data
+                self._offsets.append(len(self._urls))
+                self.status.append(0)
+                if self._files:
+                    self._files[0].write(data + b"\n")
+                return node
+            if self._urls[self._offsets[node]:self._offsets[node + 1]] == data:
+                return node
+            key += 1
+
+    def _root(self, root_url: str) -> int | None:
+        url = canonicalize(root_url)
+        return self.get(url) if url is not None else None
+
+    def node(self, url: str) -> int:
+        return self._find(url, url.encode(), True)
+
+    def get(self, url: str) -> int | None:
+        return self._find(url, url.encode(), False)
+
+    # ---------- 追加 ----------
+    def add_page(self, url: str, hrefs: Iterable[str]) -> int:
+        """url から hrefs への辺を足す (同じページ内の重複と自己リンクは除く)。足した辺の数を返す"""
+        src = self.node(url)
+        targets = set()
+        for href in hrefs:
+            if href:
+                # 既にある URL と完全一致すれば正規化済み (正規化は冪等) なので canonicalize() を省く
+                node = self.get(href)
+                if node is None:
+                    url = canonicalize(href)
+                    if url is None:
+                        continue                 # 解釈できない href (壊れたポート番号など) は辺にしない
+                    node = self.node(url)
+                targets.add(node)
+        targets.discard(src)
+        if not targets:
+            return 0
+        pairs = array("I")
+        for dst in targets:
+            pairs.extend((src, dst))
+        self.src.extend(pairs[0::2])
+        self.dst.extend(pairs[1::2])
+        if self._files:
+            self._files[1].write(pairs.tobytes())
+        return len(targets)
+
+    def visit(self, url: str, status_code: int | None, success: bool) -> None:
+        node = self.node(url)
+        status = int(status_code or 0) or (200 if success else FAILED)
+        if self.status[node] != status:
+            self.status[node] = status
+            if self._files:
+                self._files[2].write(array("i", (node, status)).tobytes())
+
+    def flush(self) -> None:
+        for f in self._files or ():
+            f.flush()
+
+    def close(self) -> None:
+        for f in self._files or ():
+            f.close()
+        self._files = None
+
+    def nbytes(self) -> int:
+        arrays = (self._offsets, self.src, self.dst, self.status)
+        return sum(a.buffer_info()[1] * a.itemsize for a in arrays) + len(self._urls)
+
+    # ---------- 読み込み ----------
+    def _load(self, directory: Path) -> None:
+        """追記済みのファイルから復元 (途中で切れた末尾は捨てる)"""
+        remap = array("I")
+        nodes = directory / NODES
+        if nodes.exists():
+            with nodes.open("rb") as f:
+                for line in f:
+                    if line.endswith(b"\n"):
+                        remap.append(self.node(line[:-1].decode()))
+        self._extend_edges(directory / EDGES, remap)
+        self._extend_visits(directory / VISITS, remap)
+
+    def _rewrite(self, directory: Path) -> None:
+        """読めた分だけで書き直す (途中で切れた末尾の後ろに追記しないように)"""
+        (directory / NODES).write_bytes(b"".join(self.url(i).encode() + b"\n" for i in range(len(self))))
+        pairs = array("I", bytes(8 * len(self.src)))
+        pairs[0::2], pairs[1::2] = self.src, self.dst
+        (directory / EDGES).write_bytes(pairs.tobytes())
+        crawled = [i for i in range(len(self)) if self.status[i]]
+        visits = array("i", bytes(8 * len(crawled)))
+        visits[0::2] = array("i", crawled)
+        visits[1::2] = array("i", (self.status[i] for i in crawled))
+        (directory / VISITS).write_bytes(visits.tobytes())
+
+    def _extend_edges(self, path: Path, remap: array) -> None:
+        if not path.exists():
+            return
+        data = path.read_bytes()
+        pairs = np.frombuffer(data[:len(data) // 8 * 8], dtype=np.uint32).reshape(-1, 2)
+        pairs = pairs[(pairs < len(remap)).all(axis=1)]           # ノードより先に書かれた辺は捨てる
+        ids = np.frombuffer(remap, dtype=np.uint32)[pairs]
+        self.src.frombytes(ids[:, 0].tobytes())
+        self.dst.frombytes(ids[:, 1].tobytes())
+
+    def _extend_visits(self, path: Path, remap: array) -> None:
+        if not path.exists():
+            return
+        data = path.read_bytes()
+        visits = array("i", data[:len(data) // 8 * 8])
+        for i in range(0, len(visits), 2):
+            if visits[i] < len(remap):
+                self.status[remap[visits[i]]] = visits[i + 1]
+
+    @classmethod
+    def load(cls, *directories: Path) -> "LinkGraph":
+        """1 つ以上の出力ディレクトリ (分散クロールならシャードごとの link_graph/) を 1 つのグラフに"""
+        graph = cls()
+        for directory in directories:
+            graph._load(directory)
+        return graph
+
+    # ---------- 集計 ----------
+    def _edges(self) -> tuple[np.ndarray, np.ndarray]:
+        """重複を除いた (元, 先) を元 → 先の順で。再開時に取り直したページの辺が二重に入っていても 1 本に"""
+        if self._edge_cache and self._edge_cache[0] == len(self.src):
+            return self._edge_cache[1]
+        src = np.frombuffer(self.src, dtype=np.uint32).astype(np.uint64)
+        dst = np.frombuffer(self.dst, dtype=np.uint32).astype(np.uint64)
+        keys = _unique((src << np.uint64(32)) | dst)
+        edges = (keys >> np.uint64(32)).astype(np.int64), (keys & np.uint64(0xFFFFFFFF)).astype(np.int64)
+        self._edge_cache = (len(self.src), edges)
+        return edges
+
+    def analyze(self, root_url: str, *, damping: float = 0.85, iterations: int = 100,
+                tol: float = 1e-9) -> dict[str, np.ndarray]:
+        """ノードごとの in_degree / out_degree / click_depth (届かなければ -1) / pagerank"""
+        n = len(self)
+        src, dst = self._edges()             # src 順に並んでいる (= CSR の indices)
+        in_degree = np.bincount(dst, minlength=n)
+        out_degree = np.bincount(src, minlength=n)
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(out_degree, out=indptr[1:])
+        return {
+            "in_degree": in_degree,
+            "out_degree": out_degree,
+            "click_depth": self._click_depth(indptr, dst, self._root(root_url)),
+            "pagerank": self._pagerank(src, dst, out_degree, damping, iterations, tol),
+        }
+
+    @staticmethod
+    def _click_depth(indptr: np.ndarray, indices: np.ndarray, root: int | None) -> np.ndarray:
+        """ルートからの幅優先探索 (1 段ずつ、段内の隣接ノードはまとめて取り出す)"""
+        depth = np.full(len(indptr) - 1, -1, dtype=np.int32)
+        if root is None:
+            return depth
+        depth[root] = 0
+        frontier = np.array([root], dtype=np.int64)
+        level = 0
+        while frontier.size:
+            starts, counts = indptr[frontier], indptr[frontier + 1] - indptr[frontier]
+            total = int(counts.sum())
+            if not total:
+                break
+            # 各 frontier ノードの隣接範囲 [start, start + count) を 1 本の添字列に
+            offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            neighbours = indices[np.repeat(starts, counts) + offsets]
+            frontier = _unique(neighbours[depth[neighbours] < 0])
+            level += 1
+            depth[frontier] = level
+        return depth
+
+    @staticmethod
+    def _pagerank(src: np.ndarray, dst: np.ndarray, out_degree: np.ndarray,
+                  damping: float, iterations: int, tol: float) -> np.ndarray:
+        n = len(out_degree)
+        if not n:
+            return np.zeros(0)
+        rank = np.full(n, 1.0 / n)
+        weight = 1.0 / out_degree[src]
+        dangling = out_degree == 0
+        for _ in range(iterations):
+            spread = np.bincount(dst, weights=rank[src] * weight, minlength=n)
+            new = (1 - damping) / n + damping * (spread + rank[dangling].sum() / n)
+            delta = np.abs(new - rank).sum()
+            rank = new
+            if delta < tol:
+                break
+        return rank
+
+    def broken_links(self) -> Iterator[tuple[str, str, int]]:
+        """(張り元 URL, リンク先 URL, リンク先のステータス)。リンク先が 4xx / 5xx / 取得失敗のもの"""
+        status = np.frombuffer(self.status, dtype=np.int32)
+        src, dst = self._edges()
+        broken = (status[dst] >= 400) | (status[dst] == FAILED)
+        for s, d in zip(src[broken].tolist(), dst[broken].tolist()):
+            yield self.url(s), self.url(d), int(status[d])
+
+    def write_reports(self, out_dir: Path, root_url: str) -> dict:
+        """page_graph.csv (取得したページごと、PageRank 順) と broken_links.csv を書き、件数を返す"""
+        stats = self.analyze(root_url)
+        status = np.frombuffer(self.status, dtype=np.int32)
+        crawled = np.flatnonzero(status != 0)
+        root = self._root(root_url)
+        orphans = crawled[(stats["in_degree"][crawled] == 0) & (crawled != (root if root is not None else -1))]
+        order = crawled[np.argsort(-stats["pagerank"][crawled], kind="stable")]
+        with (out_dir / "page_graph.csv").open("w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["url", "status_code", "click_depth", "in_links", "out_links", "pagerank", "orphan"])
+            orphan_set = set(orphans.tolist())
+            for i in order.tolist():
+                w.writerow([self.url(i), int(status[i]) if status[i] > 0 else "", int(stats["click_depth"][i]),
+                            int(stats["in_degree"][i]), int(stats["out_degree"][i]),
+                            f"{stats['pagerank'][i]:.6g}", i in orphan_set])
+        broken = 0
+        with (out_dir / "broken_links.csv").open("w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["source_url", "target_url", "status_code"])
+            for source, target, code in self.broken_links():
+                w.writerow([source, target, code if code > 0 else ""])
+                broken += 1
+        return {
+            "nodes": len(self),
+            "edges": len(self.src),
+            "crawled": len(crawled),
+            "orphans": len(orphans),
+            "unreachable": int((stats["click_depth"][crawled] < 0).sum()),
+            "broken_links": broken,
+            "nbytes": self.nbytes(),
+        }
+
+
+def main(directories: list[Path], root_url: str, out_dir: Path) -> None:
+    graph = LinkGraph.load(*directories)
+    report = graph.write_reports(out_dir, root_url)
+    print(f"✓ page_graph.csv / broken_links.csv → {out_dir}")
+    print("  " + " / ".join(f"{k} {v:,}" for k, v in report.items()))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="link_graph/ からリンク集計を作り直す")
+    parser.add_argument("directories", type=Path, nargs="+", help="intra_crawler の link_graph/ (シャードごとなら複数)")
+    parser.add_argument("--root", required=True, help="クリック数を数える起点の URL")
+    parser.add_argument("--out", type=Path, default=Path("."))
+    args = parser.parse_args()
+    main(args.directories, args.root, args.out)
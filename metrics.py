@@ -0,0 +1,277 @@
+"""
+metrics.py
+クロールの各フェーズの所要時間とカウンタを集める計測層。
+- metrics.timer(phase, url) … フェーズの所要時間をヒストグラムと URL ごとの内訳に記録
+- metrics.inc(name, n, **labels) … バイト数・リンク数・リトライ回数などのカウンタ
+- serve(port)       … Prometheus 形式のテキストを http://127.0.0.1:<port>/metrics で返す
+- write_jsonl(path) … interval 秒ごとにスナップショットを JSONL へ追記
+- enable_profiling(n) … 同期処理の区間 (パース・スクレイピング・書き出し) を cProfile / tracemalloc で測り、
+                         合計時間が遅い n ページ分だけ .prof を残す
+
+フェーズ名
+  queue_wait  … スケジューラの枠・トークン待ち        cache_check … 差分クロールの条件付き GET
+  http_fetch  … httpx での取得 (parse を含む)         parse       … HTML パース・JS 要否判定・リンク抽出
+  browser     … ブラウザでの描画 (scrape を含む)      scrape      … crawl4ai のスクレイピング (LXML)
+  links       … 発見リンクの正規化・frontier 投入     redirect    … 3xx の最終 URL 追跡
+  dedup       … 本文の MinHash 計算と近似重複の照合
+  write       … 状態 DB への記録 (CSV・Parquet は result_sink が別スレッドでまとめ書き)
+"""
+
+import asyncio
+import cProfile
+import heapq
+import json
+import time
+import tracemalloc
+from bisect import bisect_left
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+from crawl4ai import CrawlResult, LXMLWebScrapingStrategy
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PROFILED_PHASES = {"parse", "scrape", "dedup", "links", "write"}     # 同期処理なので区間が重ならない
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt(name: str, labels: Labels) -> str:
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class PhaseTimer:
+    """実行全体のフェーズごとの経過時間と CPU 時間 (このプロセス分) を積算。start() で前のフェーズを閉じる"""
+    def __init__(self) -> None:
+        self.phases: dict[str, dict[str, float]] = {}
+        self._cur = None
+
+    def start(self, name: str) -> None:
+        self.stop()
+        self._cur = (name, time.perf_counter(), time.process_time())
+
+    def stop(self) -> None:
+        if self._cur is None:
+            return
+        name, t0, c0 = self._cur
+        p = self.phases.setdefault(name, {"wall_s": 0.0, "cpu_s": 0.0})
+        p["wall_s"] += time.perf_counter() - t0
+        p["cpu_s"] += time.process_time() - c0
+        self._cur = None
+
+
+class SlowPageProfiler:
+    """ページごとに cProfile と tracemalloc のピークを取り、合計時間の遅い keep ページ分だけ残す"""
+    def __init__(self, keep: int) -> None:
+        self.keep = keep
+        self._profiles: dict[str, cProfile.Profile] = {}
+        self._peaks: dict[str, int] = {}
+        self._slowest: list[tuple[float, str, dict, cProfile.Profile | None, int]] = []
+        self._active = False
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def section(self, url: str) -> Iterator[None]:
+        if self._active:                         # 入れ子になった区間は外側で測る
+            yield
+            return
+        prof = self._profiles.setdefault(url, cProfile.Profile())
+        self._active = True
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        prof.enable()
+        try:
+            yield
+        finally:
+            prof.disable()
+            self._active = False
+            peak = tracemalloc.get_traced_memory()[1] - base
+            self._peaks[url] = max(self._peaks.get(url, 0), peak)
+
+    def page_done(self, url: str, phases: dict[str, float]) -> None:
+        item = (sum(phases.values()), url, phases, self._profiles.pop(url, None), self._peaks.pop(url, 0))
+        if len(self._slowest) < self.keep:
+            heapq.heappush(self._slowest, item)
+        else:
+            heapq.heappushpop(self._slowest, item)
+
+    def dump(self, directory: Path) -> Path:
+        """遅い順に NN.prof (pstats で読める) と index.json を書き出す"""
+        directory.mkdir(parents=True, exist_ok=True)
+        index = []
+        for rank, (total_ms, url, phases, prof, peak) in enumerate(
+                sorted(self._slowest, reverse=True), start=1):
+            entry = {
+                "rank": rank,
+                "url": url,
+                "total_ms": round(total_ms, 1),
+                "phases_ms": {k: round(v, 1) for k, v in phases.items()},
+                "peak_alloc_bytes": peak,
+                "profile": None,
+            }
+            if prof is not None:
+                entry["profile"] = f"{rank:02d}.prof"
+                prof.dump_stats(directory / entry["profile"])
+            index.append(entry)
+        path = directory / "index.json"
+        path.write_text(json.dumps(index, ensure_ascii=False, indent=2), encoding="utf-8")
+        return path
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self.counters: dict[tuple[str, Labels], float] = defaultdict(float)
+        self.histograms: dict[tuple[str, Labels], Histogram] = {}
+        self.pages: dict[str, dict[str, float]] = {}     # 処理中 URL のフェーズ別内訳 (ms)
+        self.profiler: SlowPageProfiler | None = None
+        self.started = time.time()
+
+    # ---------- 記録 ----------
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        self.counters[(name, _labels(labels))] += value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, _labels(labels))
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = Histogram()
+        hist.observe(value)
+
+    def record(self, phase: str, seconds: float, url: str | None = None) -> None:
+        self.observe("phase_seconds", seconds, phase=phase)
+        if url is not None:
+            page = self.pages.setdefault(url, {})
+            page[phase] = page.get(phase, 0.0) + seconds * 1000
+
+    @contextmanager
+    def timer(self, phase: str, url: str | None = None) -> Iterator[None]:
+        profiled = self.profiler is not None and url is not None and phase in PROFILED_PHASES
+        t0 = time.perf_counter()
+        try:
+            with self.profiler.section(url) if profiled else nullcontext():
+                yield
+        finally:
+            self.record(phase, time.perf_counter() - t0, url)
+
+    def finish_page(self, url: str) -> dict[str, float]:
+        """URL の内訳を確定して返す (プロファイル対象の選別もここで行う)"""
+        phases = self.pages.pop(url, {})
+        if self.profiler is not None:
+            self.profiler.page_done(url, phases)
+        return phases
+
+    def enable_profiling(self, keep: int) -> None:
+        self.profiler = SlowPageProfiler(keep) if keep > 0 else None
+
+    # ---------- 出力 ----------
+    def snapshot(self) -> dict:
+        return {
+            "ts": round(time.time(), 3),
+            "uptime_s": round(time.time() - self.started, 3),
+            "counters": {_fmt(n, l): v for (n, l), v in sorted(self.counters.items())},
+            "phases": {
+                dict(l).get("phase", _fmt(n, l)): {
+                    "count": h.count,
+                    "sum_s": round(h.sum, 4),
+                    "avg_ms": round(h.sum / h.count * 1000, 2) if h.count else 0.0,
+                }
+                for (n, l), h in sorted(self.histograms.items())
+            },
+            "in_flight": len(self.pages),
+        }
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for name in sorted({n for n, _ in self.counters}):
+            lines.append(f"# TYPE crawl_{name} counter")
+            for (n, labels), value in sorted(self.counters.items()):
+                if n == name:
+                    lines.append(f"{_fmt('crawl_' + n, labels)} {value:g}")
+        for name in sorted({n for n, _ in self.histograms}):
+            lines.append(f"# TYPE crawl_{name} histogram")
+            for (n, labels), h in sorted(self.histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for le, c in zip([*map(str, h.buckets), "+Inf"], h.counts):
+                    cumulative += c
+                    lines.append(f"{_fmt(f'crawl_{n}_bucket', labels + (('le', le),))} {cumulative}")
+                lines.append(f"{_fmt(f'crawl_{n}_sum', labels)} {h.sum:.6f}")
+                lines.append(f"{_fmt(f'crawl_{n}_count', labels)} {h.count}")
+        lines.append(f"crawl_in_flight_pages {len(self.pages)}")
+        return "\n".join(lines) + "\n"
+
+    # ---------- 公開 ----------
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = (await reader.readline()).split()
+            while (await reader.readline()).strip():
+                pass
+            if len(request) > 1 and request[1].split(b"?")[0] == b"/metrics":
+                status, body = "200 OK", self.render_prometheus().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, port: int, host: str = "127.0.0.1") -> asyncio.AbstractServer:
+        return await asyncio.start_server(self._handle, host, port)
+
+    async def write_jsonl(self, path: Path, interval: float = 10.0) -> None:
+        """キャンセルされるまで interval 秒ごとにスナップショットを追記"""
+        while True:
+            await asyncio.sleep(interval)
+            self.append_jsonl(path)
+
+    def append_jsonl(self, path: Path) -> None:
+        with path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(self.snapshot(), ensure_ascii=False) + "\n")
+
+
+def dispatch_ms(result: CrawlResult) -> float | None:
+    """arun_many の dispatcher が記録した開始・終了時刻から所要時間を求める"""
+    d = result.dispatch_result
+    if d is None:
+        return None
+    elapsed = d.end_time - d.start_time
+    if isinstance(elapsed, float):
+        return round(elapsed * 1000, 1)
+    return round(elapsed.total_seconds() * 1000, 1)
+
+
+class TimedLXMLScrapingStrategy(LXMLWebScrapingStrategy):
+    """crawl4ai 内部のスクレイピング時間を scrape フェーズとして記録する"""
+    def scrap(self, url: str, html: str, **kwargs):
+        with metrics.timer("scrape", url):
+            return super().scrap(url, html, **kwargs)
+
+
+metrics = Metrics()
@@ -0,0 +1,134 @@
+"""
+near_dup.py
+ほぼ同じ内容のページ (カレンダー・タグ一覧・印刷用ビューなどのテンプレート違い) を見つける。
+- page_text()  … 本文テキスト (script / style / nav / header / footer / aside は除く)
+- signature()  … 単語 k-gram (shingle) の 64bit ハッシュに対する MinHash。NumPy でまとめて計算
+- NearDupIndex … MinHash を bands × rows に分けた LSH。同じバケットに入った既出ページのうち
+                 推定 Jaccard 類似度が threshold 以上のものを「重複元」として返す
+- parse_mode() … NEAR_DUP の値 (off / mark / defer / skip) の検査
+
+    index = NearDupIndex(threshold=0.8)
+    dup = index.check(url, signature(page_text(html)))   # 重複元の URL か None (None なら索引に追加)
+"""
+
+import re
+import zlib
+
+import numpy as np
+
+from fetch_engine import parse_html
+
+NUM_PERM = 64
+SHINGLE = 5
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+_WORD = re.compile(r"\w+")
+MODES = ("off", "mark", "defer", "skip")
+
+_rng = np.random.default_rng(0x5EED)                 # 実行・プロセスをまたいで同じ置換を使う
+_A = _rng.integers(1, 2**63, size=NUM_PERM, dtype=np.uint64) | np.uint64(1)   # 奇数 (multiply-shift)
+_B = _rng.integers(0, 2**63, size=NUM_PERM, dtype=np.uint64)
+
+
+def parse_mode(value: str) -> str:
+    """重複ページの扱いを検査して返す (打ち間違いが黙って skip 扱いにならないように)"""
+    mode = value.strip()
+    if mode not in MODES:
+        raise ValueError(f"未知の NEAR_DUP: {value} ({' / '.join(MODES)})")
+    return mode
+
+
+def page_text(html: str) -> str:
+    doc = parse_html(html or "")
+    if doc is None:
+        return ""
+    for el in doc.xpath("//script|//style|//noscript|//template|//nav|//header|//footer|//aside"):
+        el.drop_tree()
+    body = doc.find("body")
+    return (body if body is not None else doc).text_content()
+
+
+def shingle_hashes(text: str, k: int = SHINGLE) -> np.ndarray:
+    """小文字化した単語の k-gram を 64bit ハッシュにした配列 (重複なし)"""
+    words = _WORD.findall(text.lower())
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    tokens = np.fromiter((zlib.crc32(w.encode()) for w in words), dtype=np.uint64, count=len(words))
+    k = min(k, len(tokens))
+    n = len(tokens) - k + 1
+    h = np.zeros(n, dtype=np.uint64)
+    with np.errstate(over="ignore"):                # uint64 の桁あふれは意図どおり (mod 2^64)
+        for j in range(k):
+            h = h * _MIX + tokens[j:j + n]
+    return np.unique(h)
+
+
+def signature(text: str, k: int = SHINGLE) -> np.ndarray | None:
+    """MinHash 署名 (uint32 × NUM_PERM)。本文が空なら None"""
+    h = shingle_hashes(text, k)
+    if not len(h):
+        return None
+    sig = np.full(NUM_PERM, np.iinfo(np.uint32).max, dtype=np.uint32)
+    with np.errstate(over="ignore"):
+        for start in range(0, len(h), 4096):        # NUM_PERM × 4096 ずつ (一時配列を 2MB に抑える)
+            chunk = h[start:start + 4096]
+            hashed = (_A[:, None] * chunk[None, :] + _B[:, None]) >> np.uint64(32)
+            np.minimum(sig, hashed.min(axis=1).astype(np.uint32), out=sig)
+    return sig
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """署名から推定した Jaccard 類似度"""
+    return float(np.count_nonzero(a == b)) / len(a)
+
+
+class NearDupIndex:
+    """既出ページの MinHash を LSH で引けるようにしておく (重複と判定したページは追加しない)"""
+    def __init__(self, threshold: float = 0.8, bands: int = 8) -> None:
+        if NUM_PERM % bands:
+            raise ValueError(f"bands は {NUM_PERM} の約数にしてください")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = NUM_PERM // bands
+        self.urls: list[str] = []
+        self._sigs = np.empty((0, NUM_PERM), dtype=np.uint32)
+        self._count = 0
+        self._buckets: list[dict[bytes, list[int]]] = [{} for _ in range(bands)]
+        self.duplicates = 0
+
+    def _band_keys(self, sig: np.ndarray) -> list[bytes]:
+        return [band.tobytes() for band in sig.reshape(self.bands, self.rows)]
+
+    def query(self, sig: np.ndarray) -> str | None:
+        """threshold 以上に似た既出ページの URL (最も似ているもの)"""
+        candidates = set()
+        for bucket, key in zip(self._buckets, self._band_keys(sig)):
+            candidates.update(bucket.get(key, ()))
+        if not candidates:
+            return None
+        ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        scores = np.count_nonzero(self._sigs[ids] == sig, axis=1) / NUM_PERM
+        best = int(np.argmax(scores))
+        return self.urls[ids[best]] if scores[best] >= self.threshold else None
+
+    def add(self, url: str, sig: np.ndarray) -> None:
+        if self._count == len(self._sigs):          # 行列は倍々で確保
+            grown = np.empty((max(1024, 2 * len(self._sigs)), NUM_PERM), dtype=np.uint32)
+            grown[:self._count] = self._sigs[:self._count]
+            self._sigs = grown
+        doc_id = self._count
+        self._sigs[doc_id] = sig
+        self._count += 1
+        self.urls.append(url)
+        for bucket, key in zip(self._buckets, self._band_keys(sig)):
+            bucket.setdefault(key, []).append(doc_id)
+
+    def check(self, url: str, sig: np.ndarray | None) -> str | None:
+        """重複元の URL を返す。重複でなければ索引に加えて None"""
+        if sig is None:
+            return None
+        dup = self.query(sig)
+        if dup is not None:
+            self.duplicates += 1
+            return dup
+        self.add(url, sig)
+        return None
@@ -0,0 +1,249 @@
+"""
+page_store.py
+ページ本文 (生 HTML / Markdown) を内容ハッシュで保存するアーカイブ。
+    <dir>/blobs.zst      … zstd フレームを追記していくだけのファイル (1 本文 = 1 フレーム)
+    <dir>/index.sqlite   … ハッシュ → (位置, 長さ) と URL → ハッシュ の索引
+    <dir>/dictionary     … 先頭 dict_samples ページの HTML から学習した zstd 辞書 (任意)
+- 同じ内容 (ミラー・ページ送りの重複など) は 1 度しか保存しない
+- 共通のヘッダ・フッタ等は辞書に入るので、ページ単位の圧縮でも効きが良い
+- 読み出しは blobs.zst を mmap して、必要なフレームだけ展開する
+
+    # 書き込み (ResultSink の書き先として使う)
+    async with ResultSink(PageStore(OUTPUT_DIR / "pages")) as pages:
+        await pages.put({"url": url, "html": res.html, "markdown": md, "status_code": 200})
+
+    # 読み出し
+    with PageReader(OUTPUT_DIR / "pages") as archive:
+        page = archive.get("https://www.python.org/about/")
+        page.markdown
+"""
+
+import hashlib
+import mmap
+import os
+import sqlite3
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple
+
+if TYPE_CHECKING:
+    from typing import Self
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None                # 未インストールならアーカイブは使えない (PAGE_STORE=0)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash     TEXT PRIMARY KEY,
+    offset   INTEGER,
+    length   INTEGER,
+    raw_size INTEGER,
+    dict_id  INTEGER                 -- 0: 辞書なし / 1: dictionary を使って圧縮
+);
+CREATE TABLE IF NOT EXISTS pages (
+    url         TEXT PRIMARY KEY,
+    html_hash   TEXT,
+    md_hash     TEXT,
+    status_code INTEGER,
+    stored_at   REAL
+);
+"""
+
+
+class StoredPage(NamedTuple):
+    url: str
+    html: str | None
+    markdown: str | None
+    status_code: int | None
+    stored_at: float
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _paths(directory: Path) -> tuple[Path, Path, Path]:
+    return directory / "blobs.zst", directory / "index.sqlite", directory / "dictionary"
+
+
+class PageStore:
+    """ResultSink の書き先。行は {"url", "html", "markdown", "status_code"} (html / markdown は省略可)"""
+    def __init__(
+        self,
+        directory: Path,
+        *,
+        level: int = 3,
+        dict_size: int = 112 * 1024,
+        dict_samples: int = 100,
+    ) -> None:
+        if zstandard is None:
+            raise RuntimeError("ページアーカイブには zstandard が必要です (pip install zstandard)")
+        directory.mkdir(parents=True, exist_ok=True)
+        self.blob_path, index_path, self.dict_path = _paths(directory)
+        self.level = level
+        self.dict_size = dict_size
+        self.dict_samples = dict_samples
+        self.stored = self.deduped = 0
+        self.raw_bytes = self.stored_bytes = 0
+
+        # 書き込みは ResultSink の書き出しスレッドから順番に呼ばれる
+        self.db = sqlite3.connect(index_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self._f = self.blob_path.open("ab")
+        self._offset = self._f.tell()
+
+        self._dict: zstandard.ZstdCompressionDict | None = None
+        if self.dict_path.exists():
+            self._dict = zstandard.ZstdCompressionDict(self.dict_path.read_bytes())
+        self._plain = zstandard.ZstdCompressor(level=level)
+        self._with_dict = zstandard.ZstdCompressor(level=level, dict_data=self._dict) if self._dict else None
+
+        # 辞書は空のアーカイブに最初に書く時だけ学習する (それまでの行は保留)
+        empty = self.db.execute("SELECT COUNT(*) FROM blobs").fetchone()[0] == 0
+        self._pending: list[dict] | None = [] if (empty and not self._dict and dict_size) else None
+
+    # ---------- ResultSink の書き先 ----------
+    def write_rows(self, rows: list[dict]) -> None:
+        if self._pending is not None:
+            self._pending.extend(rows)
+            if sum(1 for r in self._pending if r.get("html")) < self.dict_samples:
+                return
+            rows, self._pending = self._pending, None
+            self._train([r["html"].encode() for r in rows if r.get("html")])
+        for row in rows:
+            self.write(row)
+
+    def write(self, row: dict) -> None:
+        html_hash = self._put_blob(row.get("html"))
+        md_hash = self._put_blob(row.get("markdown"))
+        self.db.execute(
+            "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)",
+            (row["url"], html_hash, md_hash, row.get("status_code"), time.time()))
+
+    def flush(self) -> None:
+        self._f.flush()
+        self.db.commit()
+
+    def sync(self) -> None:
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self.db.commit()
+
+    def close(self) -> None:
+        if self._pending:                     # 辞書を学習できるほど集まらなかった
+            rows, self._pending = self._pending, None
+            self._train([r["html"].encode() for r in rows if r.get("html")])
+            for row in rows:
+                self.write(row)
+        self._f.close()
+        self.db.commit()
+        self.db.close()
+
+    # ---------- 内部 ----------
+    def _train(self, samples: list[bytes]) -> None:
+        if len(samples) < 8:                  # 少なすぎると学習できないので辞書なし
+            return
+        try:
+            self._dict = zstandard.train_dictionary(self.dict_size, samples, level=self.level)
+        except zstandard.ZstdError:
+            return
+        self.dict_path.write_bytes(self._dict.as_bytes())
+        self._with_dict = zstandard.ZstdCompressor(level=self.level, dict_data=self._dict)
+
+    def _put_blob(self, text: str | None) -> str | None:
+        if not text:
+            return None
+        data = text.encode()
+        digest = content_hash(data)
+        if self.db.execute("SELECT 1 FROM blobs WHERE hash = ?", (digest,)).fetchone():
+            self.deduped += 1
+            return digest
+        compressor = self._with_dict or self._plain
+        frame = compressor.compress(data)
+        self._f.write(frame)
+        self.db.execute(
+            "INSERT INTO blobs VALUES (?, ?, ?, ?, ?)",
+            (digest, self._offset, len(frame), len(data), 1 if self._with_dict else 0))
+        self._offset += len(frame)
+        self.stored += 1
+        self.raw_bytes += len(data)
+        self.stored_bytes += len(frame)
+        return digest
+
+
+class PageReader:
+    """URL またはハッシュで本文を取り出す (blobs.zst は mmap し、該当フレームだけ展開)"""
+    def __init__(self, directory: Path) -> None:
+        blob_path, index_path, dict_path = _paths(directory)
+        self.db = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True)
+        self._f = blob_path.open("rb")
+        size = blob_path.stat().st_size
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self._plain = zstandard.ZstdDecompressor()
+        self._with_dict = None
+        if dict_path.exists():
+            self._with_dict = zstandard.ZstdDecompressor(
+                dict_data=zstandard.ZstdCompressionDict(dict_path.read_bytes()))
+
+    def __enter__(self) -> "Self":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._f.close()
+        self.db.close()
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def __contains__(self, url: str) -> bool:
+        return self.db.execute("SELECT 1 FROM pages WHERE url = ?", (url,)).fetchone() is not None
+
+    def urls(self) -> Iterator[str]:
+        for (url,) in self.db.execute("SELECT url FROM pages ORDER BY url"):
+            yield url
+
+    def blob(self, digest: str | None) -> str | None:
+        if digest is None:
+            return None
+        found = self.db.execute(
+            "SELECT offset, length, dict_id FROM blobs WHERE hash = ?", (digest,)).fetchone()
+        if found is None:
+            return None
+        offset, length, dict_id = found
+        decompressor = self._with_dict if dict_id else self._plain
+        return decompressor.decompress(self._mm[offset:offset + length]).decode()
+
+    def get(self, url: str) -> StoredPage | None:
+        found = self.db.execute(
+            "SELECT html_hash, md_hash, status_code, stored_at FROM pages WHERE url = ?", (url,)).fetchone()
+        if found is None:
+            return None
+        html_hash, md_hash, status_code, stored_at = found
+        return StoredPage(url, self.blob(html_hash), self.blob(md_hash), status_code, stored_at)
+
+    def __iter__(self) -> Iterator[StoredPage]:
+        for url in self.urls():
+            yield self.get(url)
+
+    def stats(self) -> dict:
+        pages, distinct_html = self.db.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT html_hash) FROM pages").fetchone()
+        blobs, raw, stored = self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(raw_size), 0), COALESCE(SUM(length), 0) FROM blobs").fetchone()
+        return {
+            "pages": pages,
+            "distinct_html": distinct_html,
+            "blobs": blobs,
+            "raw_bytes": raw,
+            "stored_bytes": stored,
+            "ratio": round(raw / stored, 2) if stored else 0.0,
+        }
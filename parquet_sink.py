@@ -0,0 +1,176 @@
+"""
+parquet_sink.py
+CSV と同じ行 dict を、型付き・zstd 圧縮の Parquet データセットへ書き出すストリーム。
+    <root>/<name>/run_ts=<実行時刻>/host=<ホスト>/part-<part>.parquet   (Hive 形式のパーティション)
+row_group_size 行たまるごとに 1 行グループとして書き出すので、全行をメモリに持たない。
+スキーマは SCHEMAS に固定 (列の追加は末尾に、型は変えない)。
+
+    import pandas as pd
+    df = pd.read_parquet("crawl_results/parquet/site_structure")                         # 全実行
+    df = pd.read_parquet("crawl_results/parquet/site_structure",
+                         filters=[("run_ts", "=", "20250629_023941")])                    # 1 実行分
+"""
+
+from collections import defaultdict
+from pathlib import Path
+from typing import Any
+from urllib.parse import urlsplit
+
+# pyarrow は Parquet を書く時に初めて読み込む (CSV だけの実行では import しない)
+pa = pq = None
+
+# 表ごとの列 (名前, pyarrow の型名)。pyarrow のスキーマは arrow_schema() で作る
+SCHEMAS = {
+    "site_structure": [
+        ("url", "string"),
+        ("path", "string"),
+        ("depth", "int32"),
+        ("type", "string"),
+        ("status_code", "int32"),
+        ("success", "bool_"),
+        ("error", "string"),
+        ("redirect_to", "string"),
+        ("redirect_hops", "int32"),
+        ("engine", "string"),
+        ("fetch_ms", "float32"),
+        ("duplicate_of", "string"),
+        ("score", "float32"),
+        ("reason", "string"),
+        ("size", "int64"),
+        ("profile", "string"),
+        ("blocked", "int32"),
+        ("blocked_bytes", "int64"),
+        ("error_class", "string"),
+    ],
+    "file_links": [
+        ("page_url", "string"),
+        ("file_name", "string"),
+        ("file_url", "string"),
+    ],
+    "attachments": [
+        ("url", "string"),
+        ("path", "string"),
+        ("status", "string"),
+        ("http_status", "int32"),
+        ("size", "int64"),
+        ("sha256", "string"),
+        ("content_type", "string"),
+        ("elapsed_ms", "float32"),
+        ("error", "string"),
+    ],
+    "crawl_output": [
+        ("url", "string"),
+        ("success", "bool_"),
+        ("markdown_len", "int32"),
+        ("preview100", "string"),
+        ("error", "string"),
+    ],
+    "batch_output": [
+        ("url", "string"),
+        ("success", "bool_"),
+        ("status_code", "int32"),
+        ("final_url", "string"),
+        ("title", "string"),
+        ("markdown_len", "int32"),
+        ("error", "string"),
+        ("error_class", "string"),
+        ("fetch_ms", "float32"),
+        ("profile", "string"),
+        ("blocked", "int32"),
+        ("blocked_bytes", "int64"),
+    ],
+}
+SCHEMAS["failed_urls"] = SCHEMAS["site_structure"]
+
+
+def _arrow() -> None:
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("Parquet 出力には pyarrow が必要です (pip install pyarrow)") from None
+        pa, pq = pyarrow, pyarrow.parquet
+
+
+def arrow_schema(name: str) -> "pa.Schema":
+    _arrow()
+    return pa.schema([(column, getattr(pa, typ)()) for column, typ in SCHEMAS[name]])
+
+
+def _column(values: list[Any], typ) -> "pa.Array":
+    """CSV 用の行 ("" や文字列の数値が混じる) を schema の型にそろえる"""
+    if pa.types.is_string(typ):
+        values = [None if v is None else str(v) for v in values]
+    elif pa.types.is_boolean(typ):
+        values = [None if v in ("", None) else v in (True, "True", "true", "1", 1) for v in values]
+    elif pa.types.is_integer(typ):
+        values = [None if v in ("", None) else int(v) for v in values]
+    elif pa.types.is_floating(typ):
+        values = [None if v in ("", None) else float(v) for v in values]
+    return pa.array(values, type=typ)
+
+
+def host_partition(url: str) -> str:
+    """パーティション名に使うホスト (ポートの ':' はパスに使えない環境があるので '_' に)"""
+    return (urlsplit(url or "").netloc or "_").replace(":", "_")
+
+
+class ParquetStream:
+    """CsvWriter と同じく ResultSink の書き先になる Parquet 版 (単独でも write(row) / close() で使える)"""
+    def __init__(
+        self,
+        root: Path,
+        name: str,
+        run_ts: str,
+        *,
+        host_field: str = "url",
+        part: str = "0",
+        row_group_size: int = 1000,
+        compression: str = "zstd",
+    ) -> None:
+        self.schema = arrow_schema(name)
+        self.dir = root / name / f"run_ts={run_ts}"
+        self.host_field = host_field
+        self.part = part
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.count = 0
+        self._buffers: dict[str, list[dict]] = defaultdict(list)
+        self._writers: dict[str, pq.ParquetWriter] = {}
+
+    def write(self, row: dict) -> None:
+        host = host_partition(row.get(self.host_field))
+        buf = self._buffers[host]
+        buf.append(row)
+        self.count += 1
+        if len(buf) >= self.row_group_size:
+            self._flush(host)
+
+    def write_rows(self, rows: list[dict]) -> None:
+        """ResultSink からまとめて渡される行 (行グループ単位で書くので flush / sync は持たない)"""
+        for row in rows:
+            self.write(row)
+
+    def _flush(self, host: str) -> None:
+        rows = self._buffers.pop(host, None)
+        if not rows:
+            return
+        table = pa.Table.from_arrays(
+            [_column([r.get(f.name) for r in rows], f.type) for f in self.schema],
+            schema=self.schema,
+        )
+        writer: pq.ParquetWriter | None = self._writers.get(host)
+        if writer is None:
+            path = self.dir / f"host={host}" / f"part-{self.part}.parquet"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            writer = self._writers[host] = pq.ParquetWriter(path, self.schema, compression=self.compression)
+        writer.write_table(table, row_group_size=self.row_group_size)
+
+    def close(self) -> None:
+        for host in list(self._buffers):
+            self._flush(host)
+        for writer in self._writers.values():
+            writer.close()
+        self._writers.clear()
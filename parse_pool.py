@@ -0,0 +1,102 @@
+"""
+parse_pool.py
+HTML のパース・リンク抽出・Markdown 生成を ProcessPoolExecutor に逃がすステージ。
+イベントループ (ブラウザ操作・HTTP) は生 HTML を渡して軽い結果 (リンク・Markdown 文字列) だけ受け取る。
+- 同時に投げられる件数は max_pending まで。空きが出るまで呼び出し側が待つので、
+  ブラウザや HTTP がパースを追い越して HTML を溜め込むことはない
+- ブラウザ経路では crawl4ai のスクレイピングを PassthroughScrapingStrategy で素通りさせ、
+  同じ LXMLWebScrapingStrategy / DefaultMarkdownGenerator をワーカープロセス側で実行する
+
+    async with ParsePool(workers=4) as pool:
+        dynamic, links = await pool.analyze(html, url)          # HybridFetcher 用
+        pool.apply(result, await pool.scrape(url, result.html)) # ブラウザ結果にリンク等を補う
+"""
+
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Any
+
+from crawl4ai import CrawlResult, LXMLWebScrapingStrategy
+from crawl4ai.content_filter_strategy import PruningContentFilter
+from crawl4ai.content_scraping_strategy import ContentScrapingStrategy
+from crawl4ai.markdown_generation_strategy import DefaultMarkdownGenerator
+from crawl4ai.models import MarkdownGenerationResult, ScrapingResult
+
+from fetch_engine import extract_links, needs_browser
+from near_dup import page_text, signature
+
+if TYPE_CHECKING:
+    from typing import Self
+
+
+# ---------- ワーカープロセス側 ----------
+def _analyze(html: str, base_url: str, min_text_chars: int) -> tuple[bool, dict]:
+    if needs_browser(html, min_text_chars):
+        return True, {}
+    return False, extract_links(html, base_url)
+
+
+def _fingerprint(html: str):
+    return signature(page_text(html))
+
+
+def _scrape(url: str, html: str, markdown: bool, prune: dict | None) -> dict[str, Any]:
+    scraped = LXMLWebScrapingStrategy().scrap(url, html)
+    out = {"links": scraped.links.model_dump(), "metadata": scraped.metadata or {}}
+    if markdown:
+        generator = DefaultMarkdownGenerator(
+            content_filter=PruningContentFilter(**prune) if prune else None)
+        out["markdown"] = generator.generate_markdown(scraped.cleaned_html, base_url=url).model_dump()
+    return out
+
+
+# ---------- イベントループ側 ----------
+class PassthroughScrapingStrategy(ContentScrapingStrategy):
+    """crawl4ai 内でのスクレイピングを省く (リンク・Markdown は ParsePool.scrape で作る)"""
+    def scrap(self, url: str, html: str, **kwargs) -> ScrapingResult:
+        return ScrapingResult(cleaned_html="", success=True)
+
+    async def ascrap(self, url: str, html: str, **kwargs) -> ScrapingResult:
+        return self.scrap(url, html, **kwargs)
+
+
+class ParsePool:
+    def __init__(self, workers: int | None = None, max_pending: int | None = None) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 2
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._executor: ProcessPoolExecutor | None = None
+
+    async def __aenter__(self) -> "Self":
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    async def run(self, fn, *args):
+        """空き枠を待ってから fn(*args) をワーカープロセスで実行する"""
+        async with self._slots:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def analyze(self, html: str, base_url: str, min_text_chars: int = 200) -> tuple[bool, dict]:
+        """(ブラウザが必要か, リンク) — HybridFetcher のインライン処理と同じ判定"""
+        return await self.run(_analyze, html, base_url, min_text_chars)
+
+    async def fingerprint(self, html: str):
+        """本文の MinHash 署名 (near_dup.signature)"""
+        return await self.run(_fingerprint, html)
+
+    async def scrape(self, url: str, html: str, *, markdown: bool = False,
+                     prune: dict | None = None) -> dict[str, Any]:
+        """LXML スクレイピング (+ 任意で Markdown / fit_markdown) の結果を dict で返す"""
+        return await self.run(_scrape, url, html, markdown, prune)
+
+    @staticmethod
+    def apply(result: CrawlResult, scraped: dict[str, Any]) -> CrawlResult:
+        result.links = scraped["links"]
+        result.metadata = {**scraped["metadata"], **(result.metadata or {})}
+        if "markdown" in scraped:
+            result.markdown = MarkdownGenerationResult(**scraped["markdown"])
+        return result
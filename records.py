@@ -0,0 +1,81 @@
+"""
+records.py
+クロール結果をメモリ上に持つための小さな表現。
+- PageRecord … CrawlResult から出力に要る項目だけを取り出した __slots__ の dataclass
+                (HTML やリンク一覧への参照はここで手放す)。row() で CSV / 状態 DB 用の dict に
+ツリーとパス別サマリーは site_tree.SiteTree (パスのトライ木) に積む。
+"""
+
+import os
+import sys
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+from crawl4ai import CrawlResult
+
+from host_health import classify_error, short_error
+
+
+def utf8_size(text: str | None, chunk: int = 1 << 16) -> int:
+    """text を UTF-8 にした時のバイト数。ASCII ならそのまま、それ以外も chunk 文字ずつ数えて全体の写しは作らない"""
+    if not text:
+        return 0
+    if text.isascii():
+        return len(text)
+    return sum(len(text[i:i + chunk].encode("utf-8", "surrogatepass")) for i in range(0, len(text), chunk))
+
+
+def strip_base(url: str, netloc: str) -> str:
+    p = urlparse(url)
+    return p.path or "/" if p.netloc == netloc else url
+
+
+@dataclass(slots=True)
+class PageRecord:
+    url: str
+    path: str
+    depth: int
+    type: str
+    status_code: int | None
+    success: bool
+    error: str = ""
+    redirect_to: str = ""
+    redirect_hops: int = 0
+    engine: str = "browser"
+    fetch_ms: object = ""
+    duplicate_of: str = ""
+    score: object = ""
+    reason: str = ""
+    size: int = 0                   # HTML の UTF-8 バイト数 (ツリーの集計用)
+    profile: str = ""               # ブラウザ描画のプロファイル (ブラウザを使ったページだけ)
+    blocked: object = ""            # 描画時に止めたリクエスト数
+    blocked_bytes: object = ""      # その推定バイト数
+    error_class: str = ""           # host_health.classify_error の分類 (dns / timeout / http_4xx …)
+
+    @classmethod
+    def from_result(cls, res: CrawlResult, base: str, file_exts: set[str]) -> "PageRecord":
+        meta = res.metadata or {}
+        path = sys.intern(strip_base(res.url, base))
+        return cls(
+            url=res.url,
+            path=path,
+            depth=meta.get("depth", 0),
+            type="file" if os.path.splitext(path)[1].lower() in file_exts else "page",
+            status_code=res.status_code,
+            success=res.success,
+            error=short_error(res.error_message),
+            engine=sys.intern(meta.get("engine", "browser")),
+            fetch_ms=meta.get("fetch_ms") or "",
+            duplicate_of=meta.get("duplicate_of", ""),
+            score=meta.get("score", ""),
+            reason=meta.get("reason", ""),
+            size=utf8_size(res.html),
+            profile=meta.get("profile", ""),
+            blocked=meta.get("blocked", ""),
+            blocked_bytes=meta.get("blocked_bytes", ""),
+            error_class=meta.get("error_class") or classify_error(res.error_message, res.status_code),
+        )
+
+    def row(self) -> dict:
+        return {k: getattr(self, k) for k in self.__dataclass_fields__}
+
@@ -0,0 +1,80 @@
+"""
+redirect_resolver.py
+3xx を返した URL の最終到達先を httpx.AsyncClient で並行に追跡する。
+- keep-alive 付きのコネクションプール (上限あり) を 1 つだけ使い回す
+- まず HEAD で問い合わせ、HEAD 非対応 (405/501) の時だけ GET (本文は読まない)
+- リダイレクトは follow_redirects に任せず 1 ホップずつ自前で辿る
+- ホスト単位の同時実行数を Semaphore で制限
+"""
+
+import asyncio
+from collections import defaultdict
+from typing import TYPE_CHECKING
+from urllib.parse import urljoin, urlparse
+
+import httpx
+
+from metrics import metrics
+
+if TYPE_CHECKING:
+    from typing import Self
+
+HEAD_FALLBACK_STATUS = {405, 501}   # HEAD を受け付けないサーバ
+# resolve() が 1 URL の失敗として送出する例外 (InvalidURL は HTTPError ではない。urljoin は ValueError)
+RESOLVE_ERRORS = (httpx.HTTPError, httpx.InvalidURL, ValueError)
+
+
+class RedirectResolver:
+    """`async with RedirectResolver() as r: final_url, hops = await r.resolve(url)`"""
+    def __init__(
+        self,
+        *,
+        max_connections: int = 50,
+        max_keepalive: int = 20,
+        per_host: int = 4,
+        timeout: float = 10.0,
+        max_hops: int = 10,
+    ) -> None:
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+        )
+        self.timeout = timeout
+        self.max_hops = max_hops
+        self._host_sem = defaultdict(lambda: asyncio.Semaphore(per_host))
+        self._client = None
+
+    async def __aenter__(self) -> "Self":
+        self._client = httpx.AsyncClient(
+            limits=self.limits,
+            timeout=self.timeout,
+            follow_redirects=False,
+        )
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self._client.aclose()
+
+    async def _probe(self, url: str) -> httpx.Response:
+        """HEAD → (必要なら) GET でステータスとヘッダだけ取得する"""
+        async with self._host_sem[urlparse(url).netloc]:
+            r = await self._client.head(url)
+            if r.status_code not in HEAD_FALLBACK_STATUS:
+                return r
+            # 本文は読まずに閉じる (ヘッダだけ分かればよい)
+            metrics.inc("fallbacks_total", reason="head_fallback")
+            async with self._client.stream("GET", url) as r:
+                return r
+
+    async def resolve(self, url: str) -> tuple[str, int]:
+        """最終 URL とホップ数を返す。通信エラーや不正な URL は RESOLVE_ERRORS のいずれかとして送出"""
+        cur, hops, seen = url, 0, {url}
+        while True:
+            r = await self._probe(cur)
+            if not r.is_redirect:
+                return cur, hops
+            nxt = urljoin(cur, r.headers["location"])
+            if hops >= self.max_hops or nxt in seen:
+                raise httpx.TooManyRedirects(f"redirect loop or > {self.max_hops} hops", request=r.request)
+            seen.add(nxt)
+            cur, hops = nxt, hops + 1
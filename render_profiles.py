@@ -0,0 +1,226 @@
+"""
+render_profiles.py
+ブラウザ描画の軽さを URL ごとに切り替える「描画プロファイル」。
+- full        … 今まで通り (何も止めない。crawl4ai の既定の待ち条件)
+- text        … 画像・動画・フォントと計測タグ、他ドメインのリソースを止める。CSS と自ドメインの JS は読む
+- links-only  … text に加えて CSS も止め、アニメーションを抑え、待ち時間を短くする (リンクとステータスだけ欲しい時)
+止めるのは Playwright の route で、ページのドキュメント本体 (メインフレームのナビゲーション) は止めない。
+待ち条件 (wait_until / page_timeout / delay_before_return_html) は profile.run_config() で CrawlerRunConfig に反映する。
+
+ページごとに 止めたリクエスト数 と 推定バイト数 (リソース種別ごとの典型的なサイズ × 件数。
+止めたリクエストは本文を取らないので実測はできない) を記録し、pop_stats() で result.metadata へ渡す。
+
+    router = ProfileRouter("text", {"/app/": "full"})
+    router.install(crawler)                              # before_goto フックを登録
+    for profile, urls in router.group(urls).items():
+        await crawler.arun_many(urls, config=profile.run_config(config))
+"""
+
+from collections import defaultdict
+from collections.abc import Iterable
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+from weakref import WeakKeyDictionary
+
+from crawl4ai import AsyncWebCrawler, CrawlerRunConfig
+from crawl4ai.utils import get_base_domain
+
+from metrics import metrics
+
+# 止めたリソース 1 件あたりの推定サイズ (bytes)
+TYPICAL_BYTES = {
+    "image": 30_000,
+    "media": 500_000,
+    "font": 40_000,
+    "stylesheet": 20_000,
+    "script": 30_000,
+    "xhr": 5_000,
+    "fetch": 5_000,
+    "websocket": 0,
+    "eventsource": 0,
+    "manifest": 1_000,
+    "texttrack": 2_000,
+    "other": 5_000,
+}
+
+# 計測・広告タグの配信元 (サブドメインも含めて止める)
+TRACKER_DOMAINS = (
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googlesyndication.com",
+    "googleadservices.com", "facebook.net", "connect.facebook.net", "hotjar.com", "clarity.ms",
+    "newrelic.com", "nr-data.net", "segment.io", "segment.com", "mixpanel.com", "optimizely.com",
+    "adobedtm.com", "omtrdc.net", "demdex.net", "scorecardresearch.com", "matomo.cloud",
+)
+
+
+@dataclass(frozen=True)
+class RenderProfile:
+    name: str
+    block_types: frozenset = frozenset()     # Playwright の resource_type
+    block_third_party: bool = False          # ページと別ドメインのサブリソース
+    block_trackers: bool = False
+    reduced_motion: bool = False             # prefers-reduced-motion: reduce (CSS アニメーションを抑える)
+    wait_until: str = "domcontentloaded"
+    page_timeout: int = 60_000
+    delay_before_return_html: float = 0.1
+
+    @property
+    def intercepts(self) -> bool:
+        return bool(self.block_types or self.block_third_party or self.block_trackers)
+
+    def run_config(self, config: CrawlerRunConfig) -> CrawlerRunConfig:
+        # CrawlerRunConfig は属性を 1 つ設定するたびに inspect.signature を呼ぶので clone が 30ms ほどかかる。
+        # 同じ config から作ったものは使い回す
+        clones = _RUN_CONFIGS.setdefault(config, {})
+        if self not in clones:
+            clones[self] = config.clone(
+                wait_until=self.wait_until,
+                page_timeout=self.page_timeout,
+                delay_before_return_html=self.delay_before_return_html,
+                **({"wait_for_images": False, "scan_full_page": False} if "image" in self.block_types else {}),
+            )
+        return clones[self]
+
+
+# 元の config → {プロファイル: clone した config} (元の config が不要になれば消える)
+_RUN_CONFIGS: "WeakKeyDictionary[CrawlerRunConfig, dict[RenderProfile, CrawlerRunConfig]]" = WeakKeyDictionary()
+
+
+PROFILES = {
+    "full": RenderProfile("full"),
+    "text": RenderProfile(
+        "text",
+        block_types=frozenset({"image", "media", "font"}),
+        block_third_party=True,
+        block_trackers=True,
+        reduced_motion=True,
+    ),
+    "links-only": RenderProfile(
+        "links-only",
+        block_types=frozenset({"image", "media", "font", "stylesheet", "manifest", "texttrack", "eventsource",
+                               "websocket"}),
+        block_third_party=True,
+        block_trackers=True,
+        reduced_motion=True,
+        page_timeout=20_000,
+        delay_before_return_html=0.0,
+    ),
+}
+
+
+def parse_profile_paths(spec: str) -> dict[str, str]:
+    """"/app/=full,/docs/=links-only" → {"/app/": "full", "/docs/": "links-only"}"""
+    paths = {}
+    for part in spec.split(","):
+        prefix, sep, name = part.strip().rpartition("=")
+        if sep and prefix:
+            if name.strip() not in PROFILES:
+                raise ValueError(f"未知の描画プロファイル: {name.strip()} ({' / '.join(PROFILES)})")
+            paths[prefix.strip()] = name.strip()
+    return paths
+
+
+def _is_tracker(host: str) -> bool:
+    return any(host == d or host.endswith("." + d) for d in TRACKER_DOMAINS)
+
+
+def _same_site(host: str, page_host: str, site: str) -> bool:
+    """サブドメイン違いは同じサイト扱い (IP アドレスのページはホストが一致する時だけ)"""
+    if host == page_host:
+        return True
+    if page_host.replace(".", "").isdigit() or ":" in page_host:
+        return False
+    return host == site or host.endswith("." + site)
+
+
+class PageStats:
+    __slots__ = ("blocked", "blocked_bytes", "profile")
+
+    def __init__(self, profile: str) -> None:
+        self.profile = profile
+        self.blocked = 0
+        self.blocked_bytes = 0
+
+
+class ProfileRouter:
+    """URL のパス接頭辞 (長いもの優先) で描画プロファイルを選び、before_goto でリソースを止める"""
+    def __init__(self, default: str = "full", paths: dict[str, str] | None = None) -> None:
+        if default not in PROFILES:
+            raise ValueError(f"未知の描画プロファイル: {default} ({' / '.join(PROFILES)})")
+        self.default = PROFILES[default]
+        self.paths = sorted(((p, PROFILES[n]) for p, n in (paths or {}).items()),
+                            key=lambda kv: len(kv[0]), reverse=True)
+        self._stats: dict[str, PageStats] = {}
+        # プロファイルごとの合計 (実行後のサマリー用)
+        self.totals: dict[str, dict[str, float]] = defaultdict(lambda: defaultdict(float))
+
+    def profile_for(self, url: str) -> RenderProfile:
+        path = urlsplit(url).path or "/"
+        for prefix, profile in self.paths:
+            if path.startswith(prefix):
+                return profile
+        return self.default
+
+    def group(self, urls: Iterable[str]) -> dict[RenderProfile, list[str]]:
+        groups: dict[RenderProfile, list[str]] = defaultdict(list)
+        for url in urls:
+            groups[self.profile_for(url)].append(url)
+        return groups
+
+    def install(self, crawler: AsyncWebCrawler) -> None:
+        crawler.crawler_strategy.set_hook("before_goto", self.before_goto)
+
+    async def before_goto(self, page, context=None, url: str = "", config=None, **kwargs):
+        if not url.startswith(("http://", "https://")):
+            return page                               # raw: (プールのヘルスチェック) など
+        profile = self.profile_for(url)
+        stats = self._stats[url] = PageStats(profile.name)
+        if profile.reduced_motion:
+            await page.emulate_media(reduced_motion="reduce")
+        if not profile.intercepts:
+            return page
+
+        page_host = (urlsplit(url).hostname or "").removeprefix("www.")
+        site = get_base_domain(url)
+        main_frame = page.main_frame
+
+        async def handle(route) -> None:
+            request = route.request
+            host = (urlsplit(request.url).hostname or "").removeprefix("www.")
+            rtype = request.resource_type
+            if request.is_navigation_request() and request.frame == main_frame:
+                await route.continue_()               # ページ本体 (リダイレクト先を含む) は必ず読む
+            elif (rtype in profile.block_types
+                    or (profile.block_trackers and _is_tracker(host))
+                    or (profile.block_third_party and host and not _same_site(host, page_host, site))):
+                stats.blocked += 1
+                stats.blocked_bytes += TYPICAL_BYTES.get(rtype, TYPICAL_BYTES["other"])
+                metrics.inc("blocked_requests_total", profile=profile.name, type=rtype)
+                await route.abort("blockedbyclient")
+            else:
+                await route.continue_()
+
+        await page.route("**/*", handle)
+        return page
+
+    def pop_stats(self, url: str, fetch_ms: float | None = None) -> dict:
+        """描画し終えたページの {"profile", "blocked", "blocked_bytes"} (プロファイル別の合計にも足す)"""
+        stats = self._stats.pop(url, None) or PageStats(self.profile_for(url).name)
+        total = self.totals[stats.profile]
+        total["pages"] += 1
+        total["blocked"] += stats.blocked
+        total["blocked_bytes"] += stats.blocked_bytes
+        if fetch_ms is not None:
+            total["timed"] += 1
+            total["fetch_ms"] += fetch_ms
+            metrics.observe("render_seconds", fetch_ms / 1000, profile=stats.profile)
+        metrics.inc("blocked_bytes_total", stats.blocked_bytes, profile=stats.profile)
+        return {"profile": stats.profile, "blocked": stats.blocked, "blocked_bytes": stats.blocked_bytes}
+
+    def summary(self) -> list[tuple[str, int, float, int, int, float | None]]:
+        """(プロファイル, ページ数, 平均描画 ms, 止めた件数, 推定バイト数, full との差 ms)"""
+        avg = {name: t["fetch_ms"] / t["timed"] for name, t in self.totals.items() if t["timed"]}
+        rows = []
+        for name, t in sorted(self.totals.items()):
+            saved = avg["full"] - avg[name] if name != "full" and "full" in avg and name in avg else None
+            rows.append((name, int(t["pages"]), avg.get(name, 0.0), int(t["blocked"]), int(t["blocked_bytes"]), saved))
+        return rows
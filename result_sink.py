@@ -0,0 +1,229 @@
+"""
+result_sink.py
+クロール結果の行を書き出す非同期シンク。
+- 出力ごとにファイルハンドルは 1 つだけ (最初の行が来た時点で開き、close まで使い続ける)
+- クロール側は put(row) で有界キューに積むだけ。キューが一杯なら空くまで待つ (書き出しが詰まれば自然に減速)
+- 書き出しタスクがキューから最大 batch 行ずつまとめて取り出し、別スレッドで書く。
+  OS への flush は batch 行ごと、または flush_interval 秒ごと
+- checkpoint() でそれまでの行を書き切って fsync (状態 DB のチェックポイントに合わせて呼ぶ)
+- close() / キャンセル時も、キューに残った行を書き切ってからファイルを閉じる
+
+    async with ResultSink(CsvWriter(path, fieldnames), ParquetStream(...)) as sink:
+        await sink.put(row)                   # 同じ行を全ての書き先へ
+        await sink.checkpoint()
+"""
+
+import asyncio
+import csv
+import os
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Self
+
+_CLOSE = object()
+
+
+class CsvWriter:
+    """1 つのハンドルに行をまとめて書く CSV の書き先 (ResultSink から使う)"""
+    def __init__(self, path: Path, fieldnames: list[str], buffering: int = 1 << 20) -> None:
+        self.path = path
+        self.fieldnames = fieldnames
+        self.buffering = buffering
+        self._f = None
+        self._w = None
+
+    def write_rows(self, rows: list[dict]) -> None:
+        if self._f is None:
+            self._f = self.path.open("w", newline="", encoding="utf-8", buffering=self.buffering)
+            self._w = csv.DictWriter(self._f, fieldnames=self.fieldnames, extrasaction="ignore")
+            self._w.writeheader()
+        self._w.writerows(rows)
+
+    def flush(self) -> None:
+        if self._f is not None:
+            self._f.flush()
+
+    def sync(self) -> None:
+        if self._f is not None:
+            self._f.flush()
+            os.fsync(self._f.fileno())
+
+    def close(self) -> None:
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+class ResultSink:
+    """同じ行を 1 つ以上の書き先 (CsvWriter / ParquetStream) へ非同期に書く"""
+    def __init__(
+        self,
+        *writers,
+        max_queue: int = 10000,
+        batch: int = 1000,
+        flush_interval: float = 1.0,
+    ) -> None:
+        self.writers = writers
+        self.batch = batch
+        self.flush_interval = flush_interval
+        self.count = 0                          # 受け付けた行数
+        self._queue: asyncio.Queue = asyncio.Queue(max_queue)
+        self._task: asyncio.Task | None = None
+        self._dirty = False
+        self._flushed_at = time.monotonic()
+        self._error: BaseException | None = None
+
+    async def __aenter__(self) -> "Self":
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    # ---------- クロール側 ----------
+    def _check(self) -> None:
+        if self._error is not None:
+            raise self._error
+        if self._task is None or self._task.done():
+            raise RuntimeError("ResultSink は開始されていないか、既に閉じられています")
+
+    async def _enqueue(self, item) -> bool:
+        """キューへ積む。一杯で待っている間に書き出しタスクが止まったら積まずに False"""
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            pass
+        put = asyncio.ensure_future(self._queue.put(item))
+        await asyncio.wait({put, self._task}, return_when=asyncio.FIRST_COMPLETED)
+        if put.done():
+            return True
+        put.cancel()
+        return False
+
+    async def put(self, row: dict) -> None:
+        self._check()
+        if not await self._enqueue(row):
+            self._check()
+        self.count += 1
+
+    async def checkpoint(self, wait: bool = True) -> None:
+        """ここまでに put した行を書き切って fsync する (wait=False なら依頼だけして戻る)。
+        書き出しに失敗していればその例外を送出 (タスクが止まっても待ち続けない)"""
+        self._check()
+        done = asyncio.get_running_loop().create_future()
+        if not await self._enqueue(done):
+            self._check()
+        if not wait:
+            # 失敗は以降の put / close で送出するので、この結果は取り出し済みにしておく
+            done.add_done_callback(lambda f: f.cancelled() or f.exception())
+            return
+        await asyncio.wait({done, self._task}, return_when=asyncio.FIRST_COMPLETED)
+        if done.done():
+            done.result()
+        else:
+            self._check()
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        if not self._task.done():
+            await self._enqueue(_CLOSE)         # 途中でタスクが止まっても、例外は下で送出
+            await asyncio.wait({self._task})
+        task, self._task = self._task, None
+        if not task.cancelled():
+            task.exception()                    # 取り出し済みにする (同じ例外を下で送出)
+        if self._error is not None:
+            raise self._error
+
+    # ---------- 書き出しタスク ----------
+    def _write(self, rows: list[dict]) -> None:
+        for writer in self.writers:
+            writer.write_rows(rows)
+
+    def _flush(self, sync: bool = False) -> None:
+        for writer in self.writers:
+            fn = getattr(writer, "sync" if sync else "flush", None)
+            if fn is not None:
+                fn()
+        self._dirty = False
+        self._flushed_at = time.monotonic()
+
+    async def _run(self) -> None:
+        rows: list[dict] = []
+        waiters: list[asyncio.Future] = []
+        closing = False
+        try:
+            while not closing:
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), self.flush_interval)
+                except asyncio.TimeoutError:  # noqa: UP041 (3.10 では組み込みの TimeoutError と別物)
+                    if self._dirty:             # 流量が少ない時も flush_interval 秒以内に OS へ渡す
+                        await asyncio.to_thread(self._flush)
+                    continue
+
+                # 溜まっている分をまとめて取り出す (行以外の指示が来たらそこで区切る)
+                while True:
+                    if item is _CLOSE:
+                        closing = True
+                        break
+                    if isinstance(item, asyncio.Future):
+                        waiters.append(item)
+                        break
+                    rows.append(item)
+                    if len(rows) >= self.batch or self._queue.empty():
+                        break
+                    item = self._queue.get_nowait()
+
+                if rows:
+                    batch, rows = rows, []
+                    await asyncio.to_thread(self._write_batch, batch)
+                if waiters:
+                    await asyncio.to_thread(self._flush, True)
+                    for done in waiters:
+                        if not done.done():
+                            done.set_result(None)
+                    waiters = []
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:                  # ディスクフル等。以降の put で呼び出し側へ伝える
+            self._error = e
+            raise
+        finally:
+            # 中断時もキューに残った行を書き切ってから閉じる
+            while not self._queue.empty():
+                item = self._queue.get_nowait()
+                if isinstance(item, dict):
+                    rows.append(item)
+                elif isinstance(item, asyncio.Future):
+                    waiters.append(item)
+            try:
+                if rows and self._error is None:
+                    self._write(rows)
+                for writer in self.writers:
+                    writer.close()
+            except Exception as e:
+                self._error = self._error or e
+                raise
+            finally:
+                # checkpoint() の待ち手は書けたかどうかを必ず受け取る (失敗なら同じ例外)
+                for done in waiters:
+                    if done.done():
+                        continue
+                    if self._error is None:
+                        done.set_result(None)
+                    else:
+                        done.set_exception(self._error)
+
+    def _write_batch(self, rows: list[dict]) -> None:
+        self._write(rows)
+        self._dirty = True
+        if len(rows) >= self.batch or time.monotonic() - self._flushed_at >= self.flush_interval:
+            self._flush()
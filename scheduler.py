@@ -0,0 +1,176 @@
+"""
+scheduler.py
+frontier と fetcher の間に入るホスト単位のポライトネス・スケジューラ。
+- ホストごとに待ち行列を持ち、同時実行数を AIMD で調整
+  (429 / 503 / タイムアウトで乗算的に減らし、応答が速い間は加算的に増やす)
+- ホストごとのトークンバケットで秒間リクエスト数を制限 (Retry-After があればその間停止)
+- 全ホスト合計の同時実行数にも上限
+"""
+
+import asyncio
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from urllib.parse import urlparse
+
+from crawl4ai import CrawlResult
+
+from host_health import classify_error
+from metrics import metrics
+
+THROTTLE_STATUS = {429, 503}
+
+
+class TokenBucket:
+    """rate 件/秒、最大 burst 件まで貯まるトークンバケット (rate <= 0 で無制限)"""
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.capacity = max(1.0, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def take(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            if self.rate <= 0:
+                return
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+@dataclass
+class HostState:
+    limit: float
+    bucket: TokenBucket
+    in_flight: int = 0
+    latency: float = 0.0                      # 応答時間の指数移動平均 (秒)
+    waiters: deque = field(default_factory=deque)
+    backoffs: int = 0
+
+
+def retry_after_seconds(result: CrawlResult) -> float | None:
+    headers = {k.lower(): v for k, v in (result.response_headers or {}).items()}
+    try:
+        return float(headers["retry-after"])
+    except (KeyError, ValueError):
+        return None
+
+
+class HostScheduler:
+    """`await scheduler.run(url, fetch)` でホストの枠とトークンを取ってから fetch(url) を呼ぶ"""
+    def __init__(
+        self,
+        *,
+        global_limit: int = 16,
+        per_host_max: int = 4,
+        per_host_min: int = 1,
+        rate: float = 2.0,
+        burst: float = 4.0,
+        healthy_latency: float = 2.0,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+    ) -> None:
+        self.per_host_max = per_host_max
+        self.per_host_min = per_host_min
+        self.rate = rate
+        self.burst = burst
+        self.healthy_latency = healthy_latency
+        self.increase = increase
+        self.decrease = decrease
+        self.hosts: dict[str, HostState] = {}
+        self._global = asyncio.Semaphore(global_limit)
+
+    def _host(self, host: str) -> HostState:
+        st = self.hosts.get(host)
+        if st is None:
+            # スロースタート: 最小の同時実行数から始めて様子を見ながら増やす
+            st = self.hosts[host] = HostState(
+                limit=float(self.per_host_min),
+                bucket=TokenBucket(self.rate, self.burst),
+            )
+        return st
+
+    # ---------- ホスト枠の取得 / 解放 ----------
+    async def _acquire(self, st: HostState) -> None:
+        if st.in_flight < int(st.limit) and not st.waiters:
+            st.in_flight += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        st.waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self._release(st)            # 枠をもらった直後にキャンセルされた
+            elif fut in st.waiters:
+                st.waiters.remove(fut)
+            raise
+
+    def _release(self, st: HostState) -> None:
+        st.in_flight -= 1
+        self._wake(st)
+
+    def _wake(self, st: HostState) -> None:
+        while st.waiters and st.in_flight < int(st.limit):
+            fut = st.waiters.popleft()
+            if not fut.done():
+                st.in_flight += 1
+                fut.set_result(None)
+
+    # ---------- AIMD ----------
+    def _feedback(self, st: HostState, result: CrawlResult | None, elapsed: float) -> None:
+        if result is None:                   # 次の経路に回っただけなので判断しない
+            return
+        # エラー文には URL も入るので、語の検索ではなく host_health と同じ分類で判定する
+        timed_out = not result.success and classify_error(result.error_message, result.status_code) == "timeout"
+        if (result.status_code or 0) in THROTTLE_STATUS or timed_out:
+            st.limit = max(float(self.per_host_min), st.limit * self.decrease)
+            st.backoffs += 1
+            metrics.inc("throttled_total")           # 再試行ではなく減速
+            st.bucket.pause(retry_after_seconds(result) or 1.0 / max(self.rate, 1.0))
+            return
+        st.latency = elapsed if st.latency == 0 else 0.8 * st.latency + 0.2 * elapsed
+        if st.latency <= self.healthy_latency:
+            st.limit = min(float(self.per_host_max), st.limit + self.increase / st.limit)
+            self._wake(st)
+
+    async def run(
+        self,
+        url: str,
+        fetch: Callable[[str], Awaitable[CrawlResult | None]],
+    ) -> CrawlResult | None:
+        st = self._host(urlparse(url).netloc)
+        queued = time.monotonic()
+        await self._acquire(st)
+        try:
+            await st.bucket.take()
+            async with self._global:
+                t0 = time.monotonic()
+                metrics.record("queue_wait", t0 - queued, url)
+                result = await fetch(url)
+            self._feedback(st, result, time.monotonic() - t0)
+            return result
+        finally:
+            self._release(st)
+
+    def wrap(self, fetch: Callable[[str], Awaitable[CrawlResult | None]]):
+        """fetch(url) をスケジューラ経由で呼ぶ関数にして返す"""
+        async def scheduled(url: str) -> CrawlResult | None:
+            return await self.run(url, fetch)
+        return scheduled
+
+    def summary(self) -> list[tuple[str, float, float, int]]:
+        """(host, 最終同時実行数, 平均応答秒, バックオフ回数)"""
+        return [(h, st.limit, st.latency, st.backoffs) for h, st in sorted(self.hosts.items())]
@@ -0,0 +1,441 @@
+"""
+shard.py
+intra_crawler.py を複数プロセス (複数マシン) に分けて走らせる分散モード。
+- URL 空間を shards 個に分割 (by=hash … 正規化 URL のハッシュ / by=host … ホスト名のハッシュ)
+- 各ワーカーは共有の SQLite frontier から自分のシャードの URL だけを取り出してクロールし、
+  見つけたリンクは持ち主のシャードへ積む (重複は共有表の UNIQUE 制約で排除)
+- 出力はワーカーごとに OUTPUT_DIR/shard-NNN/ へ書き、最後に OUTPUT_DIR 直下へ決定的な順序で結合
+  (CSV は外部ソートで結合し、ツリーとパス別サマリーは結合後の site_structure.csv から作り直す。
+   Parquet は全ワーカーで同じデータセットに書くので結合は不要)
+
+    python shard.py run --workers 4                 # 1 台で: 初期化 → ワーカー起動 → 結合
+    python shard.py init --shards 4                 # 複数台で: 共有 DB を初期化し、
+    python shard.py worker --shard 0                #   各マシンで shard 0..3 を 1 つずつ起動
+    python shard.py merge                           #   全員終わったら結合
+
+共有 DB はワーカー全員から見える場所 (同一マシンのディスクや共有ストレージ) に置く。
+ワーカーが落ちた場合は同じ --shard で起動し直せば取得中だった URL から再開する
+(そのシャードが終わるまで他のワーカーも終了を待つ)。
+MAX_PAGES は全シャード合計の上限で、init 時に共有 DB に記録する (各ワーカーは残り枠の分だけ取り出し、
+使い切ったら未取得の URL が残っていても終了する)。
+by=hash では 1 ホストへの負荷がワーカー数倍になるので、run は PER_HOST_RPS / PER_HOST_CONCURRENCY を
+ワーカー数で割って渡す。
+"""
+
+import argparse
+import asyncio
+import csv
+import heapq
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from collections.abc import Iterator
+from contextlib import ExitStack
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from crawl_state import FrontierItem, add_columns
+from link_graph import LinkGraph
+from site_tree import load_site_tree
+from url_index import SeenSet, canonicalize, fingerprint
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta    (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS urls    (seq INTEGER PRIMARY KEY, url TEXT UNIQUE, shard INTEGER,
+                                    depth INTEGER, parent TEXT, state INTEGER DEFAULT 0,
+                                    score REAL DEFAULT 0, reason TEXT DEFAULT '');
+CREATE INDEX IF NOT EXISTS urls_by_shard ON urls (shard, state, depth, seq);
+CREATE TABLE IF NOT EXISTS results (seq INTEGER PRIMARY KEY, url TEXT UNIQUE, shard INTEGER,
+                                    success INTEGER, row TEXT, files TEXT);
+"""
+PENDING, LEASED, DONE = 0, 1, 2
+
+# 結合時の並び順 (実行ごとの完了順に左右されないキー)
+MERGE_KEYS = {
+    "site_structure.csv": lambda r: (int(r.get("depth") or 0), r["url"]),
+    "failed_urls.csv": lambda r: (int(r.get("depth") or 0), r["url"]),
+    "file_links.csv": lambda r: (r["page_url"], r["file_url"], r["file_name"]),
+}
+
+
+def shard_of(url: str, shards: int, by: str = "hash") -> int:
+    key = (urlsplit(url).hostname or "") if by == "host" else url
+    return fingerprint(key) % shards
+
+
+def connect(path: Path) -> sqlite3.Connection:
+    db = sqlite3.connect(path, timeout=60)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(SCHEMA)
+    add_columns(db, "urls", {"score": "REAL DEFAULT 0", "reason": "TEXT DEFAULT ''"})
+    db.execute("CREATE INDEX IF NOT EXISTS urls_by_score ON urls (shard, state, score)")
+    return db
+
+
+def init_frontier(
+    path: Path,
+    root_url: str,
+    shards: int,
+    by: str,
+    fresh: bool = False,
+    max_pages: int = 0,
+) -> bool:
+    """共有 DB を用意して ROOT_URL を積む。同じ設定の状態が残っていて fresh でなければそのまま使う (戻り値は再開か)。
+    max_pages (全シャード合計の上限、0 は無制限) は再開時も今回の値で上書きする"""
+    db = connect(path)
+    meta = dict(db.execute("SELECT key, value FROM meta"))
+    wanted = {"root_url": root_url, "shards": str(shards), "by": by}
+    try:
+        if not fresh and all(meta.get(k) == v for k, v in wanted.items()):
+            with db:
+                db.execute("INSERT OR REPLACE INTO meta VALUES ('max_pages', ?)", (str(max_pages),))
+            return True
+        wanted["run_ts"] = datetime.now().strftime("%Y%m%d_%H%M%S")
+        wanted["max_pages"] = str(max_pages)
+        with db:
+            for table in ("meta", "urls", "results"):
+                db.execute(f"DELETE FROM {table}")
+            db.executemany("INSERT INTO meta VALUES (?, ?)", wanted.items())
+            root = canonicalize(root_url)
+            if root is None:
+                raise ValueError(f"ROOT_URL を解釈できません: {root_url}")
+            db.execute("INSERT INTO urls (url, shard, depth, parent) VALUES (?, ?, 0, NULL)",
+                       (root, shard_of(root, shards, by)))
+        return False
+    finally:
+        db.close()
+
+
+class ShardStore:
+    """CrawlStateStore と同じ口で、共有 frontier のうち 1 シャード分を扱うストア"""
+    def __init__(
+        self,
+        path: Path,
+        shard: int,
+        *,
+        checkpoint_every: int = 50,
+        batch: int = 500,
+        poll_interval: float = 0.25,
+    ) -> None:
+        self.shard = shard
+        self.checkpoint_every = checkpoint_every
+        self.batch = batch
+        self.poll_interval = poll_interval
+        self.db = connect(path)
+        meta = dict(self.db.execute("SELECT key, value FROM meta"))
+        if "shards" not in meta:
+            raise RuntimeError(f"{path} が初期化されていません (python shard.py init)")
+        self.root_url = meta["root_url"]
+        self.shards = int(meta["shards"])
+        self.by = meta["by"]
+        self.run_ts = meta.get("run_ts") or datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.max_pages = int(meta.get("max_pages") or 0)     # 全シャード合計の上限 (0 は無制限)
+        if not 0 <= shard < self.shards:
+            raise ValueError(f"shard は 0..{self.shards - 1} で指定してください")
+
+        self.in_flight: dict[str, FrontierItem] = {}
+        self.visited = SeenSet()            # このワーカーが積んだ / 受け取った URL (最終判定は共有表)
+        self.pages_crawled = 0
+        self.resumed = True                 # ROOT_URL は init で積まれている
+
+        self._new_urls: list[tuple[str, int, int, str | None]] = []
+        self._done: list[str] = []
+        self._new_results: list[tuple[str, int, int, str, str]] = []
+
+    # ---------- 開始 / 再開 ----------
+    def open(self, root_url: str, resume: bool = True) -> bool:
+        """取得中のまま残った自シャードの URL を未取得に戻す。戻り値は完了済みの結果があるか"""
+        if canonicalize(root_url) != canonicalize(self.root_url):
+            raise RuntimeError(f"共有 DB の ROOT_URL ({self.root_url}) と異なります: {root_url}")
+        with self.db:
+            self.db.execute("UPDATE urls SET state=? WHERE shard=? AND state=?",
+                            (PENDING, self.shard, LEASED))
+        done, ok = self.db.execute(
+            "SELECT count(*), coalesce(sum(success), 0) FROM results WHERE shard=?",
+            (self.shard,)).fetchone()
+        self.pages_crawled = ok
+        return done > 0
+
+    # ---------- frontier 操作 ----------
+    def seen(self, url: str) -> bool:
+        return url in self.visited
+
+    def push(
+        self,
+        url: str,
+        depth: int,
+        parent: str | None = None,
+        score: float = 0.0,
+        reason: str = "",
+    ) -> bool:
+        if not self.visited.add(url):
+            return False
+        self._new_urls.append((url, shard_of(url, self.shards, self.by), depth, parent, score, reason))
+        return True
+
+    def _budget(self) -> tuple[int, int]:
+        """(全シャードで成功した数, 残り枠)。残り枠は他のワーカーが取得中の URL も使用中として数える"""
+        ok, leased = self.db.execute(
+            "SELECT (SELECT coalesce(sum(success), 0) FROM results),"
+            " (SELECT count(*) FROM urls WHERE state=?)", (LEASED,)).fetchone()
+        return ok, (self.max_pages - ok - leased if self.max_pages else self.batch)
+
+    def _lease(self, where: str, order: str, params: tuple) -> list[FrontierItem]:
+        *params, limit = params
+        limit = min(limit, self._budget()[1])
+        if limit <= 0:
+            return []                       # 全体の上限に達した (取得中の分が失敗すれば枠が戻る)
+        with self.db:
+            items = [FrontierItem(*r) for r in self.db.execute(
+                "SELECT url, depth, parent, score, reason FROM urls"
+                f" WHERE shard=? AND state=? {where} ORDER BY {order} LIMIT ?",
+                (self.shard, PENDING, *params, limit))]
+            self.db.executemany("UPDATE urls SET state=? WHERE url=?",
+                                ((LEASED, item.url) for item in items))
+        for item in items:
+            self.visited.add(item.url)
+            self.in_flight[item.url] = item
+        return items
+
+    def pop_level(self) -> list[FrontierItem]:
+        """自シャードの未取得 URL のうち最も浅い深さのものを batch 件まで取り出す"""
+        self.checkpoint()
+        row = self.db.execute("SELECT min(depth) FROM urls WHERE shard=? AND state=?",
+                              (self.shard, PENDING)).fetchone()
+        if row[0] is None:
+            return []
+        return self._lease("AND depth=?", "seq", (row[0], self.batch))
+
+    def pop_best(self, n: int) -> list[FrontierItem]:
+        """自シャードの未取得 URL をスコアの高い順に n 件取り出す"""
+        self.checkpoint()
+        return self._lease("", "score DESC, seq", (n,))
+
+    async def wait_for_work(self) -> bool:
+        """自シャードに URL が積まれて枠が空くか、全シャードが終わる
+        (未取得も取得中も無い、または全体の上限に達した) まで待つ"""
+        while True:
+            self.checkpoint()
+            mine, active = self.db.execute(
+                "SELECT coalesce(sum(shard=? AND state=?), 0), count(*) FROM urls WHERE state<?",
+                (self.shard, PENDING, DONE)).fetchone()
+            ok, remaining = self._budget()
+            if self.max_pages and ok >= self.max_pages:
+                return False
+            if mine and remaining > 0:
+                return True
+            if active == 0:
+                return False
+            await asyncio.sleep(self.poll_interval)
+
+    # ---------- 結果の記録 ----------
+    def complete(self, url: str, row: dict, file_rows: list[dict]) -> None:
+        self.in_flight.pop(url, None)
+        self._done.append(url)
+        self._new_results.append((
+            url, self.shard, int(bool(row.get("success"))),
+            json.dumps(row, ensure_ascii=False),
+            json.dumps(file_rows, ensure_ascii=False),
+        ))
+        if row.get("success"):
+            self.pages_crawled += 1
+        if len(self._new_results) >= self.checkpoint_every:
+            self.checkpoint()
+
+    def iter_results(self) -> Iterator[tuple[dict, list[dict]]]:
+        for row, files in self.db.execute(
+                "SELECT row, files FROM results WHERE shard=? ORDER BY seq", (self.shard,)):
+            yield json.loads(row), json.loads(files)
+
+    def checkpoint(self) -> None:
+        """積んだ URL と完了を 1 トランザクションで反映 (他のワーカーの終了判定が途中を見ないように)"""
+        if not (self._new_urls or self._done or self._new_results):
+            return
+        with self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO urls (url, shard, depth, parent, score, reason)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                self._new_urls)
+            self.db.executemany("UPDATE urls SET state=? WHERE url=?",
+                                ((DONE, u) for u in self._done))
+            self.db.executemany(
+                "INSERT OR REPLACE INTO results (url, shard, success, row, files)"
+                " VALUES (?, ?, ?, ?, ?)", self._new_results)
+        self._new_urls.clear()
+        self._done.clear()
+        self._new_results.clear()
+
+    def close(self) -> None:
+        self.checkpoint()
+        self.db.close()
+
+
+# ---------- 結合 ----------
+def _sorted_runs(paths: list[Path], key, tmp: Path, chunk_rows: int) -> tuple[list[str] | None, list[Path]]:
+    """各ファイルを chunk_rows 行ずつ読んで並べ替え、tmp に書いた整列済みの断片のパス (外部ソートの前半)"""
+    fieldnames, runs = None, []
+    for path in paths:
+        with path.open(newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            fieldnames = fieldnames or reader.fieldnames
+            while chunk := list(islice(reader, chunk_rows)):
+                chunk.sort(key=key)
+                run = tmp / f"run-{len(runs):05d}.csv"
+                with run.open("w", newline="", encoding="utf-8") as out:
+                    w = csv.DictWriter(out, fieldnames=fieldnames, extrasaction="ignore")
+                    w.writeheader()
+                    w.writerows(chunk)
+                runs.append(run)
+    return fieldnames, runs
+
+
+def merge_csv(paths: list[Path], out: Path, key, chunk_rows: int = 200_000) -> int | None:
+    """paths の CSV を key の順に 1 本へ結合 (chunk_rows 行ずつ並べ替えた断片を heapq.merge で流すので、
+    メモリに載るのは断片 1 つ分だけ)。書いた行数を返す (結合するファイルが無ければ None)"""
+    n = 0
+    with tempfile.TemporaryDirectory(dir=out.parent, prefix=f".{out.stem}-") as tmp:
+        fieldnames, runs = _sorted_runs(paths, key, Path(tmp), chunk_rows)
+        if fieldnames is None:
+            return None
+        with ExitStack() as stack, out.open("w", newline="", encoding="utf-8") as f:
+            readers = [csv.DictReader(stack.enter_context(run.open(newline="", encoding="utf-8")))
+                       for run in runs]
+            w = csv.DictWriter(f, fieldnames=fieldnames)
+            w.writeheader()
+            for row in heapq.merge(*readers, key=key):
+                w.writerow(row)
+                n += 1
+    return n
+
+
+def merge_outputs(output: Path) -> None:
+    """shard-*/ の出力を単一プロセスで走らせた時と同じ形で output 直下へまとめる
+    - CSV (MERGE_KEYS) … 外部ソートで決定的な順に結合
+    - site_tree.txt / site_tree_fancy.txt / site_summary.csv … 結合した site_structure.csv から作り直す
+    - リンクグラフ … シャードをまたぐ辺があるので、全シャードの辺をまとめて集計し直す
+    Parquet は全ワーカーが同じ PARQUET_DIR / run_ts に書くので、最初から 1 つのデータセットになっている"""
+    shard_dirs = sorted(output.glob("shard-*"))
+    for name, key in MERGE_KEYS.items():
+        n = merge_csv([d / name for d in shard_dirs if (d / name).exists()], output / name, key)
+        if n is not None:
+            print(f"✓ {name:22s} → {output / name}（{len(shard_dirs)} シャード / {n} 行）")
+
+    site_csv = output / "site_structure.csv"
+    if site_csv.exists():
+        collapse = int(os.getenv("TREE_COLLAPSE", "0"))
+        tree = load_site_tree(site_csv)
+        for name, write in (("site_tree.txt", tree.write_indented), ("site_tree_fancy.txt", tree.write_fancy)):
+            with (output / name).open("w", encoding="utf-8") as f:
+                write(f, collapse)
+            print(f"✓ {name:22s} → {output / name}")
+        if len(tree) > 1:
+            with (output / "site_summary.csv").open("w", newline="", encoding="utf-8") as f:
+                w = csv.DictWriter(f, fieldnames=["segment", "pages", "files", "errors"])
+                w.writeheader()
+                w.writerows(tree.summary())
+            print(f"✓ {'site_summary.csv':22s} → {output / 'site_summary.csv'}")
+
+    graph_dirs = [d / "link_graph" for d in shard_dirs if (d / "link_graph" / "nodes.tsv").exists()]
+    stats = next((d / "run_stats.json" for d in shard_dirs if (d / "run_stats.json").exists()), None)
+    if graph_dirs and stats:
+        root_url = json.loads(stats.read_text(encoding="utf-8"))["root_url"]
+        report = LinkGraph.load(*graph_dirs).write_reports(output, root_url)
+        print(f"✓ {'page_graph.csv':22s} → {output / 'page_graph.csv'}（{report['nodes']} URL / "
+              f"{report['edges']} リンク / リンク切れ {report['broken_links']}）")
+
+
+# ---------- 実行 ----------
+def run_worker(db_path: Path, shard: int, output: Path) -> None:
+    store = ShardStore(db_path, shard)
+    # intra_crawler は import 時に環境変数を読むので先に設定する
+    os.environ["OUTPUT_DIR"] = str(output / f"shard-{shard:03d}")
+    os.environ["ROOT_URL"] = store.root_url
+    if store.max_pages:
+        os.environ["MAX_PAGES"] = str(store.max_pages)              # 上限は全シャード共通の枠で判定する
+    os.environ.setdefault("PARQUET_DIR", str(output / "parquet"))   # Parquet は全シャードで 1 つのデータセット
+    import intra_crawler
+
+    store.checkpoint_every = intra_crawler.CHECKPOINT_EVERY
+    asyncio.run(intra_crawler.crawl(store=store))
+
+
+def run_local(db_path: Path, workers: int, by: str, output: Path, fresh: bool) -> int:
+    root_url = os.getenv("ROOT_URL", "https://www.python.org/")
+    output.mkdir(parents=True, exist_ok=True)
+    if init_frontier(db_path, root_url, workers, by, fresh, int(os.getenv("MAX_PAGES", "2000"))):
+        print(f"↻ 再開: {db_path}")
+
+    env = dict(os.environ)
+    if by == "hash":
+        env["PER_HOST_RPS"] = str(float(os.getenv("PER_HOST_RPS", "2.0")) / workers)
+        env["PER_HOST_CONCURRENCY"] = str(max(1, int(os.getenv("PER_HOST_CONCURRENCY", "4")) // workers))
+    metrics_port = int(os.getenv("METRICS_PORT", "0"))
+
+    procs = []
+    for k in range(workers):
+        if metrics_port:
+            env["METRICS_PORT"] = str(metrics_port + k)
+        procs.append(subprocess.Popen(
+            [sys.executable, str(Path(__file__).resolve()), "worker",
+             "--db", str(db_path), "--shard", str(k), "--output", str(output)],
+            env=dict(env),
+        ))
+    codes = [p.wait() for p in procs]
+    failed = [k for k, c in enumerate(codes) if c != 0]
+    if failed:
+        print(f"✗ 異常終了したシャード: {failed}（同じコマンドで再実行すると続きから再開）")
+        return 1
+    merge_outputs(output)
+    return 0
+
+
+def main() -> None:
+    output_default = Path(os.getenv("OUTPUT_DIR", "crawl_results"))
+    parser = argparse.ArgumentParser(description="intra_crawler の分散実行")
+    parser.add_argument("--output", type=Path, default=output_default)
+    parser.add_argument("--db", type=Path, help="共有 frontier (既定 <output>/frontier.sqlite)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_run = sub.add_parser("run", help="このマシンでワーカーを起動して結合まで行う")
+    p_run.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    p_run.add_argument("--by", choices=["hash", "host"], default="hash")
+    p_run.add_argument("--fresh", action="store_true", help="残っている状態を捨てて最初から")
+
+    p_init = sub.add_parser("init", help="共有 frontier を初期化")
+    p_init.add_argument("--shards", type=int, required=True)
+    p_init.add_argument("--by", choices=["hash", "host"], default="hash")
+    p_init.add_argument("--fresh", action="store_true")
+
+    p_worker = sub.add_parser("worker", help="1 シャード分をクロール")
+    p_worker.add_argument("--shard", type=int, required=True)
+
+    sub.add_parser("merge", help="シャードごとの CSV を結合し、ツリー・サマリー・リンクグラフを作り直す")
+
+    for p in (p_run, p_init, p_worker):
+        p.add_argument("--output", type=Path, default=argparse.SUPPRESS)
+        p.add_argument("--db", type=Path, default=argparse.SUPPRESS)
+    args = parser.parse_args()
+    db_path = args.db or args.output / "frontier.sqlite"
+
+    if args.command == "run":
+        sys.exit(run_local(db_path, args.workers, args.by, args.output, args.fresh))
+    elif args.command == "init":
+        args.output.mkdir(parents=True, exist_ok=True)
+        root_url = os.getenv("ROOT_URL", "https://www.python.org/")
+        resumed = init_frontier(db_path, root_url, args.shards, args.by, args.fresh,
+                                int(os.getenv("MAX_PAGES", "2000")))
+        print(f"{'↻ 既存の状態を使用' if resumed else '✓ 初期化'}: {db_path}（{args.shards} シャード / by={args.by}）")
+    elif args.command == "worker":
+        run_worker(db_path, args.shard, args.output)
+    else:
+        merge_outputs(args.output)
+
+
+if __name__ == "__main__":
+    main()
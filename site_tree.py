@@ -0,0 +1,199 @@
+"""
+site_tree.py
+クロールしたパスを "/" 区切りのトライ木に積み、site_tree.txt / site_tree_fancy.txt を書き出す。
+- ノードは add() のたびに増やし、ページ数・添付数・エラー数・バイト数を祖先まで足し込んでおく
+- 親・名前・集計値はノード番号で引く array に、名前は UTF-8 のまま 1 本の bytearray に持つ
+  (子の検索は (親, 名前) のハッシュで引く array('I') の開番地表。1 ノードあたり 60 バイト前後)
+- 書き出しは子の一覧 (親ごとに連続した配列) を作ってから深さ優先で 1 行ずつ書くだけで、
+  木全体の文字列やノードオブジェクトは作らない。子は名前順
+- collapse=N なら子が N 個を超えるノードは畳んで件数と集計だけ出す
+
+    tree = SiteTree()
+    tree.add("/docs/a.pdf", is_file=True, success=True, size=12345)
+    with open("site_tree_fancy.txt", "w", encoding="utf-8") as f:
+        tree.write_fancy(f, collapse=200)
+
+    python site_tree.py crawl_results/site_structure.csv --collapse 200
+"""
+
+import csv
+from array import array
+from collections.abc import Iterator
+from pathlib import Path
+from typing import TextIO
+
+ROOT = 0
+
+
+def human_size(n: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+
+
+class SiteTree:
+    def __init__(self) -> None:
+        self._table = array("I", bytes(4 * 1024))    # hash((親, 名前)) の位置にノード番号 (0 は空き。線形探査)
+        self.parent = array("I", [ROOT])
+        self.name_offsets = array("I", [0, 0])  # ノード i の名前は names[name_offsets[i]:name_offsets[i+1]]
+        self.names = bytearray()
+        # 部分木の合計 (そのノード自身の URL を含む)
+        self.pages = array("I", [0])
+        self.files = array("I", [0])
+        self.errors = array("I", [0])
+        self.bytes = array("Q", [0])
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    def name(self, node: int) -> str:
+        return self.names[self.name_offsets[node]:self.name_offsets[node + 1]].decode() if node else "/"
+
+    def _slot(self, node: int, data: bytes) -> int:
+        """(node, data) のノードがある、または入れるべき表の位置"""
+        table, mask = self._table, len(self._table) - 1
+        i = hash((node, data)) & mask
+        while child := table[i]:
+            if (self.parent[child] == node
+                    and self.names[self.name_offsets[child]:self.name_offsets[child + 1]] == data):
+                break
+            i = (i + 1) & mask
+        return i
+
+    def _find(self, node: int, seg: str) -> int:
+        """node の子 seg のノード番号 (無ければ作る)"""
+        data = seg.encode()
+        i = self._slot(node, data)
+        if child := self._table[i]:
+            return child
+        child = self._table[i] = len(self.parent)
+        self.parent.append(node)
+        self.names += data
+        self.name_offsets.append(len(self.names))
+        for column in (self.pages, self.files, self.errors, self.bytes):
+            column.append(0)
+        if len(self.parent) * 10 > len(self._table) * 7:   # 負荷率 0.7 で倍に
+            self._grow()
+        return child
+
+    def _grow(self) -> None:
+        self._table = array("I", bytes(8 * len(self._table)))
+        for child in range(1, len(self.parent)):
+            data = bytes(self.names[self.name_offsets[child]:self.name_offsets[child + 1]])
+            self._table[self._slot(self.parent[child], data)] = child
+
+    def add(self, path: str, is_file: bool = False, success: bool = True, size: int = 0) -> int:
+        """パス (ROOT からの相対 "/a/b.html" か外部 URL) を 1 件足し、そのノード番号を返す"""
+        node = ROOT
+        self._count(node, is_file, success, size)
+        for seg in path.split("/"):
+            if seg:
+                node = self._find(node, seg)
+                self._count(node, is_file, success, size)
+        return node
+
+    def _count(self, node: int, is_file: bool, success: bool, size: int) -> None:
+        self.pages[node] += 1
+        self.files[node] += is_file
+        self.errors[node] += not success
+        self.bytes[node] += size or 0
+
+    # ---------- 走査 ----------
+    def _children_index(self) -> tuple[array, array]:
+        """親ごとに連続した子の配列。node の子は kids[start[node]:start[node + 1]]"""
+        n = len(self.parent)
+        start = array("I", bytes(4 * (n + 1)))
+        for child in range(1, n):
+            start[self.parent[child] + 1] += 1
+        for i in range(n):
+            start[i + 1] += start[i]
+        fill = array("I", start)
+        kids = array("I", bytes(4 * (n - 1)))
+        for child in range(1, n):
+            p = self.parent[child]
+            kids[fill[p]] = child
+            fill[p] += 1
+        return start, kids
+
+    def walk(self, collapse: int = 0) -> Iterator[tuple[int, int, bool, int, bool]]:
+        """深さ優先・名前順に (ノード, 深さ, 兄弟の最後か, 子の数, 畳んだか)。スタックは経路上の兄弟分だけ"""
+        start, kids = self._children_index()
+        stack = [(ROOT, 0, True)]
+        while stack:
+            node, depth, last = stack.pop()
+            children = kids[start[node]:start[node + 1]]
+            folded = bool(collapse) and len(children) > collapse
+            yield node, depth, last, len(children), folded
+            if folded:
+                continue
+            ordered = sorted(children, key=self.name)
+            for i, child in enumerate(reversed(ordered)):
+                stack.append((child, depth + 1, i == 0))
+
+    def stats(self, node: int) -> str:
+        text = f"pages {self.pages[node]} / files {self.files[node]} / errors {self.errors[node]}"
+        return f"{text} / {human_size(self.bytes[node])}" if self.bytes[node] else text
+
+    # ---------- 書き出し ----------
+    def write_indented(self, f: TextIO, collapse: int = 0) -> None:
+        """site_tree.txt (深さ × 4 スペースのインデント)"""
+        for node, depth, _last, n_children, folded in self.walk(collapse):
+            line = f"{'    ' * depth}{self.name(node)}"
+            f.write(f"{line}  … {n_children} 件を省略 [{self.stats(node)}]\n" if folded else f"{line}\n")
+
+    def write_fancy(self, f: TextIO, collapse: int = 0) -> None:
+        """site_tree_fancy.txt (├── / └── / │ の罫線付き。子を持つノードには部分木の集計を付ける)"""
+        stems: list[str] = []
+        for node, depth, last, n_children, folded in self.walk(collapse):
+            if depth:
+                del stems[depth - 1:]
+                line = f"{''.join(stems)}{'└── ' if last else '├── '}{self.name(node)}"
+                stems.append("    " if last else "│   ")
+            else:
+                line = self.name(node)
+            if folded:
+                line += f"  … {n_children} 件を省略"
+            if n_children:
+                line += f"  [{self.stats(node)}]"
+            f.write(line + "\n")
+
+    def summary(self) -> Iterator[dict]:
+        """第一階層ごとのページ数・添付数・エラー数 (site_summary.csv)。"/" はトップページ自身"""
+        first = [c for c in range(1, len(self.parent)) if self.parent[c] == ROOT]
+        rows = [{"segment": self.name(c), "pages": self.pages[c],
+                 "files": self.files[c], "errors": self.errors[c]} for c in first]
+        own = {k: getattr(self, k)[ROOT] - sum(r[k] for r in rows) for k in ("pages", "files", "errors")}
+        if own["pages"]:
+            rows.append({"segment": "/", **own})
+        yield from sorted(rows, key=lambda r: r["segment"])
+
+
+def load_site_tree(site_csv: Path) -> SiteTree:
+    """site_structure.csv を 1 行ずつ読んでツリーに積む (shard.py の結合でも使う)"""
+    tree = SiteTree()
+    with site_csv.open(newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            tree.add(row["path"], row.get("type") == "file", row.get("success") == "True",
+                     int(row.get("size") or 0))
+    return tree
+
+
+def main(site_csv: Path, collapse: int) -> None:
+    tree = load_site_tree(site_csv)
+    for name, write in (("site_tree.txt", tree.write_indented), ("site_tree_fancy.txt", tree.write_fancy)):
+        out = site_csv.with_name(name)
+        with out.open("w", encoding="utf-8") as f:
+            write(f, collapse)
+        print(f"✓ {name:20s} → {out}")
+    print(f"  {len(tree):,} ノード / {tree.stats(ROOT)}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="site_structure.csv からサイトツリーを作り直す")
+    parser.add_argument("site_csv", type=Path, help="intra_crawler の site_structure.csv")
+    parser.add_argument("--collapse", type=int, default=0, help="子がこの数を超えるノードは畳む (0 で畳まない)")
+    args = parser.parse_args()
+    main(args.site_csv, args.collapse)
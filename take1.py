@@ -8,21 +8,18 @@ intra_crawler.py
 - site_summary.csv         … パス別ページ／ファイル／エラー数   ★ NEW
 """
 
-import asyncio, csv, os
+import asyncio, os
 from pathlib import Path
 from urllib.parse import urlparse
 from collections import Counter                 # ★ NEW
 
-from crawl4ai import AsyncWebCrawler, CrawlerRunConfig, CacheMode
+from crawl4ai import CrawlerRunConfig, CacheMode
 from crawl4ai.content_scraping_strategy import LXMLWebScrapingStrategy
 from crawl4ai.deep_crawling import BFSDeepCrawlStrategy
 from crawl4ai.deep_crawling.filters import FilterChain, ContentTypeFilter
 
-# 木構造表示用
-try:
-    from anytree import Node, RenderTree        # ★ NEW
-except ImportError:
-    Node = RenderTree = None    # anytree が未インストールでも動くように
+from browser_pool import get_pool, close_pool      # ブラウザはプロセス共有のプールから借りる
+from result_sink import ResultSink, CsvWriter     # CSV はどのスクリプトも同じシンク経由で書く
 
 # ----------- 必要に応じて書き換え -----------
 ROOT_URL  = os.getenv("ROOT_URL",  "https://www.python.org/")
@@ -31,7 +28,6 @@ MAX_PAGES = int(os.getenv("MAX_PAGES", 50))
 OUTPUT_DIR = Path(os.getenv("OUTPUT_DIR", "crawl_results"))
 # -------------------------------------------
 
-OUTPUT_DIR.mkdir(exist_ok=True)
 SITE_CSV, FILES_CSV, TREE_TXT = (
     OUTPUT_DIR / "site_structure.csv",
     OUTPUT_DIR / "file_links.csv",
@@ -50,6 +46,7 @@ def strip_base(url: str, netloc: str) -> str:
     return p.path or "/" if p.netloc == netloc else url
 
 async def crawl() -> None:
+    OUTPUT_DIR.mkdir(exist_ok=True)
     filters = FilterChain([ContentTypeFilter(allowed_types=["text/html"])])
 
     deep_crawl = BFSDeepCrawlStrategy(
@@ -66,8 +63,11 @@ async def crawl() -> None:
         verbose=True,
     )
 
-    async with AsyncWebCrawler() as crawler:
-        results = await crawler.arun(ROOT_URL, config=run_cfg)
+    try:
+        async with get_pool().lease(MAX_PAGES) as crawler:
+            results = await crawler.arun(ROOT_URL, config=run_cfg)
+    finally:
+        await close_pool()
 
     base = urlparse(ROOT_URL).netloc
     site_rows, file_rows, tree_paths = [], [], []
@@ -100,16 +100,14 @@ async def crawl() -> None:
                     "file_url": href,
                 })
 
-    # ---------- CSV 出力 ----------
-    if site_rows:
-        with SITE_CSV.open("w", newline="", encoding="utf-8") as f:
-            w = csv.DictWriter(f, fieldnames=site_rows[0].keys())
-            w.writeheader(); w.writerows(site_rows)
+    # ---------- CSV 出力 (行が無いファイルは作らない) ----------
+    async with ResultSink(CsvWriter(SITE_CSV, list(site_rows[0]) if site_rows else [])) as sink:
+        for row in site_rows:
+            await sink.put(row)
 
-    if file_rows:
-        with FILES_CSV.open("w", newline="", encoding="utf-8") as f:
-            w = csv.DictWriter(f, fieldnames=file_rows[0].keys())
-            w.writeheader(); w.writerows(file_rows)
+    async with ResultSink(CsvWriter(FILES_CSV, ["page_url", "file_name", "file_url"])) as sink:
+        for row in file_rows:
+            await sink.put(row)
 
     # ---------- ツリー (深さ順インデント) ----------
     with TREE_TXT.open("w", encoding="utf-8") as f:
@@ -117,6 +115,11 @@ async def crawl() -> None:
             f.write(f"{'    '*d}{os.path.basename(p) or '/'}\n")
 
     # ---------- 木構造 (anytree) ---------- ★ NEW
+    # 木構造表示用 (使う時だけ読み込む。未インストールでも動くように)
+    try:
+        from anytree import Node, RenderTree        # ★ NEW
+    except ImportError:
+        Node = RenderTree = None
     if Node:
         root_node = Node("/")
         node_map = {"/": root_node}
@@ -148,18 +151,14 @@ async def crawl() -> None:
         if not r["success"]:
             err_counter[seg] += 1
 
-    if seg_counter:
-        with SUMMARY_CSV.open("w", newline="", encoding="utf-8") as f:
-            fieldnames = ["segment", "pages", "files", "errors"]
-            w = csv.DictWriter(f, fieldnames=fieldnames)
-            w.writeheader()
-            for seg in sorted(seg_counter):
-                w.writerow({
-                    "segment": seg,
-                    "pages": seg_counter[seg],
-                    "files": file_counter[seg],
-                    "errors": err_counter[seg],
-                })
+    async with ResultSink(CsvWriter(SUMMARY_CSV, ["segment", "pages", "files", "errors"])) as sink:
+        for seg in sorted(seg_counter):
+            await sink.put({
+                "segment": seg,
+                "pages": seg_counter[seg],
+                "files": file_counter[seg],
+                "errors": err_counter[seg],
+            })
 
     # ---------- 完了ログ ----------
     print(f"✓ site_structure.csv    → {SITE_CSV}")
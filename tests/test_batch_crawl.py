@@ -0,0 +1,47 @@
+from crawl4ai import CrawlResult
+
+from batch_crawl import match_results
+
+
+def result(url: str, **kw) -> CrawlResult:
+    return CrawlResult(url=url, html="", success=True, **kw)
+
+
+def test_results_are_matched_by_url_not_order() -> None:
+    urls = ["http://h/a", "http://h/b", "http://h/c"]
+    results = [result("http://h/c"), result("http://h/a"), result("http://h/b")]
+    assert [(u, r.url) for u, r in match_results(urls, results)] == [(u, u) for u in urls]
+
+
+def test_duplicate_urls_each_get_their_own_result() -> None:
+    first = result("http://h/a", status_code=200)
+    second = result("http://h/a", status_code=503)
+    pairs = list(match_results(["http://h/a", "http://h/b", "http://h/a"], [first, second]))
+    assert pairs[0] == ("http://h/a", first)
+    assert pairs[1] == ("http://h/b", None)
+    assert pairs[2] == ("http://h/a", second)
+
+
+def test_duplicate_url_with_one_result_leaves_the_other_missing() -> None:
+    only = result("http://h/a")
+    pairs = list(match_results(["http://h/a", "http://h/a"], [only]))
+    assert [r for _, r in pairs] == [only, None]
+
+
+def test_redirected_result_matches_the_requested_url() -> None:
+    moved = result("http://h/old", redirected_url="http://h/new", status_code=200)
+    other = result("http://h/new")
+    pairs = dict(match_results(["http://h/old", "http://h/new"], [other, moved]))
+    assert pairs["http://h/old"] is moved
+    assert pairs["http://h/new"] is other
+
+
+def test_spelling_differences_are_matched_after_canonicalize() -> None:
+    got = result("http://H/a/?utm_source=x")
+    assert dict(match_results(["http://h/a"], [got]))["http://h/a"] is got
+
+
+def test_unparseable_urls_match_by_raw_string() -> None:
+    got = result("http://[::1/x")
+    pairs = list(match_results(["http://[::1/x", "http://[::2/y"], [got]))
+    assert pairs == [("http://[::1/x", got), ("http://[::2/y", None)]
@@ -0,0 +1,44 @@
+from pathlib import Path
+
+import pytest
+
+from harvester import local_path
+
+
+def test_plain_url_maps_under_host(tmp_path: Path) -> None:
+    assert local_path(tmp_path, "http://intra.example/docs/a.pdf") == tmp_path / "intra.example" / "docs" / "a.pdf"
+
+
+@pytest.mark.parametrize("url", [
+    "http://intra.example/../../etc/passwd",
+    "http://intra.example/%2e%2e/%2e%2e/etc/passwd",
+    "http://intra.example/%2E%2E/%2e./x.pdf",
+    "http://intra.example/a%2f..%2f..%2f..%2fx.pdf",
+    "http://intra.example/..%5c..%5cx.pdf",
+])
+def test_traversal_stays_under_dest(tmp_path: Path, url: str) -> None:
+    path = local_path(tmp_path, url)
+    assert path.resolve().is_relative_to((tmp_path / "intra.example").resolve())
+
+
+def test_dotdot_host_is_rejected(tmp_path: Path) -> None:
+    with pytest.raises(ValueError):
+        local_path(tmp_path / "files", "http://../x.pdf")
+
+
+@pytest.mark.parametrize("a, b", [
+    ("http://h/a b.pdf", "http://h/a_b.pdf"),
+    ("http://h/a%20b.pdf", "http://h/a_b.pdf"),
+    ("http://h/a.pdf?v=1", "http://h/a.pdf?v=2"),
+    ("http://h/a.pdf?v=1", "http://h/a.pdf"),
+    ("http://h/%2e%2e/x.pdf", "http://h/x.pdf"),
+    ("http://h:8080/x.pdf", "http://h_8080/x.pdf"),
+])
+def test_distinct_urls_do_not_share_a_file(tmp_path: Path, a: str, b: str) -> None:
+    assert local_path(tmp_path, a) != local_path(tmp_path, b)
+
+
+def test_same_url_is_stable(tmp_path: Path) -> None:
+    url = "http://h/a b.pdf?v=1"
+    assert local_path(tmp_path, url) == local_path(tmp_path, url)
+    assert local_path(tmp_path, url).suffix == ".pdf"
@@ -0,0 +1,112 @@
+import asyncio
+import csv
+from pathlib import Path
+
+import pytest
+
+from result_sink import CsvWriter, ResultSink
+
+
+class ListWriter:
+    def __init__(self) -> None:
+        self.rows: list[dict] = []
+        self.synced = 0
+        self.closed = False
+
+    def write_rows(self, rows: list[dict]) -> None:
+        self.rows.extend(rows)
+
+    def sync(self) -> None:
+        self.synced += 1
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class FullDiskWriter(ListWriter):
+    """fail_after 行を超えたら書けなくなる書き先"""
+    def __init__(self, fail_after: int = 0) -> None:
+        super().__init__()
+        self.fail_after = fail_after
+
+    def write_rows(self, rows: list[dict]) -> None:
+        if len(self.rows) + len(rows) > self.fail_after:
+            raise OSError(28, "No space left on device")
+        super().write_rows(rows)
+
+
+def run(coro, timeout: float = 5.0):
+    """書き出しの失敗で待ち続けないことも確かめる"""
+    return asyncio.run(asyncio.wait_for(coro, timeout))
+
+
+def test_rows_are_written_in_order_and_checkpoint_syncs(tmp_path: Path) -> None:
+    out = tmp_path / "out.csv"
+    extra = ListWriter()
+
+    async def main() -> None:
+        async with ResultSink(CsvWriter(out, ["url", "n"]), extra, batch=7) as sink:
+            for n in range(100):
+                await sink.put({"url": f"http://h/{n}", "n": n})
+            await sink.checkpoint()
+            assert len(extra.rows) == 100
+            assert extra.synced == 1
+            await sink.put({"url": "http://h/last", "n": 100})
+
+    run(main())
+    with out.open(newline="", encoding="utf-8") as f:
+        assert [int(r["n"]) for r in csv.DictReader(f)] == list(range(101))
+    assert extra.closed
+
+
+def test_checkpoint_raises_write_error() -> None:
+    async def main() -> None:
+        sink = ResultSink(FullDiskWriter(), batch=10)
+        sink.start()
+        await sink.put({"url": "http://h/1"})
+        with pytest.raises(OSError):
+            await sink.checkpoint()
+        with pytest.raises(OSError):
+            await sink.put({"url": "http://h/2"})
+        with pytest.raises(OSError):
+            await sink.close()
+
+    run(main())
+
+
+def test_put_on_full_queue_does_not_hang_when_writer_fails() -> None:
+    async def main() -> None:
+        sink = ResultSink(FullDiskWriter(fail_after=3), max_queue=2, batch=1)
+        sink.start()
+        with pytest.raises(OSError):
+            for n in range(1000):
+                await sink.put({"url": f"http://h/{n}"})
+        with pytest.raises(OSError):
+            await sink.close()
+
+    run(main())
+
+
+def test_checkpoint_without_wait_reports_on_close() -> None:
+    async def main() -> None:
+        writer = FullDiskWriter()
+        sink = ResultSink(writer)
+        sink.start()
+        await sink.put({"url": "http://h/1"})
+        await sink.checkpoint(wait=False)
+        with pytest.raises(OSError):
+            await sink.close()
+        assert writer.closed
+
+    run(main())
+
+
+def test_put_after_close_is_an_error() -> None:
+    async def main() -> None:
+        sink = ResultSink(ListWriter())
+        sink.start()
+        await sink.close()
+        with pytest.raises(RuntimeError):
+            await sink.put({"url": "http://h/1"})
+
+    run(main())
@@ -1,33 +1,80 @@
 # tutorial_basic_crawl.py
-from typing import List
-import asyncio,csv
-from unittest import result
-from crawl4ai import AsyncWebCrawler, CrawlResult, CrawlerRunConfig
-from crawl4ai.content_filter_strategy import PruningContentFilter
-from crawl4ai.markdown_generation_strategy import DefaultMarkdownGenerator
-
-from pathlib import Path
+import asyncio
+import os
+from contextlib import AsyncExitStack
 from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+# crawl4ai とこのリポジトリのモジュールは使う関数の中で import する
+# (python -m crawl_cli markdown の起動を軽くするため。型だけここで)
+if TYPE_CHECKING:
+    from crawl4ai import CrawlerRunConfig, CrawlResult
+
+    from parse_pool import ParsePool
+    from render_profiles import ProfileRouter
+    from result_sink import ResultSink
 
 
 TS = datetime.now().strftime("%Y%m%d_%H%M%S")
 
-# ---------- csv 出力フォルダ ----------
-OUTPUT_DIR = Path("/app/output") / f"{TS}_crawl_results"
-OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+# ---------- csv 出力フォルダ (作るのは main() の中で。import しただけではファイルを作らない) ----------
+OUTPUT_ROOT = Path(os.getenv("OUTPUT_ROOT", "/app/output"))
+OUTPUT_DIR = OUTPUT_ROOT / f"{TS}_crawl_results"
 CSV_PATH = OUTPUT_DIR / f"{TS}_crawl_output.csv"
 
+# 出力形式: csv / parquet / both (Parquet は OUTPUT_ROOT/parquet/crawl_output/run_ts=…/host=…/ に蓄積)
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "csv")
+CSV_FIELDS = ["url", "success", "markdown_len", "preview100", "error"]
+
+# 結果は 1 つのシンクにまとめて書く (main() の間だけ開く)
+RESULTS: Optional["ResultSink"] = None
+
+# 1 で全文 (HTML / Markdown) を OUTPUT_ROOT/pages のアーカイブへ (CSV には先頭 100 文字だけ)
+# zstandard (archive extra) が要るので intra_crawler と同じく既定は無効
+PAGE_STORE = os.getenv("PAGE_STORE", "0") == "1"
+PAGES: Optional["ResultSink"] = None        # main() の間だけ開く
+
+# ---------- 差分クロール (前回から変わっていない URL はブラウザを使わない) ----------
+INCREMENTAL = os.getenv("INCREMENTAL", "0") == "1"     # intra_crawler と同じく 1 で有効
+RECORDS_DB = OUTPUT_ROOT / "page_records.sqlite"     # 実行をまたいで残す
+
+# ---------- 描画プロファイル (Markdown だけ欲しいので既定は画像・フォント・外部タグを止める text) ----------
+_RENDER: Optional["ProfileRouter"] = None   # 最初に描画する時に作る
+
+
+def render_router() -> "ProfileRouter":
+    global _RENDER
+    if _RENDER is None:
+        from render_profiles import ProfileRouter, parse_profile_paths
+
+        _RENDER = ProfileRouter(os.getenv("RENDER_PROFILE", "text"),
+                                parse_profile_paths(os.getenv("RENDER_PROFILE_PATHS", "")))
+    return _RENDER
 
-def write_csv_header(fieldnames):
-    with CSV_PATH.open("w", newline="", encoding="utf-8") as f:
-        csv.DictWriter(f, fieldnames=fieldnames).writeheader()
 
-def append_row(row: dict):
-    with CSV_PATH.open("a", newline="", encoding="utf-8") as f:
-        csv.DictWriter(f, fieldnames=row.keys()).writerow(row)
+# 1 以上でスクレイピングと Markdown 生成をそのプロセス数のワーカーで行う
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "0"))
+PARSE: Optional["ParsePool"] = None         # main() の間だけ開く (render() のたびにプロセスを作らない)
 
-def log_result(url: str, result: CrawlResult, *, use_fit=False):
-    """CrawlResult を 1 行の dict にして CSV へ追記"""
+# fit_markdown() の枝刈り設定 (ワーカー側でも同じ設定で PruningContentFilter を作る)
+PRUNE = {
+    # Lower → more content retained, higher → more content pruned
+    "threshold": 0.45,
+    # "fixed" or "dynamic"
+    "threshold_type": "dynamic",
+    # Ignore nodes with <5 words
+    "min_word_threshold": 5,
+}
+
+
+async def log_missing(url: str) -> None:
+    """結果が返らなかった URL も失敗行として残す"""
+    await RESULTS.put({"url": url, "success": False, "markdown_len": 0, "preview100": "", "error": "結果なし"})
+
+
+async def log_result(url: str, result: "CrawlResult", *, use_fit=False):
+    """CrawlResult を 1 行の dict にして結果シンクへ渡す"""
     text = (
         result.markdown.fit_markdown if (use_fit and result.success)
         else result.markdown.raw_markdown
@@ -39,19 +86,81 @@ def log_result(url: str, result: CrawlResult, *, use_fit=False):
         "preview100": text[:100] if result.success else "",
         "error": result.error_message or "",
     }
-    append_row(row)
-
-write_csv_header(["url", "success", "markdown_len", "preview100", "error"])
+    await RESULTS.put(row)
+    if PAGES and result.success:
+        await PAGES.put({"url": url, "html": result.html, "markdown": text,
+                         "status_code": result.status_code})
 
 
 # ---------- クロールのメイン処理 ----------
 
+async def render(
+    urls: list[str],
+    config: Optional["CrawlerRunConfig"] = None,
+    prune: dict | None = None,
+) -> list["CrawlResult"]:
+    """プールのブラウザで描画。PARSE_WORKERS があればスクレイピングと Markdown はワーカーで作る"""
+    from crawl4ai import CrawlerRunConfig
+
+    from browser_pool import get_pool
+
+    config = config or CrawlerRunConfig()
+    if PARSE_WORKERS:
+        from parse_pool import PassthroughScrapingStrategy
+
+        config = config.clone(scraping_strategy=PassthroughScrapingStrategy())
+
+    # 描画プロファイルごとに待ち条件を変えて描画し、止めたリクエスト数を metadata に残す
+    results: list[CrawlResult] = []
+    pool = get_pool()
+    router = render_router()
+    for profile, group in router.group(urls).items():
+        tabs = min(len(group), pool.tabs)
+        async with pool.lease(len(group), tabs=tabs) as crawler:
+            results += await crawler.arun_many(
+                urls=group, config=profile.run_config(config), dispatcher=pool.dispatcher(tabs))
+    for r in results:
+        r.metadata = {**(r.metadata or {}), **router.pop_stats(r.url)}
+    if not PARSE_WORKERS:
+        return results
+
+    async def scrape(r: "CrawlResult") -> "CrawlResult":
+        if not r.success:
+            return r
+        return PARSE.apply(r, await PARSE.scrape(r.url, r.html, markdown=True, prune=prune))
+
+    return list(await asyncio.gather(*(scrape(r) for r in results)))
+
+
+async def arun_incremental(
+    urls: list[str],
+    config: Optional["CrawlerRunConfig"] = None,
+    *,
+    variant: str = "default",
+    prune: dict | None = None,
+) -> list["CrawlResult"]:
+    """前回から変わっていない URL は記録を再利用し、変わった URL だけプールのブラウザで描画する"""
+    if not INCREMENTAL:
+        return await render(urls, config, prune)
+    from incremental import IncrementalCache
+
+    async with IncrementalCache(RECORDS_DB, variant=variant, keep_markdown=True) as cache:
+        cached = await asyncio.gather(*(cache.check(u) for u in urls))
+        results = {r.url: r for r in cached if r is not None}
+        fresh = [u for u in urls if u not in results]
+        if fresh:
+            for r in await render(fresh, config, prune):
+                cache.update(r)
+                results[r.url] = r
+    return [results[u] for u in urls if u in results]
+
+
 async def basic_crawl() -> None:
     """1 URL をクロールして Markdown を 100 文字だけ表示"""
-    async with AsyncWebCrawler() as crawler:
-        results: List[CrawlResult] = await crawler.arun(
-            url="https://news.ycombinator.com",
-        )
+    results: list[CrawlResult] = await arun_incremental(["https://news.ycombinator.com"])
+    if not results:
+        print("\nResult: 結果なし")
+        await log_missing("https://news.ycombinator.com")
 
     for i, result in enumerate(results):
         print(f"\nResult {i + 1}:")
@@ -63,7 +172,7 @@ async def basic_crawl() -> None:
         else:
             print(f"Failed → {result.error_message}")
 
-        log_result("https://news.ycombinator.com", result)
+        await log_result("https://news.ycombinator.com", result)
 
 
 async def parallel_crawl() -> None:
@@ -72,22 +181,24 @@ async def parallel_crawl() -> None:
         "https://www.python.org",
         "https://example.com",
     ]
-    async with AsyncWebCrawler() as crawler:
-        results: List[CrawlResult] = await crawler.arun_many(urls=urls)
-    for url, result in zip(urls, results):
+    from batch_crawl import match_results
+
+    results: list[CrawlResult] = await arun_incremental(urls)
+    # 返ってくる順番は urls と同じとは限らないので URL で対応付ける (大量の URL は batch_crawl.py で)
+    for url, result in match_results(urls, results):
+        if result is None:
+            print(f"\n{url}: 結果なし")
+            await log_missing(url)
+            continue
         print(f"\n{url}: {result.success}")
-        log_result(url, result)
+        await log_result(url, result)
 
 async def fit_markdown():
+    from crawl4ai import CrawlerRunConfig
+    from crawl4ai.content_filter_strategy import PruningContentFilter
+    from crawl4ai.markdown_generation_strategy import DefaultMarkdownGenerator
 
-    prune_filter = PruningContentFilter(
-    # Lower → more content retained, higher → more content pruned
-    threshold=0.45,           
-    # "fixed" or "dynamic"
-    threshold_type="dynamic",  
-    # Ignore nodes with <5 words
-    min_word_threshold=5
-    )
+    prune_filter = PruningContentFilter(**PRUNE)
 
     # Step 2: Insert it into a Markdown Generator
     md_generator = DefaultMarkdownGenerator(content_filter=prune_filter)
@@ -97,25 +208,86 @@ async def fit_markdown():
         markdown_generator=md_generator
     )
 
-    async with AsyncWebCrawler() as crawler:
-        result: CrawlResult = await crawler.arun(
-            url="https://news.ycombinator.com",
-            config=config
-            )
+    # fit_markdown は設定が違うので記録も別枠 (variant) で持つ
+    results = await arun_incremental(
+        ["https://news.ycombinator.com"], config, variant="fit", prune=PRUNE)
+    if not results:
+        print("Error: 結果なし")
+        await log_missing("https://news.ycombinator.com")
+        return
+    result = results[0]
+    if result.success:
+        # 'fit_markdown' is your pruned content, focusing on "denser" text
+        print("Raw Markdown length:", len(result.markdown.raw_markdown))
+        print("Fit Markdown length:", len(result.markdown.fit_markdown))
+    else:
+        print("Error:", result.error_message)
 
-        if result.success:
-            # 'fit_markdown' is your pruned content, focusing on "denser" text
-            print("Raw Markdown length:", len(result.markdown.raw_markdown))
-            print("Fit Markdown length:", len(result.markdown.fit_markdown))
-        else:
-            print("Error:", result.error_message)
+        await log_result("https://news.ycombinator.com", result, use_fit=True)
+
+async def extract_markdown(urls: list[str], *, fit: bool = False) -> None:
+    """urls の Markdown を結果シンクへ (fit=True なら PruningContentFilter で枝刈りした fit_markdown)"""
+    from batch_crawl import match_results
+
+    config, prune = None, None
+    if fit:
+        from crawl4ai import CrawlerRunConfig
+        from crawl4ai.content_filter_strategy import PruningContentFilter
+        from crawl4ai.markdown_generation_strategy import DefaultMarkdownGenerator
+
+        prune = PRUNE
+        config = CrawlerRunConfig(markdown_generator=DefaultMarkdownGenerator(
+            content_filter=PruningContentFilter(**PRUNE)))
+    results = await arun_incremental(urls, config, variant="fit" if fit else "default", prune=prune)
+    for url, result in match_results(urls, results):
+        if result is None:
+            print(f"{url}: 結果なし")
+            await log_missing(url)
+            continue
+        print(f"{url}: {'OK' if result.success else 'NG ' + (result.error_message or '')[:80]}")
+        await log_result(url, result, use_fit=fit)
+
+
+async def main(urls: list[str] | None = None, *, fit: bool = False) -> None:
+    """urls があればその Markdown を、無ければ 3 つのサンプルを実行"""
+    global PAGES, PARSE, RESULTS
+    from browser_pool import close_pool, get_pool
+    from result_sink import CsvWriter, ResultSink
+
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    writers = []
+    if OUTPUT_FORMAT in ("csv", "both"):
+        writers.append(CsvWriter(CSV_PATH, CSV_FIELDS))
+    if OUTPUT_FORMAT in ("parquet", "both"):
+        from parquet_sink import ParquetStream
+
+        writers.append(ParquetStream(OUTPUT_ROOT / "parquet", "crawl_output", TS))
+    RESULTS = ResultSink(*writers)
+    try:
+        if PAGE_STORE:
+            from page_store import PageStore
 
-            log_result("https://news.ycombinator.com", result, use_fit=True)
+            PAGES = ResultSink(PageStore(OUTPUT_ROOT / "pages"), max_queue=256, batch=64)
+        # 3 つの処理で同じブラウザを使い回す (起動は 1 回だけ)
+        await get_pool(hooks={"before_goto": render_router().before_goto}).warmup()
+        async with AsyncExitStack() as stack:
+            await stack.enter_async_context(RESULTS)
+            if PAGES:
+                await stack.enter_async_context(PAGES)
+            if PARSE_WORKERS:
+                from parse_pool import ParsePool
 
-async def main() -> None:
-    await basic_crawl()
-    await parallel_crawl()
-    await fit_markdown()
+                PARSE = await stack.enter_async_context(ParsePool(PARSE_WORKERS))
+            if urls:
+                await extract_markdown(urls, fit=fit)
+            else:
+                await basic_crawl()
+                await parallel_crawl()
+                await fit_markdown()
+        for name, pages, _avg_ms, blocked, blocked_bytes, _saved in render_router().summary():
+            print(f"描画 {name}: {pages} ページ / 止めたリクエスト {blocked}（推定 {blocked_bytes / 1e6:.1f} MB）")
+    finally:
+        await close_pool()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,176 @@
+"""
+url_index.py
+URL の正規化と、省メモリな既訪問集合。
+- canonicalize() … スキーム/ホストの小文字化、既定ポート・フラグメント・追跡用クエリの除去、
+                    クエリのソート、ドットセグメント解決、末尾スラッシュの統一
+                    (http/https 以外はフラグメントを落とすだけ。解釈できない URL は None)
+- url_key()      … http/https の違いも無視した重複判定用キー
+- SeenSet        … キーの 64bit ハッシュだけを array('Q') のオープンアドレス表に保持
+                    (100 万 URL で約 16MB)。任意で Bloom フィルタを前段に置ける
+"""
+
+import hashlib
+import math
+import posixpath
+from array import array
+from urllib.parse import unquote_plus, urljoin, urlsplit, urlunsplit
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+TRACKING_PARAMS = {
+    "utm_source", "utm_medium", "utm_campaign", "utm_term", "utm_content",
+    "gclid", "fbclid", "msclkid", "mc_cid", "mc_eid", "_ga",
+}
+
+
+def canonicalize(url: str, base: str | None = None) -> str | None:
+    """取得に使える形のまま表記ゆれを取り除いた URL を返す。
+    ポートが数字でない・IPv6 の括弧が閉じていないなど、解釈できない URL は None (ページ内の壊れたリンクでクロールを止めない)"""
+    try:
+        if base:
+            url = urljoin(base, url.strip())
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return None
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS:
+        # mailto: / tel: / javascript: などはパスの形が違うので触らない
+        return urlunsplit((scheme, parts.netloc, parts.path, parts.query, ""))
+    host = (parts.hostname or "").lower().rstrip(".")
+    netloc = f"[{host}]" if ":" in host else host      # IPv6 は括弧を戻す
+    if port and port != DEFAULT_PORTS[scheme]:
+        netloc = f"{netloc}:{port}"
+    userinfo, at, _ = parts.netloc.rpartition("@")
+    if at:                                              # user:password@ はそのまま残す
+        netloc = f"{userinfo}@{netloc}"
+
+    path = parts.path or "/"
+    if "." in path or "//" in path:
+        path = "/" + posixpath.normpath(path).lstrip("/")
+    if len(path) > 1:
+        path = path.rstrip("/")
+
+    return urlunsplit((scheme, netloc, path, _canonical_query(parts.query), ""))
+
+
+def _canonical_query(query: str) -> str:
+    """追跡用の項目を除いてソート。値はデコードし直さない (%2F と / を区別するサーバがあるので)。
+    値の無い `?flag` も `flag=` にせずそのまま残す"""
+    items = []
+    for item in query.split("&"):
+        if item and unquote_plus(item.partition("=")[0]).lower() not in TRACKING_PARAMS:
+            items.append(item)
+    return "&".join(sorted(items, key=lambda item: item.partition("=")[::2]))
+
+
+def url_key(url: str) -> str:
+    """http / https を同一視した重複判定用のキー (canonicalize 済みの URL を渡す)"""
+    return url.split("://", 1)[-1]
+
+
+def fingerprint(url: str) -> int:
+    """url_key の 64bit ハッシュ (0 は空きスロット用に避ける)"""
+    fp = int.from_bytes(hashlib.blake2b(url_key(url).encode(), digest_size=8).digest(), "little")
+    return fp or 1
+
+
+class FingerprintSet:
+    """64bit 指紋を array('Q') に線形探査で詰めるハッシュ集合 (負荷率 0.7 で倍に拡張)"""
+    def __init__(self, capacity: int = 1 << 16) -> None:
+        size = 1 << max(4, (capacity - 1).bit_length())
+        self._slots = array("Q", bytes(8 * size))
+        self._mask = size - 1
+        self._n = 0
+
+    def __len__(self) -> int:
+        return self._n
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._slots) * self._slots.itemsize
+
+    def _find(self, fp: int) -> int:
+        slots, mask = self._slots, self._mask
+        i = fp & mask
+        while slots[i] and slots[i] != fp:
+            i = (i + 1) & mask
+        return i
+
+    def __contains__(self, fp: int) -> bool:
+        return self._slots[self._find(fp)] == fp
+
+    def add(self, fp: int) -> bool:
+        """新規なら追加して True"""
+        i = self._find(fp)
+        if self._slots[i] == fp:
+            return False
+        self._slots[i] = fp
+        self._n += 1
+        if self._n * 10 > len(self._slots) * 7:
+            self._grow()
+        return True
+
+    def _grow(self) -> None:
+        old = self._slots
+        self._slots = array("Q", bytes(16 * len(old)))
+        self._mask = len(self._slots) - 1
+        for fp in old:
+            if fp:
+                self._slots[self._find(fp)] = fp
+
+
+class BloomFilter:
+    """ビット配列 + 二重ハッシュ。capacity 件で誤検出率 error_rate 程度"""
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 1e-3) -> None:
+        self.m = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.k = max(1, round(self.m / capacity * math.log(2)))
+        self._bits = bytearray((self.m + 7) // 8)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._bits)
+
+    def _positions(self, fp: int):
+        h1, h2 = fp & 0xFFFFFFFF, (fp >> 32) | 1
+        return [(h1 + i * h2) % self.m for i in range(self.k)]
+
+    def __contains__(self, fp: int) -> bool:
+        bits = self._bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(fp))
+
+    def add(self, fp: int) -> bool:
+        """どれかのビットが新たに立てば True (= 確実に未登録だった)"""
+        new = False
+        for p in self._positions(fp):
+            byte, bit = p >> 3, 1 << (p & 7)
+            if not self._bits[byte] & bit:
+                self._bits[byte] |= bit
+                new = True
+        return new
+
+
+class SeenSet:
+    """正規化済み URL の既訪問集合。bloom_capacity > 0 で Bloom フィルタを前段に置く
+    (Bloom が「未登録」と言えば指紋表の探索を省略。最終判定は常に指紋表で行う)"""
+    def __init__(self, capacity: int = 1 << 16, bloom_capacity: int = 0) -> None:
+        self.fingerprints = FingerprintSet(capacity)
+        self.bloom = BloomFilter(bloom_capacity) if bloom_capacity > 0 else None
+
+    def __len__(self) -> int:
+        return len(self.fingerprints)
+
+    @property
+    def nbytes(self) -> int:
+        return self.fingerprints.nbytes + (self.bloom.nbytes if self.bloom else 0)
+
+    def __contains__(self, url: str) -> bool:
+        fp = fingerprint(url)
+        if self.bloom is not None and fp not in self.bloom:
+            return False
+        return fp in self.fingerprints
+
+    def add(self, url: str) -> bool:
+        fp = fingerprint(url)
+        if self.bloom is not None:
+            self.bloom.add(fp)
+        return self.fingerprints.add(fp)
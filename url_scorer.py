@@ -0,0 +1,131 @@
+"""
+url_scorer.py
+best-first クロールで frontier の優先度を決めるスコアラー。
+各スコアラーはリンク 1 本 (LinkContext) に 0〜1 程度の値を返し、CompositeScorer が重み付きで合計する。
+合計の内訳のうち寄与の大きいものを reason (発見理由) として残す。
+- path    … パス接頭辞ごとの重み (SCORE_PATHS="/docs/=2,/old/=-1")
+- attach  … 添付ファイルへのリンクそのもの、または添付リンクの多いページからのリンク
+- fresh   … 前回の実行で見ていない URL / 前回から時間が経った URL
+- keyword … URL・アンカーテキストにキーワードを含む
+- depth   … 浅いほど高い (同点の並びを BFS に近づける)
+
+    scorer = CompositeScorer([(PathPrefixScorer({"/docs/": 2.0}), 1.0), (DepthScorer(), 0.5)])
+    score, reason = scorer.score(LinkContext(url, parent, depth=2, anchor="規程集", file_density=0.3))
+"""
+
+import os
+import sqlite3
+import time
+from collections.abc import Iterable
+from pathlib import Path
+from typing import NamedTuple
+from urllib.parse import unquote, urlsplit
+
+
+class LinkContext(NamedTuple):
+    url: str
+    parent: str | None
+    depth: int
+    anchor: str = ""
+    file_density: float = 0.0       # 親ページのリンクのうち添付ファイルを指す割合
+
+
+class PathPrefixScorer:
+    name = "path"
+
+    def __init__(self, weights: dict[str, float]) -> None:
+        # 長い接頭辞から照合する
+        self.weights = sorted(weights.items(), key=lambda kv: len(kv[0]), reverse=True)
+
+    def score(self, ctx: LinkContext) -> float:
+        path = urlsplit(ctx.url).path or "/"
+        for prefix, weight in self.weights:
+            if path.startswith(prefix):
+                return weight
+        return 0.0
+
+
+class AttachmentScorer:
+    name = "attach"
+
+    def __init__(self, file_exts: Iterable[str]) -> None:
+        self.file_exts = set(file_exts)
+
+    def score(self, ctx: LinkContext) -> float:
+        if os.path.splitext(urlsplit(ctx.url).path)[1].lower() in self.file_exts:
+            return 1.0
+        return ctx.file_density
+
+
+class FreshnessScorer:
+    """previous: URL → 前回確認した時刻 (epoch 秒)。前回無かった URL は 1、確認直後は 0 に近い"""
+    name = "fresh"
+
+    def __init__(self, previous: dict[str, float], half_life_days: float = 7.0) -> None:
+        self.previous = previous
+        self.half_life = half_life_days * 86400
+        self.now = time.time()
+
+    @classmethod
+    def from_records(cls, path: Path, half_life_days: float = 7.0) -> "FreshnessScorer":
+        """IncrementalCache の記録 (page_records.sqlite) から前回の確認時刻を読む"""
+        previous: dict[str, float] = {}
+        if path.exists():
+            db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            try:
+                previous = dict(db.execute("SELECT url, max(checked_at) FROM pages GROUP BY url"))
+            finally:
+                db.close()
+        return cls(previous, half_life_days)
+
+    def score(self, ctx: LinkContext) -> float:
+        checked = self.previous.get(ctx.url)
+        if checked is None:
+            return 1.0
+        return 1.0 - 0.5 ** (max(0.0, self.now - checked) / self.half_life)
+
+
+class KeywordScorer:
+    name = "keyword"
+
+    def __init__(self, keywords: Iterable[str]) -> None:
+        self.keywords = [k.lower() for k in keywords if k]
+
+    def score(self, ctx: LinkContext) -> float:
+        if not self.keywords:
+            return 0.0
+        text = f"{unquote(urlsplit(ctx.url).path)} {ctx.anchor}".lower()
+        return min(1.0, sum(k in text for k in self.keywords) / min(len(self.keywords), 2))
+
+
+class DepthScorer:
+    name = "depth"
+
+    def score(self, ctx: LinkContext) -> float:
+        return 1.0 / (1 + ctx.depth)
+
+
+class CompositeScorer:
+    """(スコアラー, 重み) の組を合計。reason は寄与の大きい順に上位 3 件"""
+    def __init__(self, parts: list[tuple[object, float]]) -> None:
+        self.parts = [(s, w) for s, w in parts if w]
+
+    def score(self, ctx: LinkContext) -> tuple[float, str]:
+        total, reasons = 0.0, []
+        for scorer, weight in self.parts:
+            value = weight * scorer.score(ctx)
+            total += value
+            if value:
+                reasons.append((abs(value), f"{scorer.name}{value:+.2f}"))
+        reasons.sort(reverse=True)
+        return round(total, 4), " ".join(r for _, r in reasons[:3])
+
+
+def parse_weights(spec: str) -> dict[str, float]:
+    """"/docs/=2,/old/=-1" → {"/docs/": 2.0, "/old/": -1.0}"""
+    weights = {}
+    for part in spec.split(","):
+        key, sep, value = part.strip().rpartition("=")
+        if sep and key:
+            weights[key.strip()] = float(value)
+    return weights